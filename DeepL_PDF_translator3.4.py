@@ -1,14 +1,23 @@
-import time
 import os
-import pdfplumber
+import argparse
+import functools
 import re
-import pandas as pd
-import requests
-import deepl
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+import threading
+from deepl_client import batch_sentences
+from concurrency import RateLimiter, map_ordered
+from engines import EngineRouter, DeepLSdkEngine, GeminiEngine, NoEngineAvailable, EngineLog, engine_retry_policy
+from pdf_extraction import extract_pages_parallel, iter_pages, count_pages, add_extraction_arguments
+from pdf_extraction import EXTRACTOR_PDFPLUMBER, EXTRACTOR_PYPDF2, EXTRACTOR_AUTO
+from streaming import prefetch, clean_stream, translate_stream, translate_stream_multi, fan_out, windows
+from segmenter import Segmenter, PageIndex, RULE_PUNCTUATION
+from pdf_rendering import build_streaming, render_parallel, render_chunk_rows
+from translation_memory import get_shared_memory, ENGINE_DEEPL_SDK, ENGINE_GEMINI
+from checkpoint import TranslationJournal, journal_path_for
+from segment_store import SegmentStore
+from dedup import Deduplicator
+from metrics import metrics, add_metrics_arguments, start_run, finish_run
+from job_queue import JobQueue, add_batch_arguments, run_local_workers, report_queue
+from service import serve, add_service_arguments, job_input_path, job_flag, job_limit
 
 # Configuration
 page_limit = 151  # Number of pages to read from the PDF
@@ -17,21 +26,53 @@ output_pdf = 'OutputPDFs/output.pdf'  # Output PDF file
 pdf_dir = 'SourcePDFs'  # Directory containing PDF files
 margin = 30
 cell_padding = 4
-request_cooldown_sec = 1
+max_workers = 8  # Number of DeepL requests kept in flight
+requests_per_sec = 5  # Shared rate limit across all workers
+chars_per_sec = None  # Optional character rate limit; None disables it
 source_language = "EN"
 target_language = "DA"
 target_lan_fist_col = True
+target_languages = None  # Several target languages from one extraction, e.g. ["DA", "DE", "FR"]; None uses target_language
+multi_column = False  # With several target languages: one PDF with a column per language instead of one PDF per language
+deepl_server_url = None  # None uses DeepL's servers; set to a local mock server URL for testing
+batch_mode = True  # Pack many sentences into each DeepL request
+translation_memory_path = 'translation_memory.sqlite3'  # Set to None to disable the translation memory
+pdf_extractor = EXTRACTOR_PDFPLUMBER  # EXTRACTOR_PDFPLUMBER, EXTRACTOR_PYPDF2 or EXTRACTOR_AUTO (samples pages, picks the fastest good one)
+parallel_extraction = True  # Extract page ranges in a process pool
+extraction_processes = None  # None uses every CPU core
+page_cache_path = 'page_cache.sqlite3'  # Cache of extracted page text; set to None to extract every run
+streaming = True  # Extract, translate and render page by page instead of holding the whole book
+deduplicate = True  # Send repeated segments (headers, footers, stock phrases) to DeepL only once
+parallel_rendering = False  # Render table parts in worker processes and merge them; faster on long books, but each part starts a new page
+render_processes = None  # None uses every CPU core
+render_cache_dir = None  # e.g. 'RenderCache': keep rendered table parts by content, so a re-run lays out only the parts whose rows changed (each part starts a new page)
+engines = [ENGINE_DEEPL_SDK]  # Engines to spread the work over; add ENGINE_GEMINI to fail over to Gemini when DeepL throttles or runs out of quota
+genai_api_key = '...'  # Replace with your Gemini API key; only used when ENGINE_GEMINI is in engines
+gemini_model = None  # Gemini model object; created from genai_api_key on first use when left as None
 
-# Function to list available PDF files and ask user to select one
-def select_pdf_file():
+translator = None  # DeepL client, created on first use and shared by every window and target language
+limiter = None  # Rate limiter shared the same way, so the limits hold across languages translated in parallel
+retry = None  # Retry policy shared the same way, so throttling slows down every language at once
+router = None  # Engine router shared the same way, so its latency, error and quota figures hold across windows
+client_lock = threading.Lock()
+
+# Function to list available PDF files
+def list_pdf_files():
     pdf_files = [f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')]
     if not pdf_files:
         print("No PDF files found in the 'pdfBooks' directory.")
-        return None
+        return pdf_files
 
     print("Available PDF files:")
     for idx, pdf_file in enumerate(pdf_files, start=1):
         print(f"{idx}. {pdf_file}")
+    return pdf_files
+
+# Function to list available PDF files and ask user to select one
+def select_pdf_file():
+    pdf_files = list_pdf_files()
+    if not pdf_files:
+        return None
 
     try:
         choice = int(input("Select the PDF file by number: ")) - 1
@@ -44,129 +85,456 @@ def select_pdf_file():
         print("Invalid input. Please enter a number.")
         return None
 
-# Function to extract text from a PDF file with page limit and add page markers
+# Page marker written after each page's text; the segmenter lifts it out again before translation
+page_marker_pattern = r'\| - - - - (\d+) - - - - \|'
+
+def format_page_marker(page):
+    return f"| - - - - {page} - - - - |"
+
+# Function to add the page marker after the text of page page_num (counted from 0)
+def mark_page(page_num, page_text):
+    return page_text + "\n" + f" {format_page_marker(page_num + 1)} "
+
+# Function to extract text from a PDF file with page limit and add page markers;
+# page ranges are extracted in a process pool with parallel_extraction
 def extract_text_from_pdf(pdf_path):
-    text = ""
-    global page_num
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                if page_num >= page_limit:
-                    break
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-                    text += f" | - - - - {page_num + 1} - - - - | "
-                    print("Processing page: ", page_num+1)
-        return text.strip()
+        processes = extraction_processes if parallel_extraction else 1
+        page_texts = extract_pages_parallel(pdf_path, page_limit, pdf_extractor, processes, page_cache_path)
     except Exception as e:
         print(f"Error reading PDF file: {e}")
         return ""
 
+    parts = []
+    for page_num, page_text in enumerate(page_texts):
+        if page_text:
+            parts.append(page_text + "\n")
+            parts.append(f" {format_page_marker(page_num + 1)} ")
+    print("Processed pages: ", len(page_texts))
+    return "".join(parts).strip()
+
+# Function to extract pages lazily, with the same page markers as extract_text_from_pdf
+def iter_marked_pages(pdf_path, limit=None):
+    for page_num, page_text in iter_pages(pdf_path, limit or page_limit, pdf_extractor, extraction_processes, page_cache_path):
+        if page_text:
+            metrics.progress(f"Processing page: {page_num + 1}")
+            yield mark_page(page_num, page_text)
+
 # Function to clean and process text
 def clean_text(text):
     text = re.sub(r'\s+', ' ', text)
     text = text.replace('\f', ';;;;')
     return text
 
-# Function to split text into sentences with custom rules
-def split_sentences(text):
+# Function to split text into sentences with custom rules; page breaks go to page_index
+def split_sentences(text, page_index=None):
     print("Splitting sentences...")
-    sentences = re.split(r'(?<=[.!?]) +', text)
-    processed_sentences = []
+    return list(split_sentences_stream([text], page_index))
 
-    for sentence in sentences:
-        if processed_sentences and len(sentence) < 6:
-            processed_sentences[-1] += " " + sentence
-        else:
-            processed_sentences.append(sentence)
-
-    return processed_sentences
-
-# Function to create a pandas DataFrame from text with an additional numbering column
-def create_dataframe_from_text(text):
-    print("Creating dataframe from text...")
-    sentences = split_sentences(text)
-    df = pd.DataFrame({
-        'No.': range(1, len(sentences) + 1),
-        'Sentence': sentences,
-        'Translation': [''] * len(sentences)
-    })
-    return df
-
-# Function to translate sentences using DeepL with error handling
-def translate_sentences(sentences, auth_key, source_language, target_language, request_cooldown_sec=0.1):
-    translator = deepl.Translator(auth_key)
-    translations = []
-    
-    for count, sentence in enumerate(sentences, start=1):
-        print(f"Translating sentence: {count}")
-        try:
-            result = translator.translate_text(sentence, source_lang=source_language, target_lang=target_language)
-            translations.append(result.text)
-        except deepl.DeepLException as e:
-            print(f"DeepL API error: {e}")
-            translations.append("[Translation Error]")
-        
-        time.sleep(request_cooldown_sec)
-    
+# Function to split a stream of cleaned text chunks into sentences with the same rules
+def split_sentences_stream(chunks, page_index=None):
+    return Segmenter(RULE_PUNCTUATION, page_marker_pattern, page_index=page_index).segment(chunks)
+
+# Function to create the numbered segment store from text
+def create_segments_from_text(text):
+    print("Creating segments from text...")
+    page_index = PageIndex()
+    sentences = split_sentences(text, page_index)
+    return SegmentStore(sentences, page_index=page_index)
+
+# Function to translate sentences, reusing earlier translations from the translation memory.
+# The engine of every translation is recorded in engine_log.
+def translate_sentences(sentences, auth_key, source_language, target_language, engine_log=None):
+    if not translation_memory_path:
+        translations, sentence_engines = translate_with_engines(sentences, auth_key, source_language, target_language)
+    else:
+        memory = get_shared_memory(ENGINE_DEEPL_SDK, source_language, target_language, path=translation_memory_path)
+        translations, sentence_engines = memory.translate_routed(
+            sentences, engines, lambda missing: translate_with_engines(missing, auth_key, source_language, target_language))
+    if engine_log:
+        engine_log.record(sentences, sentence_engines)
     return translations
 
+# Function to return the shared DeepL client, rate limiter and retry policy; reusing the client keeps its connections alive
+def get_client(auth_key):
+    global translator, limiter, retry
+    with client_lock:
+        if translator is None:
+            import deepl
+            deepl.http_client.max_network_retries = 0  # Retries go through the shared retry policy instead
+            translator = deepl.Translator(auth_key, server_url=deepl_server_url)
+            limiter = RateLimiter(requests_per_sec, chars_per_sec)
+            retry = engine_retry_policy(ENGINE_DEEPL_SDK, max_workers, len(engines))
+    return translator, limiter, retry
 
-# Function to generate a printable PDF from the DataFrame
-def generate_pdf(df, output_pdf):
-    print("Generating pdf...")
-    pdf = SimpleDocTemplate(output_pdf, pagesize=A4, rightMargin=margin, leftMargin=margin, topMargin=margin, bottomMargin=margin)
-    styles = getSampleStyleSheet()
-    elements = []
-
-    # Define table data and style
-    if target_lan_fist_col:
-        table_data = [['No.', 'Translation', 'Sentence']]
-        for _, row in df.iterrows():
-            number = row['No.']
-            sentence = Paragraph(row['Sentence'], styles['Normal'])
-            translation = Paragraph(row['Translation'], styles['Normal'])
-            
-            table_data.append([number, translation, sentence])
+# Function to return the shared engine router over the configured engines
+def get_router(auth_key):
+    global router, gemini_model
+    translator, _, retry = get_client(auth_key)
+    with client_lock:
+        if router is None:
+            routed = []
+            for name in engines:
+                if name == ENGINE_DEEPL_SDK:
+                    routed.append(DeepLSdkEngine(translator, retry))
+                elif name == ENGINE_GEMINI:
+                    if gemini_model is None:
+                        import google.generativeai as genai
+                        genai.configure(api_key=genai_api_key)
+                        gemini_model = genai.GenerativeModel(ENGINE_GEMINI)
+                    routed.append(GeminiEngine(gemini_model, engine_retry_policy(ENGINE_GEMINI, max_workers, len(engines))))
+                else:
+                    raise ValueError(f"Unknown engine: {name}")
+            router = EngineRouter(routed)
+    return router
+
+# Function to translate sentences on the configured engines with error handling.
+# Returns (translations, engines) with the engine that produced each translation.
+def translate_with_engines(sentences, auth_key, source_language, target_language):
+    _, limiter, _ = get_client(auth_key)
+    router = get_router(auth_key)
+    sentences = list(sentences)
+    if batch_mode:
+        batches = list(batch_sentences(sentences))
     else:
-        table_data = [['No.', 'Sentence', 'Translation']]
-        for _, row in df.iterrows():
-            number = row['No.']
-            sentence = Paragraph(row['Sentence'], styles['Normal'])
-            translation = Paragraph(row['Translation'], styles['Normal'])
-            
-            table_data.append([number, sentence, translation])
-
-    table = Table(table_data, colWidths=[30, 250, 250])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        batches = [(idx, idx + 1) for idx in range(len(sentences))]
+    quota_exceeded = threading.Event()
+
+    # Every batch returns one translation or error row per sentence, so rows stay aligned whatever fails
+    def translate_batch(batch_range):
+        start, end = batch_range
+        batch = sentences[start:end]
+        if quota_exceeded.is_set():
+            return ["[Translation Error: Quota exceeded]"] * len(batch), [None] * len(batch)
+        metrics.progress(f"Translating sentences: {start + 1}-{end} of {len(sentences)}")  # Throttled; per-sentence output slowed large jobs
+        try:
+            # Throttling and server errors are retried by the engine's policy,
+            # and the router moves the batch to another engine when one keeps failing
+            return router.translate(batch, source_language, target_language)
+        except NoEngineAvailable:
+            print("The character quota of every engine is used up. Please check your plans or try again later.")
+            metrics.count('quota_exceeded')
+            quota_exceeded.set()
+            return ["[Translation Error: Quota exceeded]"] * len(batch), [None] * len(batch)
+        except Exception as e:
+            print(f"Translation error: {type(e).__name__}: {e}")
+            return ["[Translation Error]"] * len(batch), [None] * len(batch)
+
+    def batch_chars(batch_range):
+        return sum(len(sentence) for sentence in sentences[batch_range[0]:batch_range[1]])
+
+    translations = []
+    sentence_engines = []
+    for batch_translations, batch_engines in map_ordered(translate_batch, batches, max_workers, limiter, cost=batch_chars):
+        translations.extend(batch_translations)
+        sentence_engines.extend(batch_engines)
+    return translations, sentence_engines
+
+
+# Function to build one table from (number, sentence, translation) rows.
+# With languages, each translation is a tuple with one text per language, shown in a column each.
+# target_first overrides target_lan_fist_col.
+def build_table(rows, styles, header=True, languages=None, target_first=None):
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle, Paragraph
+
+    target_first = target_lan_fist_col if target_first is None else target_first
+    translation_headers = list(languages) if languages else ['Translation']
+    table_data = []
+    if header:
+        table_data.append(['No.'] + translation_headers + ['Sentence'] if target_first else ['No.', 'Sentence'] + translation_headers)
+    for number, sentence, translation in rows:
+        sentence = Paragraph(sentence, styles['Normal'])
+        translations = [Paragraph(text, styles['Normal']) for text in (translation if languages else [translation])]
+        if target_first:
+            table_data.append([number] + translations + [sentence])
+        else:
+            table_data.append([number, sentence] + translations)
+
+    first_body_row = 1 if header else 0
+    table_style = [
         ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
         ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('BACKGROUND', (0, first_body_row), (-1, -1), colors.white),
         ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
         ('LEFTPADDING', (0, 0), (-1, -1), cell_padding),
         ('RIGHTPADDING', (0, 0), (-1, -1), cell_padding),
         ('TOPPADDING', (0, 0), (-1, -1), cell_padding),
         ('BOTTOMPADDING', (0, 0), (-1, -1), cell_padding)
-    ]))
+    ]
+    if header:
+        table_style += [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ]
+    text_width = 500 / (len(translation_headers) + 1)
+    table = Table(table_data, colWidths=[30] + [text_width] * (len(translation_headers) + 1))
+    table.setStyle(TableStyle(table_style))
+    return table
+
+# Function to generate a printable PDF from the segment store
+def generate_pdf(segments, output_pdf):
+    generate_pdf_streaming(segments.marked_rows(format_page_marker), output_pdf)
+
+# Function to render rows into one PDF, one table chunk at a time; runs inside a worker
+# process when rendering in parallel. Only the very first chunk carries the header.
+def render_pdf_part(part_path, rows, first_row=0, languages=None, target_first=None):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate
+
+    pdf = SimpleDocTemplate(part_path, pagesize=A4, rightMargin=margin, leftMargin=margin, topMargin=margin, bottomMargin=margin)
+    styles = getSampleStyleSheet()
+    tables = (
+        build_table(chunk, styles, header=(first_row == 0 and idx == 0), languages=languages, target_first=target_first)
+        for idx, chunk in enumerate(windows(rows, render_chunk_rows))
+    )
+    build_streaming(pdf, tables)
+
+# Function to generate the PDF from a stream of (number, sentence, translation) rows;
+# languages renders multi-language rows with a column per language
+def generate_pdf_streaming(rows, output_pdf, languages=None, target_first=None):
+    print("Generating pdf...")
+    if render_cache_dir or (parallel_rendering and (render_processes or os.cpu_count() or 1) > 1):
+        render_parallel(rows, render_pdf_part, output_pdf, max_processes=render_processes if parallel_rendering else 1,
+                        part_args=(languages, target_first), cache_dir=render_cache_dir)
+    else:
+        render_pdf_part(output_pdf, rows, 0, languages, target_first)
+
+# Function to derive the output PDF of one language when translating into several ("output.da.pdf")
+def output_path_for(output_pdf, language):
+    root, extension = os.path.splitext(output_pdf)
+    return f"{root}.{language.lower()}{extension}"
+
+# Function to render multi-language rows: one table with a column per language, or one PDF per language
+# rendered side by side from the same row stream. one_pdf and target_first override multi_column and target_lan_fist_col.
+def generate_pdfs_multi(rows, languages, output_pdf, one_pdf=None, target_first=None):
+    one_pdf = multi_column if one_pdf is None else one_pdf
+    if one_pdf:
+        generate_pdf_streaming(rows, output_pdf, languages, target_first)
+        print("PDF document has been created:", output_pdf)
+        return
+
+    def render_language(idx, language, language_rows):
+        generate_pdf_streaming(((number, sentence, translations[idx]) for number, sentence, translations in language_rows),
+                               output_path_for(output_pdf, language), target_first=target_first)
+
+    fan_out(rows, [functools.partial(render_language, idx, language) for idx, language in enumerate(languages)])
+    for language in languages:
+        print("PDF document has been created:", output_path_for(output_pdf, language))
+
+# Function to translate one window of sentences with the configured key and languages
+def translate_window(sentences, language=None, source=None, engine_log=None):
+    return translate_sentences(sentences, auth_key=deepL_api_key, source_language=source or source_language,
+                               target_language=language or target_language, engine_log=engine_log)
+
+# Function to clean, split and translate a stream of marked page texts.
+# Yields (number, sentence, translation) rows with the page markers put back into the source text.
+# With output_pdf, the engine of every row is written next to it as rows come out.
+def translate_pages(pages, journal=None, source=None, language=None, output_pdf=None):
+    page_index = PageIndex()
+    sentences = split_sentences_stream(clean_stream(pages), page_index)
+    engine_log = EngineLog() if output_pdf else None
+    timed_window = metrics.timed('translation', functools.partial(translate_window, language=language, source=source,
+                                                                  engine_log=engine_log))
+    dedup = Deduplicator() if deduplicate else None
+    rows = translate_stream(sentences, dedup.wrap(timed_window) if dedup else timed_window, journal=journal)
+    if engine_log:
+        rows = engine_log.track(rows, output_pdf)
+    yield from page_index.mark_rows(rows, format_page_marker)
+    if dedup:
+        dedup.report()
 
-    elements.append(table)
-    pdf.build(elements)
+# Function to clean, split and translate a stream of marked page texts into several languages at once.
+# Yields (number, sentence, translations) rows with one translation per language; the languages share
+# the DeepL client and rate limiter, and each has its own deduplicator and journal.
+def translate_pages_multi(pages, languages, journals=None, source=None):
+    page_index = PageIndex()
+    sentences = split_sentences_stream(clean_stream(pages), page_index)
+    dedups = [Deduplicator() if deduplicate else None for _ in languages]
+    translate_windows = []
+    for language, dedup in zip(languages, dedups):
+        timed_window = metrics.timed('translation', functools.partial(translate_window, language=language, source=source))
+        translate_windows.append(dedup.wrap(timed_window) if dedup else timed_window)
+    rows = translate_stream_multi(sentences, translate_windows, journals=journals)
+    yield from page_index.mark_rows(rows, format_page_marker)
+    for language, dedup in zip(languages, dedups):
+        if dedup:
+            print(f"{language}: ", end='')
+            dedup.report()
+
+# Function to run extraction, cleaning, splitting, translation and rendering as one stream
+def run_streaming_pipeline(pdf_path, output_pdf, journal=None):
+    # Stages overlap while streaming: extraction and translation are timed on their own, "pipeline" end to end
+    pages = prefetch(metrics.timed_iter('extraction', iter_marked_pages(pdf_path)))
+    rows = translate_pages(pages, journal, output_pdf=output_pdf)
+    with metrics.stage('pipeline'):
+        generate_pdf_streaming(prefetch(rows), output_pdf)
+
+# Function to extract and segment the book once and translate and render it into several languages.
+# Always streams; the "translation" stage adds up the time of every language.
+def run_multi_language_pipeline(pdf_path, output_pdf, languages, journals=None):
+    pages = prefetch(metrics.timed_iter('extraction', iter_marked_pages(pdf_path)))
+    rows = translate_pages_multi(pages, languages, journals)
+    with metrics.stage('pipeline'):
+        generate_pdfs_multi(prefetch(rows), languages, output_pdf)
+
+# Function to translate one batch shard (a page range of one book) into (sentence, translation) rows
+def translate_shard(shard):
+    pages = iter_pages(shard['input_path'], shard['last_page'], pdf_extractor, 1, page_cache_path, shard['first_page'])
+    marked_pages = (mark_page(page_num, page_text) for page_num, page_text in pages if page_text)
+    return [(sentence, translation) for _, sentence, translation in translate_pages(marked_pages)]
+
+# Function to render a batch book once all its shards are translated
+def render_book(book, rows):
+    os.makedirs(os.path.dirname(book['output_pdf']) or '.', exist_ok=True)
+    generate_pdf_streaming(rows, book['output_pdf'])
+
+# Function to split the rate limits between the local worker processes, so together they stay within them
+def share_rate_limits(worker_count):
+    global requests_per_sec, chars_per_sec
+    if requests_per_sec:
+        requests_per_sec /= worker_count
+    if chars_per_sec:
+        chars_per_sec /= worker_count
+
+# Function to queue every PDF in the source directory as shards and work through the queue
+def run_batch(args):
+    if not args.worker:
+        queue = JobQueue(args.queue)
+        for pdf_file in sorted(f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')):
+            pdf_path = os.path.join(pdf_dir, pdf_file)
+            book_output = os.path.join(os.path.dirname(output_pdf), f"{os.path.splitext(pdf_file)[0]}.{target_language.lower()}.pdf")
+            if queue.add_book(pdf_path, book_output, min(count_pages(pdf_path, pdf_extractor), page_limit)) is not None:
+                print(f"Queued {pdf_path} -> {book_output}")
+        queue.close()
+    run_local_workers(args.queue, args.workers, translate_shard, render_book, functools.partial(share_rate_limits, args.workers))
+    report_queue(args.queue)
+
+# Function to create the DeepL client and load the PDF libraries before the first service job
+def warm_up():
+    get_client(deepL_api_key)
+    import pdfplumber, reportlab.platypus  # noqa: F401 - imported for their import time only
+
+# Function to check a service job and fill in defaults from the configuration. The job names
+# input_path and optionally output_pdf, source_lang, target_lang or target_langs, target_first,
+# multi_column and page_limit.
+def prepare_job(settings):
+    input_path = job_input_path(settings)
+    languages = settings.get('target_langs') or [settings.get('target_lang') or target_language]
+    if not all(isinstance(language, str) and language for language in languages):
+        raise ValueError("target_langs must be a list of language codes")
+    languages = [language.upper() for language in languages]
+    job_output = settings.get('output_pdf')
+    if not job_output:
+        job_output = os.path.join(os.path.dirname(output_pdf), f"{os.path.splitext(os.path.basename(input_path))[0]}.pdf")
+        if len(languages) == 1:
+            job_output = output_path_for(job_output, languages[0])
+    return {
+        'input_path': input_path,
+        'output_pdf': os.path.abspath(job_output),
+        'source_lang': (settings.get('source_lang') or source_language).upper(),
+        'target_langs': languages,
+        'target_first': job_flag(settings, 'target_first', target_lan_fist_col),
+        'multi_column': job_flag(settings, 'multi_column', multi_column),
+        'page_limit': job_limit(settings, 'page_limit', page_limit),
+    }
+
+# Function to translate and render one service job with the warm client and caches
+def run_job(job):
+    settings = job.settings
+    pdf_path, job_output, languages = settings['input_path'], settings['output_pdf'], settings['target_langs']
+    job.pages_total = min(count_pages(pdf_path, pdf_extractor), settings['page_limit'])
+    os.makedirs(os.path.dirname(job_output), exist_ok=True)
+    pages = prefetch(job.track_pages(iter_marked_pages(pdf_path, settings['page_limit'])))
+    if len(languages) == 1:
+        rows = translate_pages(pages, source=settings['source_lang'], language=languages[0], output_pdf=job_output)
+        generate_pdf_streaming(prefetch(job.track_rows(rows)), job_output, target_first=settings['target_first'])
+        job.outputs.append(job_output)
+        return
+    rows = translate_pages_multi(pages, languages, source=settings['source_lang'])
+    generate_pdfs_multi(prefetch(job.track_rows(rows)), languages, job_output, settings['multi_column'], settings['target_first'])
+    job.outputs.extend([job_output] if settings['multi_column'] else [output_path_for(job_output, language) for language in languages])
 
 # Main script execution
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Translate a PDF with DeepL into a printable two-column PDF.")
+    parser.add_argument('--resume', action='store_true', help="skip sentences already translated by an interrupted run")
+    parser.add_argument('--list', action='store_true', help="list the PDF files in the source directory and exit")
+    add_metrics_arguments(parser)
+    add_batch_arguments(parser)
+    add_extraction_arguments(parser)
+    add_service_arguments(parser)
+    parser.add_argument('--targets', metavar='LANGS', help="translate into several target languages at once, e.g. DA,DE,FR")
+    parser.add_argument('--multi-column', action='store_true', help="with several targets, render one PDF with a column per language")
+    parser.add_argument('--engines', help=f"comma-separated engines to route between, e.g. {ENGINE_DEEPL_SDK},{ENGINE_GEMINI}")
+    args = parser.parse_args()
+
+    if args.list:
+        list_pdf_files()
+        raise SystemExit()
+    pdf_extractor = args.extractor or pdf_extractor
+    engines = args.engines.split(',') if args.engines else engines
+    if args.batch or args.worker:
+        run_batch(args)
+        raise SystemExit()
+    if args.serve:
+        start_run(args)
+        try:
+            serve(prepare_job, run_job, args.host, args.port, args.socket, args.parallel_jobs, warm_up)
+        finally:
+            finish_run(args)
+        raise SystemExit()
+    languages = args.targets.upper().split(',') if args.targets else (target_languages or [target_language])
+    multi_column = multi_column or args.multi_column
+
     pdf_path = select_pdf_file()
-    if pdf_path:
-        text = extract_text_from_pdf(pdf_path)
-        cleaned_text = clean_text(text)
-        df = create_dataframe_from_text(cleaned_text)
+    if pdf_path and len(languages) > 1:
+        # One journal per language, so --resume picks up each language where it stopped
+        journals = [TranslationJournal(journal_path_for(pdf_path, source_language, language), resume=args.resume)
+                    for language in languages]
+        start_run(args)
+        try:
+            run_multi_language_pipeline(pdf_path, output_pdf, languages, journals)
+        except KeyboardInterrupt:
+            print("\nInterrupted. Finished translations are saved; run again with --resume to continue.")
+        finally:
+            for journal in journals:
+                journal.close()
+            finish_run(args)
+    elif pdf_path:
+        target_language = languages[0]
+        # Completed translations are journaled so an interrupted run can be resumed
+        journal = TranslationJournal(journal_path_for(pdf_path, source_language, target_language), resume=args.resume)
+        start_run(args)
+        try:
+            if streaming:
+                run_streaming_pipeline(pdf_path, output_pdf, journal)
+            else:
+                with metrics.stage('extraction'):
+                    text = extract_text_from_pdf(pdf_path)
+                with metrics.stage('cleaning'):
+                    cleaned_text = clean_text(text)
+                with metrics.stage('splitting'):
+                    segments = create_segments_from_text(cleaned_text)
 
-        # Translate sentences and populate the DataFrame
-        df['Translation'] = translate_sentences(df['Sentence'], auth_key=deepL_api_key, source_language=source_language, target_language=target_language)
+                # Translate sentences and populate the segment store
+                engine_log = EngineLog()
+                timed_window = metrics.timed('translation', functools.partial(translate_window, engine_log=engine_log))
+                dedup = Deduplicator() if deduplicate else None
+                rows = translate_stream(segments.sentences, dedup.wrap(timed_window) if dedup else timed_window, journal=journal)
+                rows = engine_log.track(rows, output_pdf)
+                segments.set_translations(translation for _, _, translation in rows)
+                if dedup:
+                    dedup.report()
 
-        # Generate PDF from DataFrame
-        generate_pdf(df, output_pdf)
-        print("PDF document has been created:", output_pdf)
+                # Generate PDF from the segments
+                with metrics.stage('rendering'):
+                    generate_pdf(segments, output_pdf)
+            print("PDF document has been created:", output_pdf)
+        except KeyboardInterrupt:
+            print("\nInterrupted. Finished translations are saved; run again with --resume to continue.")
+        finally:
+            journal.close()
+            finish_run(args)
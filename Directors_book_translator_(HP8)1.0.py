@@ -1,13 +1,25 @@
 import os
-import time
-import pdfplumber
+import argparse
+import functools
+import threading
+import tempfile
 import re
-import pandas as pd
-import requests
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+from deepl_client import batch_sentences, DeepLTransport, deepl_free_api_url
+from translation_memory import get_shared_memory, ENGINE_DEEPL_REST, ENGINE_GEMINI, normalize_text, is_error_translation
+from concurrency import RateLimiter, map_ordered
+from engines import EngineRouter, DeepLRestEngine, GeminiEngine, NoEngineAvailable, EngineLog, engine_retry_policy, engine_report_path
+from checkpoint import TranslationJournal, journal_path_for
+from pdf_extraction import extract_pages_parallel, iter_pages, count_pages, add_extraction_arguments
+from pdf_extraction import EXTRACTOR_PDFPLUMBER, EXTRACTOR_PYPDF2, EXTRACTOR_AUTO
+from streaming import prefetch, clean_stream, translate_stream, windows
+from segmenter import Segmenter, PageIndex, RULE_SPEAKER_TAGS
+from pdf_rendering import build_streaming, render_parallel, render_chunk_rows
+from segment_store import SegmentStore
+from dedup import Deduplicator
+from metrics import metrics, add_metrics_arguments, start_run, finish_run
+from job_queue import JobQueue, add_batch_arguments, run_local_workers, report_queue
+from service import serve, add_service_arguments, job_input_path, job_limit
+from budget import TranslationBudget, BUDGET_ERROR, cost_per_million_chars, plan_budget, gate_window, parse_page_ranges
 
 # Configuration
 page_limit = 50  # Number of pages to read from the PDF
@@ -16,17 +28,55 @@ output_pdf = 'OutputPDFs/output.pdf'  # Output PDF file
 pdf_dir = 'SourcePDFs'  # Directory containing PDF files
 margin = 30
 cell_padding = 4
+source_language = 'EN'
+target_language = 'DA'
+deepL_api_url = deepl_free_api_url  # Point at a local mock server for testing
+compress_requests = False  # gzip large request bodies; only for endpoints that accept Content-Encoding: gzip
+batch_mode = True  # Pack many sentences into each DeepL request
+max_workers = 8  # Number of DeepL requests kept in flight
+requests_per_sec = 5  # Shared rate limit across all workers
+chars_per_sec = None  # Optional character rate limit; None disables it
+pdf_extractor = EXTRACTOR_PDFPLUMBER  # EXTRACTOR_PDFPLUMBER, EXTRACTOR_PYPDF2 or EXTRACTOR_AUTO (samples pages, picks the fastest good one)
+parallel_extraction = True  # Extract page ranges in a process pool
+extraction_processes = None  # None uses every CPU core
+page_cache_path = 'page_cache.sqlite3'  # Cache of extracted page text; set to None to extract every run
+translation_memory_path = 'translation_memory.sqlite3'  # Set to None to disable the translation memory
+streaming = True  # Extract, translate and render page by page instead of holding the whole book
+deduplicate = True  # Send repeated segments (scene headings, stock lines) to DeepL only once
+confirm_cost = True  # Ask before translating; needs a full extraction pass before translation can start
+max_characters = None  # Characters one run may send; None for no cap. The DeepL account's remaining quota always caps a DeepL-only run
+max_cost = None  # Euros one run may spend at cost_per_million_chars; None for no cap
+priority_pages = []  # Page ranges translated first when the budget does not cover the book, e.g. [(1, 20), (45, 50)]
+parallel_rendering = False  # Render table parts in worker processes and merge them; faster on long books, but each part starts a new page
+render_processes = None  # None uses every CPU core
+render_cache_dir = None  # e.g. 'RenderCache': keep rendered table parts by content, so a re-run lays out only the parts whose rows changed (each part starts a new page)
+engines = [ENGINE_DEEPL_REST]  # Engines to spread the work over; add ENGINE_GEMINI to fail over to Gemini when DeepL throttles or runs out of quota
+genai_api_key = 'ASD'  # Replace with your Gemini API key; only used when ENGINE_GEMINI is in engines
+gemini_model = None  # Gemini model object; created from genai_api_key on first use when left as None
 
-# Function to list available PDF files and ask user to select one
-def select_pdf_file():
+transport = None  # Pooled keep-alive connection to DeepL, created on first use and shared by every window
+retry = None  # Retry policy shared the same way, so backoff and the concurrency limit hold across windows
+router = None  # Engine router, shared the same way so its latency, error and quota figures hold across windows
+limiter = None  # Rate limiter shared the same way, so the limits hold across windows and parallel service jobs
+transport_lock = threading.Lock()
+
+# Function to list available PDF files
+def list_pdf_files():
     pdf_files = [f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')]
     if not pdf_files:
         print("No PDF files found in the 'pdfBooks' directory.")
-        return None
+        return pdf_files
 
     print("Available PDF files:")
     for idx, pdf_file in enumerate(pdf_files, start=1):
         print(f"{idx}. {pdf_file}")
+    return pdf_files
+
+# Function to list available PDF files and ask user to select one
+def select_pdf_file():
+    pdf_files = list_pdf_files()
+    if not pdf_files:
+        return None
 
     try:
         choice = int(input("Select the PDF file by number: ")) - 1
@@ -39,25 +89,41 @@ def select_pdf_file():
         print("Invalid input. Please enter a number.")
         return None
 
-# Function to extract text from a PDF file with page limit and add page markers
+# Page marker written after each page's text; the segmenter lifts it out again before translation
+page_marker_pattern = r'IIII: ~+\s+(\d+)\s+~+'
+
+def format_page_marker(page):
+    return f"IIII: ~~~~~  {page}  ~~~~~"
+
+# Function to extract text from a PDF file with page limit and add page markers;
+# page ranges are extracted in a process pool with parallel_extraction
 def extract_text_from_pdf(pdf_path):
     print("Extracting text from pdf... ")
-    text = ""
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                if page_num >= page_limit:
-                    break
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-                    text += f"IIII: ~~~~~  {page_num + 1}  ~~~~~"
-        print("Successful text extraction from pdf! ")
-        return text.strip()
+        processes = extraction_processes if parallel_extraction else 1
+        page_texts = extract_pages_parallel(pdf_path, page_limit, pdf_extractor, processes, page_cache_path)
     except Exception as e:
         print(f"Error reading PDF file: {e}")
         return ""
 
+    parts = []
+    for page_num, page_text in enumerate(page_texts):
+        if page_text:
+            parts.append(page_text + "\n")
+            parts.append(format_page_marker(page_num + 1))
+    print("Successful text extraction from pdf! ")
+    return "".join(parts).strip()
+
+# Function to add the page marker after the text of page page_num (counted from 0)
+def mark_page(page_num, page_text):
+    return page_text + "\n" + format_page_marker(page_num + 1)
+
+# Function to extract pages lazily, with the same page markers as extract_text_from_pdf
+def iter_marked_pages(pdf_path, limit=None):
+    for page_num, page_text in iter_pages(pdf_path, limit or page_limit, pdf_extractor, extraction_processes, page_cache_path):
+        if page_text:
+            yield mark_page(page_num, page_text)
+
 # Function to clean and process text
 def clean_text(text):
     text = re.sub(r'\s+', ' ', text)
@@ -65,135 +131,456 @@ def clean_text(text):
     print("Successful text cleaning! ")
     return text
 
-# Function to split text by speaker tags, including names with parentheses
-def split_sentences(text):
-    # Use a regex to split on patterns like 'JAMES:', 'HERMIONE:', or 'JAMES (with a grin):'
-    sentences = re.split(r'(?=\b[A-Z]{3,}(?:\s*\([^)]*\))?:\s)', text)
-    processed_sentences = [sentence.strip() for sentence in sentences if sentence.strip()]
+# Function to split text by speaker tags, including names with parentheses; page breaks go to page_index
+def split_sentences(text, page_index=None):
+    processed_sentences = list(split_sentences_stream([text], page_index))
     print("\nSuccessful text splitting! ")
     return processed_sentences
 
+# Function to split a stream of cleaned text chunks by speaker tags
+# like 'JAMES:', 'HERMIONE:', or 'JAMES (with a grin):'
+def split_sentences_stream(chunks, page_index=None):
+    return Segmenter(RULE_SPEAKER_TAGS, page_marker_pattern, page_index=page_index).segment(chunks)
 
-# Function to create a pandas DataFrame from text with an additional numbering column
-def create_dataframe_from_text(text):
-    sentences = split_sentences(text)
-    df = pd.DataFrame({
-        'No.': range(1, len(sentences) + 1),
-        'Sentence': sentences,
-        'Translation': [''] * len(sentences)
-    })
-    print("Successful dataframe creation! ")
-    return df
-
-# Function to translate sentences using DeepL with error handling
-def translate_sentences(sentences):
-    print("___INITIATING TRANSLATION___")
-    translations = []
-    for sentence in sentences:
-        print('Translating "',sentence,'"')
+
+# Function to create the numbered segment store from text
+def create_segments_from_text(text):
+    page_index = PageIndex()
+    segments = SegmentStore(split_sentences(text, page_index), page_index=page_index)
+    print("Successful segment creation! ")
+    return segments
+
+# Function to translate sentences, reusing earlier translations from the translation memory.
+# source and target override the configured languages; every request is charged to budget,
+# and the engine of every translation is recorded in engine_log.
+def translate_sentences(sentences, source=None, target=None, budget=None, engine_log=None):
+    source, target = source or source_language, target or target_language
+    if not translation_memory_path:
+        translations, sentence_engines = translate_with_engines(sentences, source, target, budget)
+    else:
+        memory = get_shared_memory(ENGINE_DEEPL_REST, source, target, path=translation_memory_path)
+        translations, sentence_engines = memory.translate_routed(
+            sentences, engines, lambda missing: translate_with_engines(missing, source, target, budget))
+    if engine_log:
+        engine_log.record(sentences, sentence_engines)
+    return translations
+
+# Function to return the shared DeepL transport and retry policy
+def get_transport():
+    global transport, retry
+    with transport_lock:
+        if transport is None:
+            transport = DeepLTransport(deepL_api_key, deepL_api_url, pool_size=max_workers, compress=compress_requests)
+            retry = engine_retry_policy(ENGINE_DEEPL_REST, max_workers, len(engines))
+    return transport, retry
+
+# Function to return the shared rate limiter, built once per process so its bucket does not refill at every window
+def get_rate_limiter():
+    global limiter
+    with transport_lock:
+        if limiter is None:
+            limiter = RateLimiter(requests_per_sec, chars_per_sec)
+    return limiter
+
+# Function to return the shared engine router over the configured engines
+def get_router():
+    global router, gemini_model
+    transport, retry = get_transport()
+    with transport_lock:
+        if router is None:
+            routed = []
+            for name in engines:
+                if name == ENGINE_DEEPL_REST:
+                    routed.append(DeepLRestEngine(transport, retry))
+                elif name == ENGINE_GEMINI:
+                    if gemini_model is None:
+                        import google.generativeai as genai
+                        genai.configure(api_key=genai_api_key)
+                        gemini_model = genai.GenerativeModel(ENGINE_GEMINI)
+                    routed.append(GeminiEngine(gemini_model, engine_retry_policy(ENGINE_GEMINI, max_workers, len(engines))))
+                else:
+                    raise ValueError(f"Unknown engine: {name}")
+            router = EngineRouter(routed)
+    return router
+
+# Function to translate sentences on the configured engines with error handling.
+# Returns (translations, engines) with the engine that produced each translation.
+# A batch that does not fit the budget is not sent and comes back as budget rows.
+def translate_with_engines(sentences, source=None, target=None, budget=None):
+    import requests
+
+    source, target = source or source_language, target or target_language
+    sentences = list(sentences)
+    if batch_mode:
+        batches = list(batch_sentences(sentences))
+    else:
+        batches = [(idx, idx + 1) for idx in range(len(sentences))]
+    quota_exceeded = threading.Event()
+    limiter = get_rate_limiter()
+
+    # Every batch returns one translation or error row per sentence, so rows stay aligned whatever fails
+    def translate_batch(batch_range):
+        start, end = batch_range
+        batch = sentences[start:end]
+        if quota_exceeded.is_set():
+            return ["[Translation Error: Quota exceeded]"] * len(batch), [None] * len(batch)  # Stop further translations since quota is exceeded
+        if budget and not budget.reserve(batch):
+            return [BUDGET_ERROR] * len(batch), [None] * len(batch)
+        metrics.progress(f'Translating sentences {start + 1}-{end} of {len(sentences)}')
+        translations, batch_engines = send_batch(batch)
+        if budget:
+            # Failed rows were not billed
+            budget.release(sum(len(sentence) for sentence, translation in zip(batch, translations) if is_error_translation(translation)))
+        return translations, batch_engines
+
+    def send_batch(batch):
         try:
-            response = requests.post(
-                'https://api-free.deepl.com/v2/translate',
-                data={
-                    'auth_key': deepL_api_key,
-                    'text': sentence,
-                    'source_lang': 'EN',  # Source language
-                    'target_lang': 'DA'   # Target language
-                }
-            )
-            response.raise_for_status()  # Check for HTTP errors
-
-            result = response.json()
-            translated_text = result['translations'][0]['text']
-            translations.append(translated_text)
+            # Throttling, 5xx replies, connection errors and timeouts are retried by the engine's policy,
+            # and the router moves the batch to another engine when one keeps failing
+            return get_router().translate(batch, source, target)
+
+        except NoEngineAvailable:
+            print("The character quota of every engine is used up. Please check your plans or try again later.")
+            print("Finished translations are saved; run again with --resume once the quota allows.")
+            metrics.count('quota_exceeded')
+            quota_exceeded.set()
+            return ["[Translation Error: Quota exceeded]"] * len(batch), [None] * len(batch)
 
         except requests.exceptions.HTTPError as http_err:
-            if response.status_code == 456:
+            status_code = http_err.response.status_code
+            if status_code == 456:
                 print("Error 456: Quota exceeded. Please check your DeepL plan or try again later.")
-                translations.append("[Translation Error: Quota exceeded]")
-                break  # Stop further translations since quota is exceeded
-            else:
-                print(f"HTTP error occurred: {http_err} (Status code: {response.status_code})")
-                translations.append("[Translation Error]")
-
-        except requests.exceptions.ConnectionError:
-            print("Connection error. Retrying in 5 seconds...")
-            time.sleep(5)
-            continue  # Retry the current sentence
+                print("Finished translations are saved; run again with --resume once the quota allows.")
+                metrics.count('quota_exceeded')
+                quota_exceeded.set()
+                return ["[Translation Error: Quota exceeded]"] * len(batch), [None] * len(batch)
+            print(f"HTTP error occurred: {http_err} (Status code: {status_code})")
+            return ["[Translation Error]"] * len(batch), [None] * len(batch)
 
-        except requests.exceptions.Timeout:
-            print("Request timed out. Retrying in 5 seconds...")
-            time.sleep(5)
-            continue  # Retry the current sentence
+        except requests.exceptions.RequestException as err:
+            print(f"Request failed after retries: {err}")
+            return ["[Translation Error]"] * len(batch), [None] * len(batch)
 
         except Exception as err:
             print(f"An error occurred: {err}")
-            translations.append("[Translation Error]")
-    print("Successful translations! ")
-    return translations
+            return ["[Translation Error]"] * len(batch), [None] * len(batch)
 
-# Function to generate a printable PDF from the DataFrame
-def generate_pdf(df, output_pdf):
-    pdf = SimpleDocTemplate(output_pdf, pagesize=A4, rightMargin=margin, leftMargin=margin, topMargin=margin, bottomMargin=margin)
-    styles = getSampleStyleSheet()
-    elements = []
-
-    # Define table data and style
-    table_data = [['No.', 'Translation', 'Sentence']]
-    for _, row in df.iterrows():
-        number = row['No.']
-        sentence = Paragraph(row['Sentence'], styles['Normal'])
-        translation = Paragraph(row['Translation'], styles['Normal'])
+    def batch_chars(batch_range):
+        return sum(len(sentence) for sentence in sentences[batch_range[0]:batch_range[1]])
+
+    # Results come back in batch order, so rows stay aligned with their sentences
+    translations = []
+    sentence_engines = []
+    for batch_translations, batch_engines in map_ordered(translate_batch, batches, max_workers, limiter, cost=batch_chars):
+        translations.extend(batch_translations)
+        sentence_engines.extend(batch_engines)
+    return translations, sentence_engines
+
+# Function to build one table from (number, sentence, translation) rows
+def build_table(rows, styles, header=True):
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle, Paragraph
+
+    table_data = [['No.', 'Translation', 'Sentence']] if header else []
+    for number, sentence, translation in rows:
+        sentence = Paragraph(sentence, styles['Normal'])
+        translation = Paragraph(translation, styles['Normal'])
         table_data.append([number, translation, sentence])
 
-    table = Table(table_data, colWidths=[30, 250, 250])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+    first_body_row = 1 if header else 0
+    table_style = [
         ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
         ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('BACKGROUND', (0, first_body_row), (-1, -1), colors.white),
         ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
         ('LEFTPADDING', (0, 0), (-1, -1), cell_padding),
         ('RIGHTPADDING', (0, 0), (-1, -1), cell_padding),
         ('TOPPADDING', (0, 0), (-1, -1), cell_padding),
         ('BOTTOMPADDING', (0, 0), (-1, -1), cell_padding)
-    ]))
+    ]
+    if header:
+        table_style += [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ]
+    table = Table(table_data, colWidths=[30, 250, 250])
+    table.setStyle(TableStyle(table_style))
+    return table
+
+# Function to generate a printable PDF from the segment store
+def generate_pdf(segments, output_pdf):
+    generate_pdf_streaming(segments.marked_rows(format_page_marker), output_pdf)
+
+# Function to render rows into one PDF, one table chunk at a time; runs inside a worker
+# process when rendering in parallel. Only the very first chunk carries the header.
+def render_pdf_part(part_path, rows, first_row=0):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate
+
+    pdf = SimpleDocTemplate(part_path, pagesize=A4, rightMargin=margin, leftMargin=margin, topMargin=margin, bottomMargin=margin)
+    styles = getSampleStyleSheet()
+    tables = (
+        build_table(chunk, styles, header=(first_row == 0 and idx == 0))
+        for idx, chunk in enumerate(windows(rows, render_chunk_rows))
+    )
+    build_streaming(pdf, tables)
 
-    elements.append(table)
-    pdf.build(elements)
+# Function to generate the PDF from a stream of (number, sentence, translation) rows
+def generate_pdf_streaming(rows, output_pdf):
+    if render_cache_dir or (parallel_rendering and (render_processes or os.cpu_count() or 1) > 1):
+        render_parallel(rows, render_pdf_part, output_pdf, max_processes=render_processes if parallel_rendering else 1,
+                        cache_dir=render_cache_dir)
+    else:
+        render_pdf_part(output_pdf, rows)
     print("Successfully built PDF! ")
 
-def calculate_character_count(text):
-    return len(text)
+# Function to extract and clean the book into a temporary spool file.
+# Keeps memory flat while still letting the run be planned and confirmed before anything is translated.
+def spool_cleaned_text(pdf_path, spool):
+    print("Extracting text from pdf... ")
+    for chunk in clean_stream(prefetch(metrics.timed_iter('extraction', iter_marked_pages(pdf_path)))):
+        spool.write(chunk)
+    print("Successful text extraction from pdf! ")
+
+# Function to return the budget for one run: the configured caps, and the DeepL account's
+# remaining quota when DeepL is the only engine (with more engines the router fails over instead)
+def make_budget(characters=None):
+    usage = get_transport()[0].usage if engines == [ENGINE_DEEPL_REST] else None
+    return TranslationBudget(characters or max_characters, max_cost, usage=usage)
+
+# Function to plan a run against the budget from its segments and their page_of(number) function.
+# Returns (billable characters, planned characters, blocked segments); see budget.plan_budget.
+def plan_translation(sentences, page_of, journal=None, budget=None):
+    cached = set()
+    if translation_memory_path:
+        memory = get_shared_memory(ENGINE_DEEPL_REST, source_language, target_language, path=translation_memory_path)
+        for engine in engines:
+            cached.update(normalize_text(sentence) for sentence, translation
+                          in zip(sentences, memory.lookup_many(sentences, engine)) if translation is not None)
+
+    def is_done(number, sentence):
+        return normalize_text(sentence) in cached or (journal is not None and journal.lookup(number, sentence) is not None)
+
+    return plan_budget(sentences, budget, page_of, priority_pages, is_done)
+
+# Function to split and translate a stream of cleaned text chunks.
+# Yields (number, sentence, translation) rows with the page markers put back into the source text.
+# With output_pdf, the engine of every row is written next to it as rows come out. Requests are
+# charged to budget, and segments in blocked (left out by plan_translation) are not sent.
+def translate_chunks(chunks, journal=None, source=None, target=None, output_pdf=None, budget=None, blocked=None):
+    page_index = PageIndex()
+    sentences = split_sentences_stream(chunks, page_index)
+    engine_log = EngineLog() if output_pdf else None
+    timed_window = metrics.timed('translation', functools.partial(translate_sentences, source=source, target=target,
+                                                                  budget=budget, engine_log=engine_log))
+    if blocked:
+        timed_window = gate_window(timed_window, blocked)
+    dedup = Deduplicator() if deduplicate else None
+    rows = translate_stream(sentences, dedup.wrap(timed_window) if dedup else timed_window, journal=journal)
+    if engine_log:
+        rows = engine_log.track(rows, output_pdf)
+    yield from page_index.mark_rows(rows, format_page_marker)
+    if dedup:
+        dedup.report()
+
+# Function to translate and render a stream of cleaned text chunks
+def translate_and_render_stream(chunks, output_pdf, journal=None, budget=None, blocked=None):
+    rows = translate_chunks(chunks, journal, output_pdf=output_pdf, budget=budget, blocked=blocked)
+    with metrics.stage('pipeline'):
+        generate_pdf_streaming(prefetch(rows), output_pdf)
+    if budget:
+        budget.report()
+
+# Function to run the whole job as a stream; returns False if the user cancels
+def run_streaming_pipeline(pdf_path, output_pdf, journal=None):
+    budget = make_budget()
+    if not confirm_cost and not budget.max_characters:
+        # Translation starts as soon as the first pages are extracted.
+        # Stages overlap while streaming: extraction and translation are timed on their own, "pipeline" end to end
+        pages = prefetch(metrics.timed_iter('extraction', iter_marked_pages(pdf_path)))
+        translate_and_render_stream(clean_stream(pages), output_pdf, journal, budget)
+        return True
 
-# Prompt user for continuation based on character count and cost
-def prompt_user_for_translation(character_count):
-    cost_per_million_chars = 20.00
-    characters_per_million = 1_000_000
-    estimated_cost = (character_count / characters_per_million) * cost_per_million_chars
-    print(f"\nTotal characters in source document: {character_count}")
-    print(f"Estimated cost for translation: €{estimated_cost:.2f}")
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as spool:
+        spool_cleaned_text(pdf_path, spool)
+        spool.seek(0)
+        page_index = PageIndex()
+        sentences = list(split_sentences_stream(iter(lambda: spool.read(64 * 1024), ''), page_index))
+        billable, planned, blocked = plan_translation(sentences, page_index.page_of, journal, budget)
+        del sentences
+        if confirm_cost and not prompt_user_for_translation(billable, planned, budget):
+            return False
+        spool.seek(0)
+        translate_and_render_stream(iter(lambda: spool.read(64 * 1024), ''), output_pdf, journal, budget, blocked)
+    return True
+
+# Function to translate one batch shard (a page range of one book) into (sentence, translation) rows
+def translate_shard(shard):
+    pages = iter_pages(shard['input_path'], shard['last_page'], pdf_extractor, 1, page_cache_path, shard['first_page'])
+    marked_pages = (mark_page(page_num, page_text) for page_num, page_text in pages if page_text)
+    return [(sentence, translation) for _, sentence, translation in translate_chunks(clean_stream(marked_pages))]
+
+# Function to render a batch book once all its shards are translated
+def render_book(book, rows):
+    os.makedirs(os.path.dirname(book['output_pdf']) or '.', exist_ok=True)
+    generate_pdf_streaming(rows, book['output_pdf'])
+
+# Function to split the rate limits between the local worker processes, so together they stay within them
+def share_rate_limits(worker_count):
+    global requests_per_sec, chars_per_sec
+    if requests_per_sec:
+        requests_per_sec /= worker_count
+    if chars_per_sec:
+        chars_per_sec /= worker_count
+
+# Function to queue every PDF in the source directory as shards and work through the queue.
+# Batch runs are unattended, so there is no cost prompt.
+def run_batch(args):
+    if not args.worker:
+        queue = JobQueue(args.queue)
+        for pdf_file in sorted(f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')):
+            pdf_path = os.path.join(pdf_dir, pdf_file)
+            book_output = os.path.join(os.path.dirname(output_pdf), f"{os.path.splitext(pdf_file)[0]}.{target_language.lower()}.pdf")
+            if queue.add_book(pdf_path, book_output, min(count_pages(pdf_path, pdf_extractor), page_limit)) is not None:
+                print(f"Queued {pdf_path} -> {book_output}")
+        queue.close()
+    run_local_workers(args.queue, args.workers, translate_shard, render_book, functools.partial(share_rate_limits, args.workers))
+    report_queue(args.queue)
+
+# Prompt user for continuation based on the characters still to be sent and their cost
+def prompt_user_for_translation(billable, planned, budget):
+    print(f"\nCharacters to translate (after the journal, translation memory and repeats): {billable}")
+    print(f"Estimated cost for translation: €{budget.cost_of(billable):.2f} at €{cost_per_million_chars:.2f} per million characters")
+    if budget.account_cap is not None:
+        print(f"Characters left on the DeepL account: {budget.account_cap - budget.spent}")
+    if planned < billable:
+        print(f"The budget covers {planned} characters (€{budget.cost_of(planned):.2f}); "
+              f"{'the priority pages and ' if priority_pages else ''}the earliest pages are translated and the rest is left untranslated.")
 
     user_input = input("Would you like to continue with the translation? (yes/no): ")
     return user_input.lower() == 'yes'
 
+# Function to open the DeepL connection pool and load the PDF libraries before the first service job
+def warm_up():
+    get_router()
+    import pdfplumber, reportlab.platypus  # noqa: F401 - imported for their import time only
+
+# Function to check a service job and fill in defaults from the configuration. The job names
+# input_path and optionally output_pdf, source_lang, target_lang and page_limit. The cost prompt is
+# skipped: the job was submitted on purpose.
+def prepare_job(settings):
+    input_path = job_input_path(settings)
+    source_lang = (settings.get('source_lang') or source_language).upper()
+    target_lang = (settings.get('target_lang') or target_language).upper()
+    job_output = settings.get('output_pdf') or os.path.join(
+        os.path.dirname(output_pdf), f"{os.path.splitext(os.path.basename(input_path))[0]}.{target_lang.lower()}.pdf")
+    return {
+        'input_path': input_path,
+        'output_pdf': os.path.abspath(job_output),
+        'source_lang': source_lang,
+        'target_lang': target_lang,
+        'page_limit': job_limit(settings, 'page_limit', page_limit),
+        'max_characters': job_limit(settings, 'max_characters', max_characters),
+    }
+
+# Function to translate and render one service job over the warm connection pool
+def run_job(job):
+    settings = job.settings
+    pdf_path, job_output = settings['input_path'], settings['output_pdf']
+    job.pages_total = min(count_pages(pdf_path, pdf_extractor), settings['page_limit'])
+    os.makedirs(os.path.dirname(job_output), exist_ok=True)
+    pages = prefetch(job.track_pages(iter_marked_pages(pdf_path, settings['page_limit'])))
+    budget = make_budget(settings['max_characters'])
+    rows = translate_chunks(clean_stream(pages), source=settings['source_lang'], target=settings['target_lang'],
+                            output_pdf=job_output, budget=budget)
+    generate_pdf_streaming(prefetch(job.track_rows(rows)), job_output)
+    job.outputs.append(job_output)
+    job.outputs.append(engine_report_path(job_output))
+    budget.report()
+
 
 # Main Execution Flow
-text = extract_text_from_pdf(select_pdf_file())
-cleaned_text = clean_text(text)
-character_count = len(cleaned_text)
-
-# Ask user if they want to continue with the translation process
-if prompt_user_for_translation(character_count):
-    df = create_dataframe_from_text(cleaned_text)
-
-    # Translate sentences and populate the DataFrame
-    df['Translation'] = translate_sentences(df['Sentence'])
-
-    # Generate PDF from DataFrame
-    generate_pdf(df, output_pdf)
-    print("PDF document has been created:", output_pdf)
-else:
-    print("Translation process was canceled.")
+# (guarded so extraction worker processes can import this script safely)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Translate a screenplay-style PDF with DeepL into a printable two-column PDF.")
+    parser.add_argument('--resume', action='store_true', help="skip sentences already translated by an interrupted run")
+    parser.add_argument('--list', action='store_true', help="list the PDF files in the source directory and exit")
+    add_metrics_arguments(parser)
+    add_batch_arguments(parser)
+    add_extraction_arguments(parser)
+    add_service_arguments(parser)
+    parser.add_argument('--engines', help=f"comma-separated engines to route between, e.g. {ENGINE_DEEPL_REST},{ENGINE_GEMINI}")
+    parser.add_argument('--max-characters', type=int, help="stop the run once it has sent this many characters")
+    parser.add_argument('--max-cost', type=float, help=f"stop the run once it has spent this many euros (at €{cost_per_million_chars:.2f} per million characters)")
+    parser.add_argument('--priority-pages', type=parse_page_ranges, metavar='RANGES',
+                        help="page ranges to translate first when the budget does not cover the book, e.g. 1-20,45-50")
+    args = parser.parse_args()
+    if args.list:
+        list_pdf_files()
+        raise SystemExit()
+    pdf_extractor = args.extractor or pdf_extractor
+    engines = args.engines.split(',') if args.engines else engines
+    max_characters = args.max_characters or max_characters
+    max_cost = args.max_cost or max_cost
+    priority_pages = args.priority_pages or priority_pages
+    if args.batch or args.worker:
+        run_batch(args)
+        raise SystemExit()
+    if args.serve:
+        start_run(args)
+        try:
+            serve(prepare_job, run_job, args.host, args.port, args.socket, args.parallel_jobs, warm_up)
+        finally:
+            finish_run(args)
+        raise SystemExit()
+
+    pdf_path = select_pdf_file()
+    if not pdf_path:
+        raise SystemExit("No PDF file selected.")
+    # Completed translations are journaled so an interrupted or quota-stopped run can be resumed
+    journal = TranslationJournal(journal_path_for(pdf_path, source_language, target_language), resume=args.resume)
+    start_run(args)
+    try:
+        if streaming:
+            if run_streaming_pipeline(pdf_path, output_pdf, journal):
+                print("PDF document has been created:", output_pdf)
+            else:
+                print("Translation process was canceled.")
+        else:
+            with metrics.stage('extraction'):
+                text = extract_text_from_pdf(pdf_path)
+            with metrics.stage('cleaning'):
+                cleaned_text = clean_text(text)
+            with metrics.stage('splitting'):
+                segments = create_segments_from_text(cleaned_text)
+            budget = make_budget()
+            billable, planned, blocked = plan_translation(segments.sentences, segments.page_index.page_of, journal, budget)
+
+            # Ask user if they want to continue with the translation process
+            if prompt_user_for_translation(billable, planned, budget):
+                # Translate sentences and populate the segment store
+                engine_log = EngineLog()
+                timed_window = metrics.timed('translation', functools.partial(translate_sentences, budget=budget, engine_log=engine_log))
+                if blocked:
+                    timed_window = gate_window(timed_window, blocked)
+                dedup = Deduplicator() if deduplicate else None
+                rows = translate_stream(segments.sentences, dedup.wrap(timed_window) if dedup else timed_window, journal=journal)
+                rows = engine_log.track(rows, output_pdf)
+                segments.set_translations(translation for _, _, translation in rows)
+                if dedup:
+                    dedup.report()
+
+                # Generate PDF from the segments
+                with metrics.stage('rendering'):
+                    generate_pdf(segments, output_pdf)
+                budget.report()
+                print("PDF document has been created:", output_pdf)
+            else:
+                print("Translation process was canceled.")
+    except KeyboardInterrupt:
+        print("\nInterrupted. Finished translations are saved; run again with --resume to continue.")
+    finally:
+        journal.close()
+        finish_run(args)
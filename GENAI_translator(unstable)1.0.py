@@ -1,21 +1,72 @@
-import PyPDF2
 import re
-import google.generativeai as genai
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
 import os
+import time
+import argparse
+import functools
+import threading
+from translation_memory import get_shared_memory, ENGINE_GEMINI
+from concurrency import RateLimiter, map_ordered
+from retry_policy import RetryPolicy
+from gemini_packing import translate_packed
+from pdf_extraction import extract_pages_parallel, iter_pages, count_pages, add_extraction_arguments
+from pdf_extraction import EXTRACTOR_PDFPLUMBER, EXTRACTOR_PYPDF2, EXTRACTOR_AUTO
+from streaming import prefetch, clean_stream, translate_stream, windows, iter_text_lines
+from segmenter import Segmenter, RULE_PUNCTUATION
+from pdf_rendering import build_streaming, render_parallel, render_chunk_rows
+from checkpoint import TranslationJournal, journal_path_for
+from dedup import Deduplicator
+from metrics import metrics, add_metrics_arguments, start_run, finish_run
+from job_queue import JobQueue, add_batch_arguments, run_local_workers, report_queue
+from service import serve, add_service_arguments, job_input_path, job_flag, job_limit
 
 # Configuration
 line_limit = 30000  # Number of lines to read from the PDF
 genai_api_key = 'ASD'  # Replace with your Gemini API key
+translation_memory_path = 'translation_memory.sqlite3'  # Set to None to disable the translation memory
+max_workers = 8  # Number of Gemini requests kept in flight
+requests_per_sec = 5  # Shared rate limit across all workers
+chars_per_sec = None  # Optional character rate limit; None disables it
+packed_mode = True  # Send many numbered sentences per Gemini request and parse a JSON reply
+pack_token_budget = 2000  # Estimated source tokens per packed request
+pdf_extractor = EXTRACTOR_PYPDF2  # EXTRACTOR_PYPDF2, EXTRACTOR_PDFPLUMBER or EXTRACTOR_AUTO (samples pages, picks the fastest good one)
+parallel_extraction = True  # Extract page ranges in a process pool
+extraction_processes = None  # None uses every CPU core
+page_cache_path = 'page_cache.sqlite3'  # Cache of extracted page text; set to None to extract every run
+streaming = True  # Extract, translate and render chunk by chunk instead of holding the whole text
+deduplicate = True  # Send repeated segments to Gemini only once
+parallel_rendering = False  # Render table parts in worker processes and merge them; faster on long books, but each part starts a new page
+render_processes = None  # None uses every CPU core
+render_cache_dir = None  # e.g. 'RenderCache': keep rendered table parts by content, so a re-run lays out only the parts whose rows changed (each part starts a new page)
+batch_output_dir = 'TranslatedPDFs'  # Where --batch writes its PDFs, so they are not picked up as sources next time
 
-# Set up Google Generative AI
-genai.configure(api_key=genai_api_key)
-model = genai.GenerativeModel("gemini-1.5-flash")
+model = None  # Created on first use, so listing files and --help do not wait for the Gemini client
+retry = None  # Retry policy shared by every window, created on first use
+limiter = None  # Rate limiter shared the same way, so the limits hold across windows and parallel service jobs
+limiter_lock = threading.Lock()
+
+# Function to set up Google Generative AI the first time a translation is needed
+def get_model():
+    global model
+    if model is None:
+        import google.generativeai as genai
+        genai.configure(api_key=genai_api_key)
+        model = genai.GenerativeModel("gemini-1.5-flash")
+    return model
+
+# Function to return the shared retry policy for Gemini requests
+def get_retry_policy():
+    global retry
+    if retry is None:
+        retry = RetryPolicy(ENGINE_GEMINI, max_workers)
+    return retry
+
+# Function to return the shared rate limiter, built once per process so its bucket does not refill at every window
+def get_rate_limiter():
+    global limiter
+    with limiter_lock:
+        if limiter is None:
+            limiter = RateLimiter(requests_per_sec, chars_per_sec)
+    return limiter
 
 def list_available_files():
     # Get all PDF and TXT files in the current directory
@@ -34,17 +85,13 @@ def extract_text_from_file(file_path):
     text = ""
     try:
         if file_extension == '.pdf':
-            with open(file_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                for page in reader.pages[:line_limit]:  # Limit to specified number of lines
-                    text += page.extract_text() + "\n"
+            # With parallel_extraction, page ranges are extracted in a process pool and reassembled in page order
+            processes = extraction_processes if parallel_extraction else 1
+            page_texts = extract_pages_parallel(file_path, line_limit, pdf_extractor, processes, page_cache_path)
+            text = "".join(page_text + "\n" for page_text in page_texts)
         elif file_extension == '.txt':
-            with open(file_path, 'r', encoding='utf-8') as file:
-                # Read only up to line_limit lines
-                for i, line in enumerate(file):
-                    if i >= line_limit:
-                        break
-                    text += line
+            # Read only up to line_limit lines
+            text = "".join(iter_text_lines(file_path, line_limit))
         else:
             raise ValueError(f"Unsupported file type: {file_extension}. Please provide a .pdf or .txt file.")
         
@@ -55,28 +102,96 @@ def extract_text_from_file(file_path):
     except Exception as e:
         raise Exception(f"Error reading file: {str(e)}")
 
+# Function to yield the text of a PDF page by page, or of a TXT file line by line
+def iter_file_chunks(file_path, limit=None):
+    _, file_extension = os.path.splitext(file_path)
+    file_extension = file_extension.lower()
+    limit = limit or line_limit
+    if file_extension == '.pdf':
+        for _, page_text in iter_pages(file_path, limit, pdf_extractor, extraction_processes, page_cache_path):
+            yield page_text + "\n"
+    elif file_extension == '.txt':
+        yield from iter_text_lines(file_path, limit)
+    else:
+        raise ValueError(f"Unsupported file type: {file_extension}. Please provide a .pdf or .txt file.")
+
 # Function to clean and process text
 def clean_text(text):
     text = re.sub(r'\s+', ' ', text)  # Replace multiple spaces with a single space
     text = text.replace('\f', ';;;;')  # Replace page breaks with ";;;;"
     return text
 
-# Function to translate and split text into sentences with custom rules
-def translate_and_split_sentences(text, source_lang, target_lang):
-    sentences = []
-    translations = []
+# Function to split text into sentences with custom rules
+def split_sentences(text):
+    return list(split_sentences_stream([text]))
+
+# Function to split a stream of cleaned text chunks into sentences with the same rules
+def split_sentences_stream(chunks):
+    return Segmenter(RULE_PUNCTUATION, drop_leading=True).segment(chunks)
+
+# Function to translate sentences with Gemini, packed many per request or one per request, several in flight
+def translate_with_gemini(sentences, source_lang, target_lang):
     prompt_prefix = (f"You are a translator. Your job is to translate the following text from {source_lang} to {target_lang}. "
                      "Be as literate as possible with the words, because your output will be used to learn vocabulary.")
 
-    for sentence in re.split(r'(?<=[.!?]) +', text):
-        if sentence and len(sentence) >= 6:
-            prompt = f"{prompt_prefix}\n\nText: {sentence}"
-            response = model.generate_content(prompt)
-            translated_text = response.text  # Get the translation result
-            sentences.append(sentence)
-            translations.append(translated_text)
-        elif sentences:
-            sentences[-1] += " " + sentence
+    gemini = get_model()
+    retry = get_retry_policy()
+
+    # Sends one prompt and records its latency and, when the reply reports it, the billed token count
+    def send(prompt, **kwargs):
+        request_start = time.perf_counter()
+        try:
+            response = gemini.generate_content(prompt, **kwargs)
+        except Exception:
+            metrics.observe_request(ENGINE_GEMINI, time.perf_counter() - request_start, ok=False)
+            raise
+        metrics.observe_request(ENGINE_GEMINI, time.perf_counter() - request_start, characters=len(prompt))
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            metrics.count(f"tokens_billed.{ENGINE_GEMINI}", usage.prompt_token_count + usage.candidates_token_count)
+        return response
+
+    # Sends one prompt under the retry policy: 429 and 5xx replies are retried with backoff
+    def generate(prompt, **kwargs):
+        return retry.call(send, prompt, **kwargs)
+
+    def translate_one(sentence):
+        prompt = f"{prompt_prefix}\n\nText: {sentence}"
+        try:
+            response = generate(prompt)
+        except Exception as e:
+            print(f"Gemini API error: {e}")
+            return "[Translation Error]"  # Keeps the row, so later translations stay aligned
+        return response.text  # Get the translation result
+
+    def translate_prompt_as_json(prompt):
+        response = generate(prompt, generation_config={'response_mime_type': 'application/json'})
+        return response.text
+
+    limiter = get_rate_limiter()
+    if packed_mode:
+        return translate_packed(sentences, prompt_prefix, translate_prompt_as_json, translate_one,
+                                pack_token_budget, max_workers, limiter)
+    return map_ordered(translate_one, sentences, max_workers, limiter)
+
+# Function to translate sentences, reusing earlier translations from the translation memory
+def translate_sentences(sentences, source_lang, target_lang):
+    if not translation_memory_path:
+        return translate_with_gemini(sentences, source_lang, target_lang)
+
+    memory = get_shared_memory(ENGINE_GEMINI, source_lang, target_lang, path=translation_memory_path)
+    return memory.translate(sentences, lambda missing: translate_with_gemini(missing, source_lang, target_lang))
+
+# Function to translate and split text into sentences with custom rules
+def translate_and_split_sentences(text, source_lang, target_lang, journal=None):
+    with metrics.stage('splitting'):
+        sentences = split_sentences(text)
+    translate_window = metrics.timed('translation', lambda window: translate_sentences(window, source_lang, target_lang))
+    dedup = Deduplicator() if deduplicate else None
+    rows = translate_stream(sentences, dedup.wrap(translate_window) if dedup else translate_window, journal=journal)
+    translations = [translation for _, _, translation in rows]
+    if dedup:
+        dedup.report()
     return sentences, translations
 
 # Custom canvas for page numbers
@@ -92,10 +207,12 @@ def add_page_number(canvas, doc):
     canvas.drawString(x, 20, text)
     canvas.restoreState()
 
-# Function to generate PDF from the data
-def generate_pdf(original_text, translated_text, output_pdf, original_first=True):
-    # Create the PDF document
-    doc = SimpleDocTemplate(
+# Function to create the document template shared by both PDF generators
+def create_document(output_pdf):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate
+
+    return SimpleDocTemplate(
         output_pdf,
         pagesize=A4,
         rightMargin=30,
@@ -104,11 +221,13 @@ def generate_pdf(original_text, translated_text, output_pdf, original_first=True
         bottomMargin=30
     )
 
-    # Create styles
+# Function to create custom style for table cells
+def create_cell_style():
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
     styles = getSampleStyleSheet()
-    
-    # Create custom style for table cells
-    cell_style = ParagraphStyle(
+    return ParagraphStyle(
         'CellStyle',
         parent=styles['Normal'],
         fontSize=11,
@@ -117,11 +236,18 @@ def generate_pdf(original_text, translated_text, output_pdf, original_first=True
         textColor=colors.black
     )
 
+# Function to build one table from (number, original, translation) rows.
+# first_row is the 0-based position of the first row in the whole document, so the
+# alternating backgrounds continue across table chunks.
+def build_table(rows, doc, cell_style, original_first=True, first_row=0):
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle, Paragraph
+
     # Prepare the data for the table
     data = []
 
     # Add sentences and translations to the table with row numbers based on order preference
-    for i, (orig, trans) in enumerate(zip(original_text, translated_text), 1):
+    for i, orig, trans in rows:
         if original_first:
             row = [str(i), Paragraph(orig, cell_style), Paragraph(trans, cell_style)]
         else:
@@ -137,6 +263,7 @@ def generate_pdf(original_text, translated_text, output_pdf, original_first=True
 
     # Very light gray color
     very_light_gray = colors.Color(0.97, 0.97, 0.97)
+    row_backgrounds = [colors.white, very_light_gray] if first_row % 2 == 0 else [very_light_gray, colors.white]
 
     # Style the table
     table.setStyle(TableStyle([
@@ -154,7 +281,7 @@ def generate_pdf(original_text, translated_text, output_pdf, original_first=True
         ('BOX', (0, 0), (-1, -1), 1, colors.black),
         
         # Row styling (alternating very light gray)
-        ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.white, very_light_gray]),
+        ('ROWBACKGROUNDS', (0, 0), (-1, -1), row_backgrounds),
         
         # Padding
         ('TOPPADDING', (0, 0), (-1, -1), 8),
@@ -162,11 +289,158 @@ def generate_pdf(original_text, translated_text, output_pdf, original_first=True
         ('LEFTPADDING', (0, 0), (-1, -1), 6),
         ('RIGHTPADDING', (0, 0), (-1, -1), 6),
     ]))
+    return table
+
+# Function to generate PDF from the data
+def generate_pdf(original_text, translated_text, output_pdf, original_first=True):
+    rows = ((i, orig, trans) for i, (orig, trans) in enumerate(zip(original_text, translated_text), 1))
+    generate_pdf_streaming(rows, output_pdf, original_first)
+
+# Function to render rows into one PDF, one table chunk at a time; runs inside a worker
+# process when rendering in parallel, where page numbers are stamped after merging instead
+def render_pdf_part(part_path, rows, first_row=0, original_first=True, page_numbers=True):
+    doc = create_document(part_path)
+    cell_style = create_cell_style()
+    tables = (
+        build_table(chunk, doc, cell_style, original_first, first_row=first_row + idx * render_chunk_rows)
+        for idx, chunk in enumerate(windows(rows, render_chunk_rows))
+    )
+    if page_numbers:
+        # Build the PDF with page numbers
+        build_streaming(doc, tables, onFirstPage=add_page_number, onLaterPages=add_page_number)
+    else:
+        build_streaming(doc, tables)
+
+# Function to generate the PDF from a stream of (number, original, translation) rows
+def generate_pdf_streaming(rows, output_pdf, original_first=True):
+    if render_cache_dir or (parallel_rendering and (render_processes or os.cpu_count() or 1) > 1):
+        render_parallel(rows, render_pdf_part, output_pdf, max_processes=render_processes if parallel_rendering else 1,
+                        footer=add_page_number, part_args=(original_first, False), cache_dir=render_cache_dir)
+    else:
+        render_pdf_part(output_pdf, rows, 0, original_first)
+
+# Function to split and translate a stream of cleaned text chunks into (number, original, translation) rows
+def translate_chunks(chunks, source_lang, target_lang, journal=None):
+    sentences = split_sentences_stream(chunks)
+    translate_window = metrics.timed('translation', lambda window: translate_sentences(window, source_lang, target_lang))
+    dedup = Deduplicator() if deduplicate else None
+    yield from translate_stream(sentences, dedup.wrap(translate_window) if dedup else translate_window, journal=journal)
+    if dedup:
+        dedup.report()
+
+# Function to run extraction, cleaning, splitting, translation and rendering as one stream
+def run_streaming_pipeline(input_path, output_pdf, source_lang, target_lang, original_first=True, journal=None):
+    # Stages overlap while streaming: extraction and translation are timed on their own, "pipeline" end to end
+    chunks = clean_stream(prefetch(metrics.timed_iter('extraction', iter_file_chunks(input_path))))
+    rows = translate_chunks(chunks, source_lang, target_lang, journal)
+    with metrics.stage('pipeline'):
+        generate_pdf_streaming(prefetch(rows), output_pdf, original_first)
 
-    # Build the PDF with page numbers
-    doc.build([table], onFirstPage=add_page_number, onLaterPages=add_page_number)
+# Function to translate one batch shard (a page range of a PDF, or a whole TXT file) into (original, translation) rows
+def translate_shard(shard):
+    settings = shard['settings']
+    if shard['input_path'].lower().endswith('.pdf'):
+        pages = iter_pages(shard['input_path'], shard['last_page'], pdf_extractor, 1, page_cache_path, shard['first_page'])
+        chunks = (page_text + "\n" for _, page_text in pages)
+    else:
+        chunks = iter_file_chunks(shard['input_path'])
+    rows = translate_chunks(clean_stream(chunks), settings['source_lang'], settings['target_lang'])
+    return [(sentence, translation) for _, sentence, translation in rows]
+
+# Function to render a batch book once all its shards are translated
+def render_book(book, rows):
+    os.makedirs(os.path.dirname(book['output_pdf']) or '.', exist_ok=True)
+    generate_pdf_streaming(rows, book['output_pdf'], book['settings']['original_first'])
+
+# Function to split the rate limits between the local worker processes, so together they stay within them
+def share_rate_limits(worker_count):
+    global requests_per_sec, chars_per_sec
+    if requests_per_sec:
+        requests_per_sec /= worker_count
+    if chars_per_sec:
+        chars_per_sec /= worker_count
+
+# Function to queue every PDF and TXT file in the current directory and work through the queue.
+# PDFs are split into page-range shards; a TXT file is one shard.
+def run_batch(args):
+    if not args.worker:
+        if not (args.source_lang and args.target_lang):
+            raise SystemExit("--batch needs --source-lang and --target-lang.")
+        settings = {'source_lang': args.source_lang, 'target_lang': args.target_lang, 'original_first': not args.target_first}
+        queue = JobQueue(args.queue)
+        for input_path in sorted(f for f in os.listdir('.') if f.lower().endswith(('.pdf', '.txt'))):
+            book_output = os.path.join(batch_output_dir, f"{os.path.splitext(input_path)[0]}.{args.target_lang.lower()}.pdf")
+            page_count = min(count_pages(input_path, pdf_extractor), line_limit) if input_path.lower().endswith('.pdf') else 1
+            if queue.add_book(input_path, book_output, page_count, settings) is not None:
+                print(f"Queued {input_path} -> {book_output}")
+        queue.close()
+    run_local_workers(args.queue, args.workers, translate_shard, render_book, functools.partial(share_rate_limits, args.workers))
+    report_queue(args.queue)
+
+# Function to create the Gemini client and load the PDF libraries before the first service job
+def warm_up():
+    get_model()
+    get_retry_policy()
+    import PyPDF2, reportlab.platypus  # noqa: F401 - imported for their import time only
+
+# Function to check a service job and fill in defaults. The job names input_path, source_lang and
+# target_lang, and optionally output_pdf, target_first and page_limit (lines of a TXT file, pages of a PDF).
+def prepare_job(settings):
+    input_path = job_input_path(settings, ('.pdf', '.txt'))
+    source_lang, target_lang = settings.get('source_lang'), settings.get('target_lang')
+    if not (isinstance(source_lang, str) and source_lang and isinstance(target_lang, str) and target_lang):
+        raise ValueError("source_lang and target_lang are required")
+    job_output = settings.get('output_pdf') or os.path.join(
+        batch_output_dir, f"{os.path.splitext(os.path.basename(input_path))[0]}.{target_lang.lower()}.pdf")
+    return {
+        'input_path': input_path,
+        'output_pdf': os.path.abspath(job_output),
+        'source_lang': source_lang,
+        'target_lang': target_lang,
+        'target_first': job_flag(settings, 'target_first'),
+        'page_limit': job_limit(settings, 'page_limit', line_limit),
+    }
+
+# Function to translate and render one service job with the warm model and caches
+def run_job(job):
+    settings = job.settings
+    input_path, job_output = settings['input_path'], settings['output_pdf']
+    if input_path.lower().endswith('.pdf'):
+        job.pages_total = min(count_pages(input_path, pdf_extractor), settings['page_limit'])
+    os.makedirs(os.path.dirname(job_output), exist_ok=True)
+    chunks = clean_stream(prefetch(job.track_pages(iter_file_chunks(input_path, settings['page_limit']))))
+    rows = translate_chunks(chunks, settings['source_lang'], settings['target_lang'])
+    generate_pdf_streaming(prefetch(job.track_rows(rows)), job_output, not settings['target_first'])
+    job.outputs.append(job_output)
 
 def main():
+    parser = argparse.ArgumentParser(description="Translate a PDF or TXT file with Gemini into a printable two-column PDF.")
+    parser.add_argument('--resume', action='store_true', help="skip sentences already translated by an interrupted run")
+    parser.add_argument('--list', action='store_true', help="list the PDF and TXT files in the current directory and exit")
+    add_metrics_arguments(parser)
+    add_batch_arguments(parser)
+    add_extraction_arguments(parser)
+    add_service_arguments(parser)
+    parser.add_argument('--source-lang', help="original language of the texts (for --batch)")
+    parser.add_argument('--target-lang', help="language to translate to (for --batch)")
+    parser.add_argument('--target-first', action='store_true', help="put the translation in the first column (for --batch)")
+    args = parser.parse_args()
+    if args.list:
+        list_available_files()
+        return
+    global pdf_extractor
+    pdf_extractor = args.extractor or pdf_extractor
+    if args.batch or args.worker:
+        run_batch(args)
+        return
+    if args.serve:
+        start_run(args)
+        try:
+            serve(prepare_job, run_job, args.host, args.port, args.socket, args.parallel_jobs, warm_up)
+        finally:
+            finish_run(args)
+        return
+
     # List available files and get user selection
     files = list_available_files()
     while True:
@@ -194,20 +468,35 @@ def main():
 
     output_pdf = 'translated_output.pdf'  # Output PDF file
 
+    # Completed translations are journaled so an interrupted run can be resumed
+    journal = TranslationJournal(journal_path_for(input_path, source_lang, target_lang), resume=args.resume)
+    start_run(args)
     try:
-        # Extract text from either PDF or TXT file
-        text = extract_text_from_file(input_path)
-        
-        # Process and generate output
-        cleaned_text = clean_text(text)
-        sentences, translations = translate_and_split_sentences(cleaned_text, source_lang, target_lang)
-        generate_pdf(sentences, translations, output_pdf, original_first)
+        if streaming:
+            run_streaming_pipeline(input_path, output_pdf, source_lang, target_lang, original_first, journal)
+        else:
+            # Extract text from either PDF or TXT file
+            with metrics.stage('extraction'):
+                text = extract_text_from_file(input_path)
+
+            # Process and generate output
+            with metrics.stage('cleaning'):
+                cleaned_text = clean_text(text)
+            sentences, translations = translate_and_split_sentences(cleaned_text, source_lang, target_lang, journal)
+            with metrics.stage('rendering'):
+                generate_pdf(sentences, translations, output_pdf, original_first)
         
         print(f"\nPDF document has been created: {output_pdf}")
         print(f"Successfully processed {os.path.basename(input_path)}")
         
+    except KeyboardInterrupt:
+        print("\nInterrupted. Finished translations are saved; run again with --resume to continue.")
     except Exception as e:
         print(f"Error: {str(e)}")
+        print("Finished translations are saved; run again with --resume to continue.")
+    finally:
+        journal.close()
+        finish_run(args)
 
 if __name__ == "__main__":
     main()
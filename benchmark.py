@@ -0,0 +1,220 @@
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+from mock_backends import start_mock_server, MockGeminiModel
+from pdf_extraction import count_pages
+from streaming import translate_stream
+from dedup import Deduplicator
+from metrics import metrics
+
+# Offline benchmark: synthetic PDFs, mock translation backends and per-stage timings,
+# so performance can be compared between versions without spending API quota.
+
+script_files = {
+    'deepl': 'DeepL_PDF_translator3.4.py',
+    'directors': 'Directors_book_translator_(HP8)1.0.py',
+    'genai': 'GENAI_translator(unstable)1.0.py',
+}
+default_layouts = {'deepl': 'prose', 'directors': 'screenplay', 'genai': 'prose'}
+
+speakers = ['HARRY', 'HERMIONE', 'RON (whispering)', 'DUMBLEDORE', 'MCGONAGALL']
+words = ('the quick brown fox jumps over a lazy dog while an old owl watches from the tower '
+         'and nobody in the castle notices anything unusual about the evening').split()
+
+# Function to generate a synthetic PDF with reportlab. "prose" fills pages with sentences;
+# "screenplay" alternates speaker-tagged lines with wrapped dialogue, like a directors' book.
+def make_synthetic_pdf(path, pages, layout='prose', lines_per_page=45, seed=1):
+    import random
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    rng = random.Random(seed)
+    pdf = canvas.Canvas(path, pagesize=A4)
+    line_count = 0
+    for page in range(pages):
+        y = 800
+        pdf.setFont('Helvetica', 9)
+        pdf.drawString(40, y, f"Synthetic benchmark book - page {page + 1}")  # Running header, repeated on every page
+        y -= 18
+        for line in range(lines_per_page):
+            text = ' '.join(rng.choice(words) for _ in range(rng.randint(6, 12)))
+            if layout == 'screenplay' and line % 3 == 0:
+                text = f"{speakers[line_count % len(speakers)]}: {text.capitalize()}."
+            elif rng.random() < 0.4:
+                text = f"{text.capitalize()}."
+            pdf.drawString(40, y, text)
+            line_count += 1
+            y -= 16
+        pdf.showPage()
+    pdf.save()
+
+# Function to import one of the translator scripts as a module despite its file name
+def load_script(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script_files[name])
+    module_name = f"benchmark_{name}"
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module  # Lets worker processes unpickle the script's functions
+    spec.loader.exec_module(module)
+    return module
+
+# Function to point a script at the mock server and turn off state that would skew timings
+def configure_script(name, script, server_url, pages, workers, parallel_rendering=False):
+    script.translation_memory_path = None
+    script.page_cache_path = None
+    script.render_cache_dir = None
+    script.requests_per_sec = None
+    script.chars_per_sec = None
+    script.parallel_rendering = parallel_rendering
+    if workers:
+        script.max_workers = workers
+    if name == 'deepl':
+        script.deepl_server_url = server_url
+        script.page_limit = pages
+    elif name == 'directors':
+        script.deepL_api_url = f"{server_url}/v2/translate"
+        script.page_limit = pages
+        script.confirm_cost = False
+    else:
+        script.model = MockGeminiModel(server_url)
+        script.line_limit = pages
+
+# Function to translate sentences the way the script's whole-text path does
+def translate_all(name, script, sentences):
+    if name == 'deepl':
+        translate_window = script.translate_window
+    elif name == 'directors':
+        translate_window = script.translate_sentences
+    else:
+        translate_window = lambda window: script.translate_sentences(window, 'EN', 'DA')
+    if script.deduplicate:
+        translate_window = Deduplicator().wrap(translate_window)
+    return [translation for _, _, translation in translate_stream(sentences, translate_window)]
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.stages[stage] = time.perf_counter() - start
+        return result
+
+# Function to run one script through every stage on the given PDF and return its timings
+def benchmark_script(name, pdf_path, pages, server, workers=None, streaming=False, parallel_rendering=False):
+    script = load_script(name)
+    configure_script(name, script, server.url, pages, workers, parallel_rendering)
+    timer = StageTimer()
+    metrics.reset()
+    requests_before = server.requests
+    output_dir = tempfile.mkdtemp(prefix='benchmark_')
+    output_pdf = os.path.join(output_dir, f"{name}.pdf")
+
+    if name == 'genai':
+        text = timer.run('extract_text_from_pdf', script.extract_text_from_file, pdf_path)
+        cleaned = timer.run('clean_text', script.clean_text, text)
+        sentences = timer.run('split_sentences', script.split_sentences, cleaned)
+        translations = timer.run('translation', translate_all, name, script, sentences)
+        timer.run('generate_pdf', script.generate_pdf, sentences, translations, output_pdf, True)
+    else:
+        text = timer.run('extract_text_from_pdf', script.extract_text_from_pdf, pdf_path)
+        cleaned = timer.run('clean_text', script.clean_text, text)
+        segments = timer.run('split_sentences', script.create_segments_from_text, cleaned)
+        sentences = segments.sentences
+        translations = timer.run('translation', translate_all, name, script, sentences)
+        segments.set_translations(translations)
+        timer.run('generate_pdf', script.generate_pdf, segments, output_pdf)
+
+    if streaming:
+        streamed_pdf = os.path.join(output_dir, f"{name}_streamed.pdf")
+        if name == 'genai':
+            timer.run('streaming_pipeline', script.run_streaming_pipeline, pdf_path, streamed_pdf, 'EN', 'DA')
+        else:
+            timer.run('streaming_pipeline', script.run_streaming_pipeline, pdf_path, streamed_pdf)
+
+    rows = len(sentences)
+    stages = timer.stages
+    total = sum(seconds for stage, seconds in stages.items() if stage != 'streaming_pipeline')
+    result = {
+        'script': name,
+        'pages': pages,
+        'sentences': rows,
+        'characters': sum(len(sentence) for sentence in sentences),
+        'failed_rows': sum(1 for translation in translations if translation.startswith('[Translation Error')),
+        'requests': server.requests - requests_before,
+        'stages': {stage: round(seconds, 4) for stage, seconds in stages.items()},
+        'total_sec': round(total, 4),
+        'throughput': {
+            'pages_per_sec': round(pages / stages['extract_text_from_pdf'], 2),
+            'sentences_per_sec': round(rows / stages['translation'], 2) if stages['translation'] else None,
+            'rows_rendered_per_sec': round(rows / stages['generate_pdf'], 2),
+            'end_to_end_pages_per_sec': round(pages / total, 2),
+        },
+        'counters': metrics.snapshot()['counters'],
+        'api_latency': metrics.snapshot()['api_latency'],
+        'output_pdf': output_pdf,
+    }
+    if streaming:
+        result['throughput']['streaming_pages_per_sec'] = round(pages / stages['streaming_pipeline'], 2)
+    return result
+
+# Function to print one benchmark result as a readable table
+def print_result(result):
+    print(f"\n{result['script']}: {result['pages']} pages, {result['sentences']} sentences, "
+          f"{result['characters']} characters, {result['requests']} requests, {result['failed_rows']} failed rows")
+    for stage, seconds in result['stages'].items():
+        print(f"  {stage:<24}{seconds:>10.3f} s")
+    print(f"  {'total':<24}{result['total_sec']:>10.3f} s")
+    for metric, value in result['throughput'].items():
+        print(f"  {metric:<24}{value:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the translators offline on synthetic PDFs against mock DeepL and Gemini servers.")
+    parser.add_argument('--script', choices=sorted(script_files) + ['all'], default='all', help="translator to benchmark")
+    parser.add_argument('--pages', type=int, default=20, help="pages in the synthetic PDF")
+    parser.add_argument('--layout', choices=['prose', 'screenplay'], help="synthetic PDF layout (default depends on the script)")
+    parser.add_argument('--pdf', help="benchmark this PDF instead of a synthetic one")
+    parser.add_argument('--latency', type=float, default=0.05, help="mock API latency per request in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random +/- variation of the latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of mock API requests that fail with 429/503")
+    parser.add_argument('--workers', type=int, help="override max_workers in the scripts")
+    parser.add_argument('--streaming', action='store_true', help="also time the streaming pipeline end to end")
+    parser.add_argument('--parallel-rendering', action='store_true', help="render the streamed PDF in parts on every CPU core")
+    parser.add_argument('--json', help="write the results to this JSON file for comparing versions")
+    args = parser.parse_args()
+
+    server = start_mock_server(args.latency, args.jitter, args.error_rate)
+    names = sorted(script_files) if args.script == 'all' else [args.script]
+    results = []
+    with tempfile.TemporaryDirectory(prefix='benchmark_pdfs_') as pdf_dir:
+        for name in names:
+            pdf_path = args.pdf
+            if not pdf_path:
+                layout = args.layout or default_layouts[name]
+                pdf_path = os.path.join(pdf_dir, f"{layout}_{args.pages}.pdf")
+                if not os.path.exists(pdf_path):
+                    make_synthetic_pdf(pdf_path, args.pages, layout)
+            pages = min(args.pages, count_pages(pdf_path))
+            try:
+                result = benchmark_script(name, pdf_path, pages, server, args.workers, args.streaming, args.parallel_rendering)
+            except Exception as e:
+                # A script that gives up on mock API errors is a result too, not a reason to stop
+                print(f"\n{name}: failed with {type(e).__name__}: {e}")
+                results.append({'script': name, 'pages': pages, 'error': f"{type(e).__name__}: {e}"})
+                continue
+            print_result(result)
+            results.append(result)
+    server.shutdown()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'settings': vars(args), 'results': results}, file, indent=2)
+        print(f"\nResults written to {args.json}")
+
+if __name__ == "__main__":
+    main()
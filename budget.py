@@ -0,0 +1,176 @@
+import threading
+import time
+from metrics import metrics
+from translation_memory import normalize_text
+
+# Character and cost budget for a run. Before translation, plan_budget works out which segments
+# still have to be sent (not in the journal or translation memory, each repeated segment once),
+# and picks them in priority order until the budget or the account's remaining quota is used up.
+# The characters of the priority pages are held back for them, as translation still runs in reading
+# order. During the run every request reserves its characters first, and the account usage is re-read
+# now and then, so the run stops cleanly at the cap instead of sending requests that fail with 456.
+
+cost_per_million_chars = 20.00  # Price per million characters, in euros
+usage_check_sec = 30  # How often the account usage is re-read during a run
+BUDGET_ERROR = "[Translation Error: Budget reached]"  # Rows left untranslated by the budget; retried on --resume
+
+class TranslationBudget:
+    # max_characters and max_cost (in euros) cap this run; None leaves that cap off.
+    # usage() returns the account's (characters used, character limit), or None if unknown.
+    def __init__(self, max_characters=None, max_cost=None, cost_per_million=cost_per_million_chars, usage=None):
+        self.cost_per_million = cost_per_million
+        caps = [cap for cap in (max_characters, max_cost and int(max_cost * 1_000_000 / cost_per_million)) if cap]
+        self.max_characters = min(caps) if caps else None
+        self.usage = usage
+        self.spent = 0  # Characters reserved by requests sent or in flight
+        self.held = {}  # Normalized priority segment -> characters held back for it until it is sent
+        self.held_total = 0
+        self.account_cap = None  # Value of spent at which the account's quota runs out, from the last usage check
+        self.stopped = False
+        self._usage_checked = None
+        self._lock = threading.Lock()
+
+    def cost_of(self, characters):
+        return characters / 1_000_000 * self.cost_per_million
+
+    # Function to re-read the account usage, at most every usage_check_sec unless forced
+    def check_usage(self, force=False):
+        if self.usage is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._usage_checked is not None and now - self._usage_checked < usage_check_sec:
+                return
+            self._usage_checked = now
+            spent = self.spent
+        try:
+            usage = self.usage()
+        except Exception as e:
+            print(f"Could not read the account usage: {e}")
+            return
+        with self._lock:
+            if usage is not None and usage[1]:
+                # Characters this run sent before the check are in the account's count already
+                self.account_cap = max(0, usage[1] - usage[0]) + spent
+
+    # Function to return the characters this run may still send, or None if unlimited.
+    # Characters held for priority segments are not counted as available.
+    def remaining(self):
+        self.check_usage()
+        with self._lock:
+            remaining = self._remaining()
+            return None if remaining is None else max(0, remaining - self.held_total)
+
+    def _remaining(self):
+        limits = [limit - self.spent for limit in (self.max_characters, self.account_cap) if limit is not None]
+        return max(0, min(limits)) if limits else None
+
+    # Function to hold characters back for priority segments ({normalized segment: characters}), so
+    # segments sent earlier in reading order cannot use up the budget before the priority pages come
+    def hold(self, segments):
+        with self._lock:
+            self.held.update(segments)
+            self.held_total = sum(self.held.values())
+
+    # Function to claim the characters of one request's sentences; returns False, and stops the run,
+    # if they do not fit. Priority sentences use their held characters; the others only what is left.
+    def reserve(self, sentences):
+        self.check_usage()
+        with self._lock:
+            keys = {normalize_text(sentence) for sentence in sentences}
+            held = sum(self.held.get(key, 0) for key in keys)
+            characters = sum(len(sentence) for sentence in sentences)
+            remaining = self._remaining()
+            # After a usage check lowered the cap, priority sentences still come before the rest
+            fits = remaining is None or (characters <= remaining and characters - held <= remaining - self.held_total)
+            # Once stopped, only requests made up of held priority sentences still go out
+            if not fits or (self.stopped and characters > held):
+                if not self.stopped:
+                    self.stopped = True
+                    metrics.count('budget.stopped')
+                    print(f"Budget reached after {self.spent} characters (€{self.cost_of(self.spent):.2f}); the remaining rows"
+                          f"{' outside the priority pages' if self.held else ''} are left untranslated. "
+                          "Run again with --resume and a larger budget to finish.")
+                return False
+            for key in keys:
+                self.held.pop(key, None)
+            self.held_total -= held
+            self.spent += characters
+            return True
+
+    # Function to give back the characters of a request that failed and was not billed
+    def release(self, characters):
+        with self._lock:
+            self.spent -= characters
+
+    def report(self):
+        print(f"Budget: {self.spent} characters sent (€{self.cost_of(self.spent):.2f})"
+              + (f" of {self.max_characters} allowed" if self.max_characters else ""))
+        metrics.count('budget.characters', self.spent)
+
+# Function to parse page ranges such as "1-20,45,50-60" into [(1, 20), (45, 45), (50, 60)]
+def parse_page_ranges(text):
+    ranges = []
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        try:
+            ranges.append((int(first), int(last or first)))
+        except ValueError:
+            raise ValueError(f"Invalid page range: {part.strip()!r}") from None
+    return ranges
+
+def on_pages(page, page_ranges):
+    return page is not None and any(first <= page <= last for first, last in page_ranges)
+
+# Function to order segment numbers by priority: segments on the first page range first, then
+# the next range, and everything else in reading order. page_of(number) returns a segment's page.
+def priority_order(count, page_of, priority_pages=()):
+    rank = {}
+    for number in range(1, count + 1):
+        page = page_of(number)
+        rank[number] = next((idx for idx, (first, last) in enumerate(priority_pages)
+                             if page is not None and first <= page <= last), len(priority_pages))
+    return sorted(range(1, count + 1), key=lambda number: (rank[number], number))
+
+# Function to plan a run. sentences are all segments in order, is_done(number, sentence) tells if a
+# segment needs no request (journal or memory). Returns (billable characters, planned characters, blocked).
+# Segments are taken in priority order: the priority pages, then the rest from the start of the book,
+# stopping at the first segment that does not fit. Outside the priority pages the translated part is
+# therefore one run from the start, which may end before the first priority page. blocked is the set
+# of normalized segments left over. The planned priority segments are held in the budget.
+def plan_budget(sentences, budget, page_of, priority_pages=(), is_done=None):
+    billable = {}
+    for number, sentence in enumerate(sentences, start=1):
+        key = normalize_text(sentence)
+        if key not in billable and not (is_done and is_done(number, sentence)):
+            billable[key] = len(sentence)
+    remaining = budget.remaining() if budget else None
+    planned = 0
+    blocked = set()
+    priority = {}
+    for number in priority_order(len(sentences), page_of, priority_pages):
+        key = normalize_text(sentences[number - 1])
+        if key not in billable or key in blocked:
+            continue
+        if blocked or (remaining is not None and planned + billable[key] > remaining):
+            blocked.add(key)
+            continue
+        if on_pages(page_of(number), priority_pages):
+            priority[key] = billable[key]
+        planned += billable.pop(key)
+    if budget and priority:
+        budget.hold(priority)
+    return planned + sum(billable.values()), planned, blocked
+
+# Function to wrap a translate_window(sentences) function so segments the plan left out are not sent
+def gate_window(translate_window, blocked):
+    def translate(sentences):
+        sentences = list(sentences)
+        inside = [idx for idx, sentence in enumerate(sentences) if normalize_text(sentence) not in blocked]
+        translations = [BUDGET_ERROR] * len(sentences)
+        if inside:
+            for idx, translation in zip(inside, translate_window([sentences[idx] for idx in inside])):
+                translations[idx] = translation
+        metrics.count('budget.skipped_segments', len(sentences) - len(inside))
+        return translations
+    return translate
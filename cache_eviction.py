@@ -0,0 +1,26 @@
+# Least recently used eviction shared by the SQLite caches (translation memory and page cache).
+# Their tables have a size and a last_used column; the cache keeps a running total of the stored
+# bytes, so the whole table is only summed when that total passes the limit.
+
+evict_to_fraction = 0.9  # Eviction frees space down to this share of max_bytes, so it runs now and then rather than on every store
+
+# Function to add the size of newly stored rows to the running total (None before the first count),
+# and evict the least recently used rows of table once it passes max_bytes. Replaced rows and other
+# processes sharing the file make the total drift, so it is recounted from the table before evicting.
+# Returns (new running total, evicted rows). Call it with the cache's lock held, before its commit.
+def evict_lru(conn, table, max_bytes, size, added):
+    if size is not None and size + added <= max_bytes:
+        return size + added, 0
+    total = conn.execute(f'SELECT COALESCE(SUM(size), 0) FROM {table}').fetchone()[0]
+    if total <= max_bytes:
+        return total, 0
+    target = int(max_bytes * evict_to_fraction)
+    victims = []
+    freed = 0
+    for rowid, row_size in conn.execute(f'SELECT rowid, size FROM {table} ORDER BY last_used'):
+        if total - freed <= target:
+            break
+        victims.append((rowid,))
+        freed += row_size
+    conn.executemany(f'DELETE FROM {table} WHERE rowid = ?', victims)
+    return total - freed, len(victims)
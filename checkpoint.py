@@ -0,0 +1,76 @@
+import json
+import os
+import re
+import time
+
+journal_dir = 'Journals'  # Directory holding one journal per book and language pair
+flush_every = 50  # Records buffered before the journal is flushed to disk
+flush_interval_sec = 10  # ...or this many seconds, whichever comes first
+
+# Function to derive the journal file for a source file and language pair
+def journal_path_for(input_path, source_language, target_language, directory=journal_dir):
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    name = re.sub(r'[^\w.-]+', '_', name).strip('_')
+    return os.path.join(directory, f"{name}.{source_language}-{target_language}.jsonl".lower())
+
+# Append-only journal of completed (index, source, translation) records
+class TranslationJournal:
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = {}
+        if resume:
+            self.done = self._load()
+            print(f"Resuming: {len(self.done)} translated sentences found in {path}")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def _load(self):
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # A torn last line from a crash mid-write
+                done[record['index']] = (record['source'], record['translation'])
+        return done
+
+    # Function to return the journaled translation of a sentence, or None if it still has to be done.
+    # The source text must match, so a changed segmentation never reuses the wrong row.
+    def lookup(self, index, source):
+        record = self.done.get(index)
+        if record and record[0] == source:
+            return record[1]
+        return None
+
+    def record(self, index, source, translation):
+        if translation.startswith('[Translation Error'):
+            return  # Failed rows are retried on --resume
+        self.done[index] = (source, translation)
+        self._file.write(json.dumps({'index': index, 'source': source, 'translation': translation}, ensure_ascii=False) + '\n')
+        self._pending += 1
+        if self._pending >= flush_every or time.monotonic() - self._last_flush >= flush_interval_sec:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
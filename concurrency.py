@@ -0,0 +1,53 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Token bucket refilled at a fixed rate; capacity allows short bursts
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Function to block until `amount` tokens are available and take them.
+    # Requests larger than the capacity wait for a full bucket and go into debt.
+    def acquire(self, amount=1):
+        amount = float(amount)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                needed = min(amount, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Shared limiter for requests/sec and chars/sec; None disables a limit
+class RateLimiter:
+    def __init__(self, requests_per_sec=None, chars_per_sec=None):
+        self.request_bucket = TokenBucket(requests_per_sec) if requests_per_sec else None
+        self.char_bucket = TokenBucket(chars_per_sec) if chars_per_sec else None
+
+    def acquire(self, chars=0):
+        if self.request_bucket:
+            self.request_bucket.acquire(1)
+        if self.char_bucket and chars:
+            self.char_bucket.acquire(chars)
+
+# Function to run `function` over `items` with up to `max_workers` calls in flight.
+# Results come back in the same order as `items`, whatever order the calls finish in.
+def map_ordered(function, items, max_workers=1, limiter=None, cost=len):
+    def run(item):
+        if limiter:
+            limiter.acquire(cost(item))
+        return function(item)
+
+    if max_workers <= 1:
+        return [run(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, items))
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from translation_memory import normalize_text, is_error_translation
+from metrics import metrics
+
+max_remembered_segments = 50000  # Translations kept for reuse by later windows of the same document
+
+# Sends each unique normalized segment to the engine once and fans the result back out to
+# every row that repeats it. Repeats are found within a window and across earlier windows.
+class Deduplicator:
+    def __init__(self, max_entries=max_remembered_segments):
+        self.max_entries = max_entries
+        self.seen = OrderedDict()  # normalized segment -> translation, least recently used first
+        self.segments_total = 0
+        self.segments_saved = 0
+        self.chars_total = 0
+        self.chars_saved = 0
+
+    # Function to translate a window of segments, calling translate_window only for unique ones
+    def translate(self, sentences, translate_window):
+        sentences = list(sentences)
+        keys = [normalize_text(sentence) for sentence in sentences]
+        unique = OrderedDict()  # normalized segment -> first sentence that has it
+        for key, sentence in zip(keys, sentences):
+            if key not in self.seen and key not in unique:
+                unique[key] = sentence
+
+        if unique:
+            fresh = dict(zip(unique, translate_window(list(unique.values()))))
+        else:
+            fresh = {}
+        translations = []
+        for key in keys:
+            if key in fresh:
+                translations.append(fresh[key])
+            else:
+                self.seen.move_to_end(key)
+                translations.append(self.seen[key])
+
+        for key, translation in fresh.items():
+            if not is_error_translation(translation):
+                self.seen[key] = translation
+        while len(self.seen) > self.max_entries:
+            self.seen.popitem(last=False)
+
+        segments_saved = len(sentences) - len(unique)
+        chars_saved = sum(len(sentence) for sentence in sentences) - sum(len(sentence) for sentence in unique.values())
+        self.segments_total += len(sentences)
+        self.segments_saved += segments_saved
+        self.chars_total += sum(len(sentence) for sentence in sentences)
+        self.chars_saved += chars_saved
+        metrics.count('dedup.segments_saved', segments_saved)
+        metrics.count('dedup.chars_saved', chars_saved)
+        return translations
+
+    # Function to wrap a translate_window(sentences) function with deduplication
+    def wrap(self, translate_window):
+        return lambda sentences: self.translate(sentences, translate_window)
+
+    def stats(self):
+        return {
+            'segments': self.segments_total,
+            'segments_saved': self.segments_saved,
+            'chars': self.chars_total,
+            'chars_saved': self.chars_saved,
+        }
+
+    def report(self):
+        print(f"Deduplication: {self.segments_saved} of {self.segments_total} segments were repeats; "
+              f"{self.chars_saved} of {self.chars_total} characters were not sent for translation")
@@ -0,0 +1,131 @@
+import gzip
+import time
+from urllib.parse import quote_plus, urlencode
+from concurrency import map_ordered
+from metrics import metrics
+from translation_memory import ENGINE_DEEPL_SDK, ENGINE_DEEPL_REST
+
+# DeepL per-request limits: at most 50 texts and 128 KiB of request body
+max_texts_per_request = 50
+max_request_bytes = 128 * 1024
+deepl_free_api_url = 'https://api-free.deepl.com/v2/translate'
+connect_timeout_sec = 5  # Time allowed to open a connection to DeepL
+read_timeout_sec = 60  # Time allowed for DeepL to answer once the request is sent
+compress_min_bytes = 2048  # With compression on, request bodies at least this big are gzipped
+
+# Size of a sentence once it is form-encoded into a request body ("&text=...")
+def encoded_size(sentence):
+    return len(quote_plus(sentence)) + len('&text=')
+
+# Function to pack sentences into batches that respect DeepL's per-request limits.
+# Yields (start, end) index pairs so results can be mapped back to rows in order.
+def batch_sentences(sentences, max_texts=max_texts_per_request, max_bytes=max_request_bytes):
+    # Leave room for auth, language and other form fields
+    budget = max_bytes - 1024
+    start = 0
+    size = 0
+    for idx, sentence in enumerate(sentences):
+        sentence_size = encoded_size(sentence)
+        if idx > start and (idx - start >= max_texts or size + sentence_size > budget):
+            yield start, idx
+            start = idx
+            size = 0
+        size += sentence_size
+    if start < len(sentences):
+        yield start, len(sentences)
+
+# Function to send one batch with the DeepL SDK and record the request; raises deepl.DeepLException
+def send_sdk_batch(translator, batch, source_language, target_language):
+    import deepl
+
+    request_start = time.perf_counter()
+    try:
+        results = translator.translate_text(batch, source_lang=source_language, target_lang=target_language)
+    except deepl.DeepLException:
+        metrics.observe_request(ENGINE_DEEPL_SDK, time.perf_counter() - request_start, ok=False)
+        raise
+    billed = [result.billed_characters for result in results]
+    metrics.observe_request(ENGINE_DEEPL_SDK, time.perf_counter() - request_start, characters=sum(len(sentence) for sentence in batch),
+                            billed=None if None in billed else sum(billed))
+    return [result.text for result in results]
+
+# Function to translate sentences in batches with the official DeepL SDK,
+# keeping up to max_workers batches in flight. With a retry policy, failed batches are retried under it.
+def translate_batched_sdk(translator, sentences, source_language, target_language, max_workers=1, limiter=None, policy=None):
+    import deepl
+
+    sentences = list(sentences)
+
+    def translate_batch(batch_range):
+        start, end = batch_range
+        metrics.progress(f"Translating sentences: {start + 1}-{end} of {len(sentences)}")
+        try:
+            if policy:
+                return policy.call(send_sdk_batch, translator, sentences[start:end], source_language, target_language)
+            return send_sdk_batch(translator, sentences[start:end], source_language, target_language)
+        except deepl.DeepLException as e:
+            print(f"DeepL API error: {e}")
+            return ["[Translation Error]"] * (end - start)
+
+    def batch_chars(batch_range):
+        return sum(len(sentence) for sentence in sentences[batch_range[0]:batch_range[1]])
+
+    batches = list(batch_sentences(sentences))
+    translations = []
+    for batch_translations in map_ordered(translate_batch, batches, max_workers, limiter, cost=batch_chars):
+        translations.extend(batch_translations)
+    return translations
+
+# Pooled keep-alive HTTP transport for the DeepL REST API, shared by all worker threads.
+# Connections are opened once and reused, so requests after the first skip the TCP and TLS handshakes.
+# api_url can point at a local stand-in server for testing.
+class DeepLTransport:
+    def __init__(self, auth_key, api_url=deepl_free_api_url, pool_size=8, connect_timeout=connect_timeout_sec,
+                 read_timeout=read_timeout_sec, compress=False):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.api_url = api_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.compress = compress
+        self.session = requests.Session()
+        # pool_block keeps the number of open connections at pool_size; extra threads wait for a free one
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Authorization': f'DeepL-Auth-Key {auth_key}', 'Accept-Encoding': 'gzip'})
+
+    # Function to send one batch of sentences; raises requests exceptions, e.g. HTTPError for a 456 or 5xx
+    def translate(self, batch, source_language, target_language):
+        import requests
+
+        data = [('text', sentence) for sentence in batch]
+        data += [('source_lang', source_language), ('target_lang', target_language), ('show_billed_characters', '1')]
+        body = urlencode(data).encode('utf-8')
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if self.compress and len(body) >= compress_min_bytes:
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        request_start = time.perf_counter()
+        try:
+            response = self.session.post(self.api_url, data=body, headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            metrics.observe_request(ENGINE_DEEPL_REST, time.perf_counter() - request_start, ok=False)
+            raise
+        translations = response.json()['translations']
+        billed = [translation.get('billed_characters') for translation in translations]
+        metrics.observe_request(ENGINE_DEEPL_REST, time.perf_counter() - request_start, characters=sum(len(sentence) for sentence in batch),
+                                billed=None if None in billed else sum(billed))
+        return [translation['text'] for translation in translations]
+
+    # Function to read the account's character usage as (count, limit) from the usage endpoint next to api_url
+    def usage(self):
+        usage_url = self.api_url.rsplit('/translate', 1)[0] + '/usage'
+        response = self.session.get(usage_url, timeout=self.timeout)
+        response.raise_for_status()
+        usage = response.json()
+        return usage['character_count'], usage.get('character_limit')
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,286 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dedup import max_remembered_segments
+from metrics import metrics
+from retry_policy import RetryPolicy, classify, retry_after_of, ERROR_THROTTLED, ERROR_QUOTA, ERROR_FATAL
+from translation_memory import ENGINE_DEEPL_SDK, ENGINE_DEEPL_REST, ENGINE_GEMINI, is_error_translation
+
+# Translation engines behind one interface, and a router that spreads batches across them by
+# observed latency, error rate and remaining quota, failing over to another engine instead of
+# giving up when one throttles, errors or runs out of quota.
+#
+# An engine has a name, translate(batch, source, target) returning one translation per sentence
+# (raising when the request fails) and usage() returning (characters used, character limit) or None.
+
+usage_refresh_sec = 60  # How often the router asks an engine for its remaining quota
+throttle_cooldown_sec = 10  # How long a throttled engine gets no new batches without a Retry-After
+error_cooldown_sec = 5  # How long an engine gets no new batches after a failed batch
+latency_smoothing = 0.3  # Weight of the newest request in the latency and error rate averages
+failover_attempts = 1  # Tries per request on one engine before the router fails over, when there are several engines
+failover_rounds = 3  # Passes over all engines before a batch's remaining rows are given up as errors
+
+# Raised when every engine is out of quota, so nothing more can be translated in this run
+class NoEngineAvailable(Exception):
+    pass
+
+class DeepLRestEngine:
+    name = ENGINE_DEEPL_REST
+
+    def __init__(self, transport, retry):
+        self.transport = transport
+        self.retry = retry
+
+    def translate(self, batch, source, target):
+        return self.retry.call(self.transport.translate, batch, source, target)
+
+    def usage(self):
+        return self.transport.usage()
+
+class DeepLSdkEngine:
+    name = ENGINE_DEEPL_SDK
+
+    def __init__(self, translator, retry):
+        self.translator = translator
+        self.retry = retry
+
+    def translate(self, batch, source, target):
+        from deepl_client import send_sdk_batch
+        return self.retry.call(send_sdk_batch, self.translator, batch, source, target)
+
+    def usage(self):
+        usage = self.translator.get_usage().character
+        return (usage.count, usage.limit) if usage.valid else None
+
+# Gemini through a google.generativeai GenerativeModel (or a stand-in with the same generate_content).
+# Batches go out as packed prompts; sentences whose packed reply does not map back are retried in smaller packs.
+class GeminiEngine:
+    name = ENGINE_GEMINI
+
+    def __init__(self, model, retry, token_budget=2000):
+        self.model = model
+        self.retry = retry
+        self.token_budget = token_budget
+
+    def _send(self, prompt, **kwargs):
+        request_start = time.perf_counter()
+        try:
+            response = self.model.generate_content(prompt, **kwargs)
+        except Exception:
+            metrics.observe_request(self.name, time.perf_counter() - request_start, ok=False)
+            raise
+        metrics.observe_request(self.name, time.perf_counter() - request_start, characters=len(prompt))
+        return response.text
+
+    def translate(self, batch, source, target):
+        from gemini_packing import translate_packed
+        prompt_prefix = (f"You are a translator. Your job is to translate the following text from {source} to {target}. "
+                         "Be as literate as possible with the words, because your output will be used to learn vocabulary.")
+        generate_packed = lambda prompt: self.retry.call(self._send, prompt, generation_config={'response_mime_type': 'application/json'})
+        generate_single = lambda sentence: self.retry.call(self._send, f"{prompt_prefix}\n\nText: {sentence}")
+        return translate_packed(batch, prompt_prefix, generate_packed, generate_single, self.token_budget)
+
+    def usage(self):
+        return None  # Gemini has no quota endpoint; its limits show up as 429s
+
+# Health of one engine as the router has seen it
+class EngineState:
+    def __init__(self, engine):
+        self.engine = engine
+        self.latency = None  # Smoothed seconds per batch
+        self.error_rate = 0.0  # Smoothed share of failed batches
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.quota_exhausted = False
+        self.remaining = None  # Characters left in the quota, None if unknown or unlimited
+        self.usage_checked = 0.0
+
+    # Expected wait for a new batch: everything in flight plus this batch at the engine's speed,
+    # weighed up by its error rate. Engines without measurements are tried first.
+    def score(self):
+        return (self.in_flight + 1) * (self.latency or 0.0) * (1 + 4 * self.error_rate)
+
+    def to_dict(self):
+        return {'latency_sec': round(self.latency, 4) if self.latency is not None else None,
+                'error_rate': round(self.error_rate, 3), 'remaining_quota': self.remaining,
+                'quota_exhausted': self.quota_exhausted}
+
+class EngineRouter:
+    def __init__(self, engines):
+        if not engines:
+            raise ValueError("The router needs at least one engine")
+        self.states = [EngineState(engine) for engine in engines]
+        self._lock = threading.Lock()
+
+    # Function to translate a batch on the best available engine, failing over to the others.
+    # Returns (translations, engines) with the engine that produced each translation. Sentences an
+    # engine returned as error rows are sent to the next engine. Raises the last error if no engine
+    # could translate the batch at all, or NoEngineAvailable if every engine is out of quota.
+    def translate(self, batch, source, target):
+        batch = list(batch)
+        translations = [None] * len(batch)
+        engines = [None] * len(batch)
+        pending = list(range(len(batch)))
+        tried = set()
+        rounds = 0
+        last_error = None
+        while pending:
+            state = self._choose(sum(len(batch[idx]) for idx in pending), tried)
+            if state is None:
+                if not tried and not rounds:
+                    raise NoEngineAvailable("Every engine is out of quota")
+                rounds += 1
+                # One engine already retried under its own policy, and a fatal error will not go away
+                if rounds >= failover_rounds or not tried or len(self.states) == 1 \
+                        or (last_error is not None and classify(last_error) == ERROR_FATAL):
+                    break
+                tried = set()  # Every engine failed this batch; go round again once their cooldowns pass
+                continue
+            if tried or rounds:
+                metrics.count('router.failovers')
+            tried.add(id(state))
+            try:
+                results = self._send(state, [batch[idx] for idx in pending], source, target)
+            except Exception as error:
+                last_error = error
+                if len(self.states) > 1:
+                    print(f"{state.engine.name}: {type(error).__name__}: {error}; trying another engine")
+                continue
+            still_pending = []
+            for idx, translation in zip(pending, results):
+                translations[idx] = translation
+                engines[idx] = state.engine.name
+                if is_error_translation(translation):
+                    still_pending.append(idx)
+            pending = still_pending
+        if all(engine is None for engine in engines) and last_error is not None:
+            raise last_error
+        for idx in pending:
+            if translations[idx] is None:
+                translations[idx] = "[Translation Error]"
+        for engine in engines:
+            if engine:
+                metrics.count(f"rows.{engine}")
+        return translations, engines
+
+    # Function to pick the engine with the lowest score among those not tried yet for this batch,
+    # skipping engines out of quota and, while others are available, engines cooling down
+    def _choose(self, characters, tried):
+        now = time.monotonic()
+        for state in self.states:
+            self._refresh_usage(state, now)
+        with self._lock:
+            candidates = [state for state in self.states if id(state) not in tried and not state.quota_exhausted
+                          and (state.remaining is None or state.remaining >= characters)]
+            ready = [state for state in candidates if state.cooldown_until <= now]
+            if not candidates:
+                return None
+            state = min(ready or candidates, key=lambda state: (state.score(), state.cooldown_until))
+            state.in_flight += 1
+        if state.cooldown_until > now:
+            time.sleep(state.cooldown_until - now)  # Every engine is cooling down; wait for the first one
+        return state
+
+    def _send(self, state, batch, source, target):
+        start = time.perf_counter()
+        try:
+            translations = state.engine.translate(batch, source, target)
+        except Exception as error:
+            self._on_failure(state, error)
+            raise
+        finally:
+            with self._lock:
+                state.in_flight -= 1
+        with self._lock:
+            elapsed = time.perf_counter() - start
+            state.latency = elapsed if state.latency is None else (1 - latency_smoothing) * state.latency + latency_smoothing * elapsed
+            error_share = sum(1 for translation in translations if is_error_translation(translation)) / max(1, len(batch))
+            state.error_rate = (1 - latency_smoothing) * state.error_rate + latency_smoothing * error_share
+            if state.remaining is not None:
+                state.remaining -= sum(len(sentence) for sentence in batch)
+        return translations
+
+    def _on_failure(self, state, error):
+        kind = classify(error)
+        with self._lock:
+            state.error_rate = (1 - latency_smoothing) * state.error_rate + latency_smoothing
+            if kind == ERROR_QUOTA:
+                state.quota_exhausted = True
+                print(f"{state.engine.name}: quota exceeded; routing its batches to the other engines")
+            elif kind == ERROR_THROTTLED:
+                state.cooldown_until = time.monotonic() + (retry_after_of(error) or throttle_cooldown_sec)
+            elif kind != ERROR_FATAL:
+                state.cooldown_until = time.monotonic() + error_cooldown_sec
+        metrics.count(f"router.errors.{state.engine.name}")
+
+    # Function to ask an engine for its remaining quota once every usage_refresh_sec
+    def _refresh_usage(self, state, now):
+        with self._lock:
+            if now - state.usage_checked < usage_refresh_sec:
+                return
+            state.usage_checked = now
+        try:
+            usage = state.engine.usage()
+        except Exception as e:
+            print(f"{state.engine.name}: could not read usage: {e}")
+            return
+        with self._lock:
+            if usage is not None:
+                used, limit = usage
+                state.remaining = max(0, limit - used) if limit else None
+
+    def stats(self):
+        with self._lock:
+            return {state.engine.name: state.to_dict() for state in self.states}
+
+# Function to build the retry policy of one engine. With several engines a failed request goes
+# straight back to the router, which sends it to another engine instead of waiting out a backoff.
+def engine_retry_policy(name, max_concurrency, engine_count):
+    if engine_count > 1:
+        return RetryPolicy(name, max_concurrency, attempts=failover_attempts)
+    return RetryPolicy(name, max_concurrency)
+
+def engine_report_path(output_pdf):
+    return f"{os.path.splitext(output_pdf)[0]}.engines.jsonl"
+
+# Which engine translated which sentence in one run, so rows can be attributed after translation
+# memory, deduplication and the journal have reordered and merged the work. Create one per run.
+# Only the most recent sentences are kept: rows are tracked soon after their window is translated,
+# and older sentences are only needed again for repeats the deduplicator still remembers.
+class EngineLog:
+    def __init__(self, max_entries=max_remembered_segments):
+        self.max_entries = max_entries
+        self._engines = OrderedDict()  # sentence -> engine, least recently used first
+        self._lock = threading.Lock()
+
+    def record(self, sentences, engines):
+        with self._lock:
+            for sentence, engine in zip(sentences, engines):
+                if engine:
+                    self._engines[sentence] = engine
+                    self._engines.move_to_end(sentence)
+            while len(self._engines) > self.max_entries:
+                self._engines.popitem(last=False)
+
+    def engine_of(self, sentence):
+        with self._lock:
+            engine = self._engines.get(sentence)
+            if engine:
+                self._engines.move_to_end(sentence)
+            return engine
+
+    # Function to pass (number, sentence, translation) rows through, writing which engine produced
+    # each row as JSON lines next to the output PDF as they go; rows resumed from a journal have no engine on record
+    def track(self, rows, output_pdf):
+        path = engine_report_path(output_pdf)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        counts = {}
+        with open(path, 'w', encoding='utf-8') as file:
+            for row in rows:
+                engine = self.engine_of(row[1])
+                file.write(json.dumps({'row': row[0], 'engine': engine}) + '\n')
+                counts[engine or 'unknown'] = counts.get(engine or 'unknown', 0) + 1
+                yield row
+        print(f"Rows by engine: {counts} (written to {path})")
@@ -0,0 +1,95 @@
+import json
+import re
+from concurrency import map_ordered
+from metrics import metrics
+
+pack_token_budget = 2000  # Estimated source tokens per packed request; translations come back at a similar size
+chars_per_token = 4  # Rough estimate for Latin-script text
+
+packed_instructions = (
+    "The input is a JSON array of numbered items. Translate the text of every item separately. "
+    "Do not merge, split, skip or reorder items. "
+    'Reply with only a JSON array of objects {"id": <number>, "translation": <text>}, one per input item.'
+)
+
+# Function to estimate the number of tokens in a text
+def estimate_tokens(text):
+    return len(text) // chars_per_token + 1
+
+# Function to pack sentences into (start, end) ranges that stay under the token budget
+def pack_sentences(sentences, token_budget=pack_token_budget):
+    start = 0
+    tokens = 0
+    for idx, sentence in enumerate(sentences):
+        sentence_tokens = estimate_tokens(sentence) + 8  # JSON and numbering overhead
+        if idx > start and tokens + sentence_tokens > token_budget:
+            yield start, idx
+            start = idx
+            tokens = 0
+        tokens += sentence_tokens
+    if start < len(sentences):
+        yield start, len(sentences)
+
+# Function to build one prompt holding many numbered sentences
+def build_packed_prompt(prompt_prefix, batch):
+    items = [{'id': number, 'text': sentence} for number, sentence in enumerate(batch, start=1)]
+    return f"{prompt_prefix}\n\n{packed_instructions}\n\nInput: {json.dumps(items, ensure_ascii=False)}"
+
+# Function to parse a packed reply into one translation per item, or None if items were
+# merged, dropped or invented, so the caller can fall back to smaller packs
+def parse_packed_response(text, count):
+    text = text.strip()
+    fenced = re.match(r'^```(?:json)?\s*(.*?)\s*```$', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        items = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != count:
+        return None
+
+    translations = {}
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('translation'), str):
+            return None
+        try:
+            number = int(item.get('id'))
+        except (TypeError, ValueError):
+            return None
+        translations[number] = item['translation']
+    if sorted(translations) != list(range(1, count + 1)):
+        return None
+    return [translations[number] for number in range(1, count + 1)]
+
+# Function to translate sentences with packed prompts. generate_packed(prompt) and
+# generate_single(sentence) return response text. A pack whose reply does not map back
+# one-to-one is split in half and retried, down to single sentences.
+def translate_packed(sentences, prompt_prefix, generate_packed, generate_single,
+                     token_budget=pack_token_budget, max_workers=1, limiter=None):
+    sentences = list(sentences)
+
+    def translate_pack(batch):
+        # Every request, including the retries of split packs, goes through the limiter
+        if limiter:
+            limiter.acquire(sum(len(sentence) for sentence in batch))
+        if len(batch) == 1:
+            return [generate_single(batch[0])]
+        try:
+            reply = generate_packed(build_packed_prompt(prompt_prefix, batch))
+        except Exception as e:
+            print(f"Gemini API error for {len(batch)} packed sentences: {e}")
+            return ['[Translation Error]'] * len(batch)  # One row per sentence, so later translations stay aligned
+        translations = parse_packed_response(reply, len(batch))
+        if translations is not None:
+            return translations
+        print(f"Packed reply for {len(batch)} sentences did not match, retrying in smaller packs")
+        metrics.count('retries.gemini.pack_splits')
+        middle = len(batch) // 2
+        return translate_pack(batch[:middle]) + translate_pack(batch[middle:])
+
+    packs = [sentences[start:end] for start, end in pack_sentences(sentences, token_budget)]
+    translations = []
+    for pack_translations in map_ordered(translate_pack, packs, max_workers):
+        translations.extend(pack_translations)
+    return translations
@@ -0,0 +1,297 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+from metrics import metrics
+
+# Durable batch-job queue in SQLite. Each book is split into page-range shards that worker
+# processes claim, translate and write to row files; once every shard of a book is done,
+# one worker merges the rows in page order and renders the book's PDF.
+# Workers on several machines can share a queue directory on a shared filesystem.
+
+queue_dir = 'Jobs'  # Queue database and shard row files
+shard_pages = 20  # Pages per shard
+lease_sec = 30 * 60  # A claimed shard goes back to the queue if its worker has not finished it by then
+max_attempts = 3  # Attempts per shard before its book is marked failed
+poll_interval_sec = 2  # How often an idle worker looks for new work
+
+SHARD_PENDING = 'pending'
+SHARD_CLAIMED = 'claimed'
+SHARD_DONE = 'done'
+SHARD_FAILED = 'failed'
+
+BOOK_QUEUED = 'queued'
+BOOK_MERGING = 'merging'
+BOOK_DONE = 'done'
+BOOK_FAILED = 'failed'
+
+def make_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class JobQueue:
+    def __init__(self, directory=queue_dir):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Autocommit mode with explicit BEGIN IMMEDIATE, so a claim is one atomic read-and-update
+        self._conn = sqlite3.connect(os.path.join(directory, 'queue.sqlite3'), timeout=60, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS books ('
+            ' id INTEGER PRIMARY KEY, input_path TEXT, output_pdf TEXT, settings TEXT,'
+            ' status TEXT, claimed_at REAL, error TEXT, UNIQUE (input_path, output_pdf));'
+            'CREATE TABLE IF NOT EXISTS shards ('
+            ' id INTEGER PRIMARY KEY, book_id INTEGER, first_page INTEGER, last_page INTEGER,'
+            ' status TEXT, worker TEXT, claimed_at REAL, attempts INTEGER DEFAULT 0,'
+            ' rows_path TEXT, error TEXT);'
+            'CREATE INDEX IF NOT EXISTS shards_status ON shards (status, book_id, first_page);'
+        )
+
+    def _transaction(self):
+        self._conn.execute('BEGIN IMMEDIATE')
+
+    # Function to queue a book as shards of pages [0, page_count). A book that failed earlier is
+    # queued again with its failed shards reset; a book already queued or done is left alone.
+    def add_book(self, input_path, output_pdf, page_count, settings=None, pages_per_shard=shard_pages):
+        self._transaction()
+        try:
+            book = self._conn.execute('SELECT id, status FROM books WHERE input_path = ? AND output_pdf = ?',
+                                      (input_path, output_pdf)).fetchone()
+            if book and book['status'] != BOOK_FAILED:
+                self._conn.execute('COMMIT')
+                return None
+            if book:
+                self._conn.execute('UPDATE books SET status = ?, error = NULL WHERE id = ?', (BOOK_QUEUED, book['id']))
+                self._conn.execute('UPDATE shards SET status = ?, attempts = 0, error = NULL WHERE book_id = ? AND status = ?',
+                                   (SHARD_PENDING, book['id'], SHARD_FAILED))
+                self._conn.execute('COMMIT')
+                return book['id']
+            book_id = self._conn.execute(
+                'INSERT INTO books (input_path, output_pdf, settings, status) VALUES (?, ?, ?, ?)',
+                (input_path, output_pdf, json.dumps(settings or {}), BOOK_QUEUED)
+            ).lastrowid
+            for first_page in range(0, max(page_count, 1), pages_per_shard):
+                self._conn.execute(
+                    'INSERT INTO shards (book_id, first_page, last_page, status) VALUES (?, ?, ?, ?)',
+                    (book_id, first_page, min(first_page + pages_per_shard, max(page_count, 1)), SHARD_PENDING)
+                )
+            self._conn.execute('COMMIT')
+            return book_id
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    def _shard_with_book(self, shard_id):
+        row = self._conn.execute(
+            'SELECT shards.*, books.input_path, books.output_pdf, books.settings FROM shards'
+            ' JOIN books ON books.id = shards.book_id WHERE shards.id = ?', (shard_id,)
+        ).fetchone()
+        shard = dict(row)
+        shard['settings'] = json.loads(shard['settings'])
+        return shard
+
+    # Function to claim the next pending shard, or one whose lease ran out; None if there is none
+    def claim_shard(self, worker):
+        now = time.time()
+        self._transaction()
+        try:
+            row = self._conn.execute(
+                'SELECT shards.id FROM shards JOIN books ON books.id = shards.book_id'
+                ' WHERE books.status = ? AND (shards.status = ? OR (shards.status = ? AND shards.claimed_at < ?))'
+                ' ORDER BY shards.book_id, shards.first_page LIMIT 1',
+                (BOOK_QUEUED, SHARD_PENDING, SHARD_CLAIMED, now - lease_sec)
+            ).fetchone()
+            if row is None:
+                self._conn.execute('COMMIT')
+                return None
+            self._conn.execute('UPDATE shards SET status = ?, worker = ?, claimed_at = ?, attempts = attempts + 1 WHERE id = ?',
+                               (SHARD_CLAIMED, worker, now, row['id']))
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        return self._shard_with_book(row['id'])
+
+    # Function to mark a shard done; returns False if the worker's lease ran out and another worker took the shard over
+    def complete_shard(self, shard_id, rows_path, worker):
+        cursor = self._conn.execute('UPDATE shards SET status = ?, rows_path = ?, error = NULL WHERE id = ? AND status = ? AND worker = ?',
+                                    (SHARD_DONE, rows_path, shard_id, SHARD_CLAIMED, worker))
+        return cursor.rowcount > 0
+
+    # Function to record a failed attempt; the shard is retried until max_attempts, then its book fails.
+    # Returns False, leaving the shard alone, if the worker's lease ran out and another worker took it over.
+    def fail_shard(self, shard_id, error, worker):
+        self._transaction()
+        try:
+            shard = self._conn.execute('SELECT book_id, attempts FROM shards WHERE id = ? AND status = ? AND worker = ?',
+                                       (shard_id, SHARD_CLAIMED, worker)).fetchone()
+            if shard is None:
+                self._conn.execute('COMMIT')
+                return False
+            if shard['attempts'] >= max_attempts:
+                self._conn.execute('UPDATE shards SET status = ?, error = ? WHERE id = ?', (SHARD_FAILED, error, shard_id))
+                self._conn.execute('UPDATE books SET status = ?, error = ? WHERE id = ?',
+                                   (BOOK_FAILED, f"Shard {shard_id} failed: {error}", shard['book_id']))
+            else:
+                self._conn.execute('UPDATE shards SET status = ?, error = ? WHERE id = ?', (SHARD_PENDING, error, shard_id))
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        return True
+
+    # Function to claim a book whose shards are all done, or whose merge lease ran out; None if there is none
+    def claim_merge(self):
+        now = time.time()
+        self._transaction()
+        try:
+            row = self._conn.execute(
+                'SELECT id FROM books WHERE (status = ? AND NOT EXISTS'
+                ' (SELECT 1 FROM shards WHERE shards.book_id = books.id AND shards.status != ?))'
+                ' OR (status = ? AND claimed_at < ?)'
+                ' ORDER BY id LIMIT 1', (BOOK_QUEUED, SHARD_DONE, BOOK_MERGING, now - lease_sec)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute('UPDATE books SET status = ?, claimed_at = ? WHERE id = ?', (BOOK_MERGING, now, row['id']))
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        book = dict(self._conn.execute('SELECT * FROM books WHERE id = ?', (row['id'],)).fetchone())
+        book['settings'] = json.loads(book['settings'])
+        return book
+
+    def finish_book(self, book_id, error=None):
+        self._conn.execute('UPDATE books SET status = ?, error = ? WHERE id = ?',
+                           (BOOK_FAILED if error else BOOK_DONE, error, book_id))
+
+    def shard_rows_paths(self, book_id):
+        return [row['rows_path'] for row in self._conn.execute(
+            'SELECT rows_path FROM shards WHERE book_id = ? ORDER BY first_page', (book_id,))]
+
+    # Function to tell whether any book still has shards to translate or is waiting to be merged
+    def has_unfinished_work(self):
+        return self._conn.execute('SELECT 1 FROM books WHERE status IN (?, ?) LIMIT 1',
+                                  (BOOK_QUEUED, BOOK_MERGING)).fetchone() is not None
+
+    def progress(self):
+        shards = dict(self._conn.execute('SELECT status, COUNT(*) FROM shards GROUP BY status').fetchall())
+        books = dict(self._conn.execute('SELECT status, COUNT(*) FROM books GROUP BY status').fetchall())
+        return {'books': books, 'shards': shards}
+
+    def failed_books(self):
+        return [dict(row) for row in self._conn.execute('SELECT input_path, error FROM books WHERE status = ?', (BOOK_FAILED,))]
+
+    def close(self):
+        self._conn.close()
+
+# Function to write a shard's (sentence, translation) rows; written to a temporary file first,
+# so a crashed worker never leaves a half-written shard behind
+def write_shard_rows(path, rows):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        for sentence, translation in rows:
+            file.write(json.dumps([sentence, translation], ensure_ascii=False) + '\n')
+    os.replace(temporary_path, path)
+
+# Function to read a book's shard row files in page order, numbering rows across the whole book
+def iter_book_rows(rows_paths):
+    number = 0
+    for path in rows_paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                sentence, translation = json.loads(line)
+                number += 1
+                yield number, sentence, translation
+
+# Function to print when a shard update was refused because another worker took the shard over; returns updated
+def report_lost_lease(worker, shard, updated):
+    if not updated:
+        print(f"[{worker}] Lease on {shard['input_path']} pages {shard['first_page'] + 1}-{shard['last_page']} ran out;"
+              " another worker took the shard over, so this result is dropped")
+        metrics.count('batch.lost_leases')
+    return updated
+
+# Function to process the queue until no work is left. translate_shard(shard) returns the shard's
+# (sentence, translation) rows; render_book(book, rows) renders (number, sentence, translation) rows.
+def run_worker(queue, translate_shard, render_book, worker=None):
+    worker = worker or make_worker_id()
+    while True:
+        book = queue.claim_merge()
+        if book:
+            print(f"[{worker}] Merging {book['input_path']} into {book['output_pdf']}")
+            try:
+                render_book(book, iter_book_rows(queue.shard_rows_paths(book['id'])))
+                queue.finish_book(book['id'])
+            except Exception as e:
+                print(f"[{worker}] Merging {book['input_path']} failed: {e}")
+                queue.finish_book(book['id'], str(e))
+            continue
+
+        shard = queue.claim_shard(worker)
+        if shard:
+            print(f"[{worker}] Translating {shard['input_path']} pages {shard['first_page'] + 1}-{shard['last_page']}")
+            try:
+                rows = translate_shard(shard)
+                failed = sum(1 for _, translation in rows if translation.startswith('[Translation Error'))
+                if failed:
+                    # Finished rows are in the translation memory, so a retry only sends the failed ones
+                    report_lost_lease(worker, shard, queue.fail_shard(shard['id'], f"{failed} rows failed to translate", worker))
+                    metrics.count('batch.shards_failed')
+                    continue
+                rows_path = os.path.join(queue.directory, f"book{shard['book_id']}-pages{shard['first_page'] + 1:05d}-{worker}.jsonl")
+                write_shard_rows(rows_path, rows)
+                if report_lost_lease(worker, shard, queue.complete_shard(shard['id'], rows_path, worker)):
+                    metrics.count('batch.shards_done')
+            except Exception as e:
+                print(f"[{worker}] Shard failed: {e}")
+                report_lost_lease(worker, shard, queue.fail_shard(shard['id'], str(e), worker))
+                metrics.count('batch.shards_failed')
+            continue
+
+        if not queue.has_unfinished_work():
+            return
+        time.sleep(poll_interval_sec)  # Other workers are still busy with the last shards or a merge
+
+# Function to run a worker in a process of its own and write its metrics next to the queue
+def run_worker_process(queue_directory, translate_shard, render_book, setup=None):
+    if setup:
+        setup()
+    worker = make_worker_id()
+    metrics.reset()
+    queue = JobQueue(queue_directory)
+    try:
+        run_worker(queue, translate_shard, render_book, worker)
+    finally:
+        queue.close()
+        metrics.write(os.path.join(queue_directory, f"metrics-{worker}.json"))
+
+# Function to run `count` local worker processes on the queue and wait for them
+def run_local_workers(queue_directory, count, translate_shard, render_book, setup=None):
+    if count <= 1:
+        run_worker_process(queue_directory, translate_shard, render_book, setup)
+        return
+    import multiprocessing
+    processes = [multiprocessing.Process(target=run_worker_process, args=(queue_directory, translate_shard, render_book, setup))
+                 for _ in range(count)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+# Function to add the batch options shared by the translator scripts
+def add_batch_arguments(parser):
+    parser.add_argument('--batch', action='store_true', help="queue every source file as page-range shards and process the queue without prompts")
+    parser.add_argument('--worker', action='store_true', help="only work on an existing queue (e.g. from another machine sharing the queue directory)")
+    parser.add_argument('--workers', type=int, default=1, help="number of local worker processes (default: 1)")
+    parser.add_argument('--queue', default=queue_dir, help=f"queue directory (default: {queue_dir})")
+
+# Function to print how the queue ended up
+def report_queue(queue_directory):
+    queue = JobQueue(queue_directory)
+    print("Batch queue:", queue.progress())
+    for book in queue.failed_books():
+        print(f"Failed: {book['input_path']}: {book['error']}")
+    queue.close()
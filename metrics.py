@@ -0,0 +1,240 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Run metrics shared by the scripts and helper modules: wall time per stage, API latency
+# histograms, counters (retries, characters sent and billed, cache hits) and optional profiles.
+
+metrics_path = 'run_metrics.json'  # Where the scripts write their metrics at the end of a run
+profile_dir = 'Profiles'  # cProfile dumps of profiled stages go here
+live_interval_sec = 5  # Default interval for --live-metrics
+progress_interval_sec = 2  # Shortest time between two progress lines; per-window and per-batch lines in between are dropped
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # Upper bounds in seconds; slower requests land in "+Inf"
+
+class LatencyHistogram:
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        idx = 0
+        while idx < len(self.buckets) and seconds > self.buckets[idx]:
+            idx += 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    # Function to estimate a quantile as the upper bound of the bucket it falls in
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (self.max,), self.counts):
+            seen += count
+            if seen >= target:
+                return round(min(bound, self.max), 4)
+        return round(self.max, 4)
+
+    def to_dict(self):
+        labels = [f"<={bound}" for bound in self.buckets] + ['+Inf']
+        return {
+            'count': self.count,
+            'mean_sec': round(self.total / self.count, 4) if self.count else None,
+            'p50_sec': self.quantile(0.5),
+            'p95_sec': self.quantile(0.95),
+            'max_sec': round(self.max, 4),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+class RunMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}
+            self.counters = {}
+            self.latencies = {}
+            self.profiles = {}
+            self.profile_stages = set()
+            self._profilers = {}
+            self._live_stop = None
+            self._last_progress = None
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'seconds': 0.0, 'calls': 0})
+            entry['seconds'] += seconds
+            entry['calls'] += 1
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # Function to print a progress line, at most once every progress_interval_sec.
+    # Counters and --live-metrics carry the full picture; these lines only show the run is moving.
+    def progress(self, message):
+        now = time.monotonic()
+        with self._lock:
+            if self._last_progress is not None and now - self._last_progress < progress_interval_sec:
+                return
+            self._last_progress = now
+        print(message)
+
+    # Function to record one API request: latency, outcome and characters sent and billed
+    def observe_request(self, engine, seconds, ok=True, characters=0, billed=None):
+        with self._lock:
+            self.latencies.setdefault(engine, LatencyHistogram()).observe(seconds)
+        self.count(f"requests.{engine}")
+        if not ok:
+            self.count(f"errors.{engine}")
+        if characters:
+            self.count(f"chars_sent.{engine}", characters)
+        if billed is not None:
+            self.count(f"chars_billed.{engine}", billed)
+
+    # Context manager timing a stage; also profiles it when the stage was selected with --profile
+    @contextmanager
+    def stage(self, name):
+        profiler = self._start_profile(name) if name in self.profile_stages else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+            if profiler:
+                self._finish_profile(name, profiler)
+
+    # Function to wrap a function so every call adds to a stage's wall time
+    def timed(self, name, function):
+        def timed_function(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return timed_function
+
+    # Function to time a generator stage: only the time spent producing items is counted,
+    # which includes the stages it pulls from
+    def timed_iter(self, name, items):
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def _start_profile(self, name):
+        import cProfile
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        with self._lock:
+            profiler = self._profilers.setdefault(name, cProfile.Profile())
+        profiler.enable()
+        return profiler
+
+    def _finish_profile(self, name, profiler):
+        import tracemalloc
+        profiler.disable()
+        peak = tracemalloc.get_traced_memory()[1]
+        with self._lock:
+            profile = self.profiles.setdefault(name, {'calls': 0, 'memory_peak_bytes': 0})
+            profile['calls'] += 1
+            profile['memory_peak_bytes'] = max(profile['memory_peak_bytes'], peak)
+
+    # Function to dump the collected profiles; a stage run many times is profiled across all its calls
+    def finish_profiles(self):
+        import io
+        import pstats
+        import tracemalloc
+        if not self._profilers:
+            return
+        top_allocations = tracemalloc.take_snapshot().statistics('lineno')[:10] if tracemalloc.is_tracing() else []
+        tracemalloc.stop()
+        os.makedirs(profile_dir, exist_ok=True)
+        for name, profiler in self._profilers.items():
+            dump_path = os.path.join(profile_dir, f"{name}.prof")
+            profiler.dump_stats(dump_path)
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(15)
+            with self._lock:
+                profile = self.profiles.setdefault(name, {'calls': 0, 'memory_peak_bytes': 0})
+                profile['cprofile_dump'] = dump_path
+                profile['top_functions'] = report.getvalue().strip().splitlines()[-15:]
+                profile['retained_allocations'] = [str(statistic) for statistic in top_allocations]
+        self._profilers = {}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'elapsed_sec': round(time.time() - self.started, 3),
+                'stages': {name: {'seconds': round(entry['seconds'], 4), 'calls': entry['calls']}
+                           for name, entry in self.stages.items()},
+                'counters': dict(self.counters),
+                'api_latency': {engine: histogram.to_dict() for engine, histogram in self.latencies.items()},
+                'profiles': dict(self.profiles),
+            }
+
+    def write(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+    # Function to write a one-line JSON snapshot to stderr every interval seconds until stop_live()
+    def start_live(self, interval=live_interval_sec, stream=None):
+        stop = threading.Event()
+        self._live_stop = stop
+
+        def report():
+            while not stop.wait(interval):
+                print(json.dumps(self.snapshot()), file=stream or sys.stderr, flush=True)
+
+        threading.Thread(target=report, daemon=True).start()
+
+    def stop_live(self):
+        if self._live_stop:
+            self._live_stop.set()
+            self._live_stop = None
+
+metrics = RunMetrics()
+
+# Function to add the metrics options shared by the translator scripts
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics', default=metrics_path, metavar='PATH',
+                        help=f"write run metrics as JSON to PATH at the end of the run (default: {metrics_path})")
+    parser.add_argument('--live-metrics', type=float, nargs='?', const=live_interval_sec, metavar='SECONDS',
+                        help="also print a JSON metrics line to stderr every SECONDS while running")
+    parser.add_argument('--profile', action='append', default=[], metavar='STAGE',
+                        help=f"profile a stage (e.g. extraction, translation, rendering) with cProfile and tracemalloc; dumps go to {profile_dir}/")
+
+# Function to set up metrics from the parsed options at the start of a run
+def start_run(args):
+    metrics.reset()
+    metrics.profile_stages = set(args.profile)
+    if args.live_metrics:
+        metrics.start_live(args.live_metrics)
+
+# Function to write the metrics at the end of a run
+def finish_run(args):
+    metrics.stop_live()
+    metrics.finish_profiles()
+    if args.metrics:
+        metrics.write(args.metrics)
+        print(f"Run metrics written to {args.metrics}")
@@ -0,0 +1,147 @@
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.request import Request, urlopen
+
+# Local stand-ins for the DeepL REST API and the Gemini generateContent API, for benchmarks
+# and offline runs. "Translations" are the source text upper-cased, so output stays checkable.
+
+mock_character_limit = 500000  # Character allowance reported by the mock /v2/usage endpoint
+
+class MockBackendHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real services
+
+    def log_message(self, *args):
+        pass  # Keep benchmark output readable
+
+    def send_json(self, status, payload, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1  # One handler per connection, so this counts connections, not requests
+
+    def read_body(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    # Function to wait out the simulated latency and decide whether this request fails.
+    # Returns True if an error reply was sent.
+    def simulate(self):
+        server = self.server
+        time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        with server.lock:
+            server.requests += 1
+        if random.random() < server.error_rate:
+            with server.lock:
+                server.errors += 1
+            status = random.choice(server.error_statuses)
+            self.send_json(status, {'message': 'Simulated failure'}, [('Retry-After', '1')] if status == 429 else ())
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path.startswith('/v2/usage'):
+            with self.server.lock:
+                used = self.server.characters
+            self.send_json(200, {'character_count': used, 'character_limit': self.server.character_limit})
+        else:
+            self.send_json(404, {'message': 'Not found'})
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path.startswith('/v2/translate'):
+            self.translate_deepl(body)
+        elif re.search(r':generateContent$', self.path.split('?')[0]):
+            self.generate_gemini(body)
+        else:
+            self.send_json(404, {'message': 'Not found'})
+
+    def translate_deepl(self, body):
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            texts = json.loads(body)['text']
+        else:
+            texts = parse_qs(body.decode('utf-8')).get('text', [])
+        if self.simulate():
+            return
+        characters = sum(len(text) for text in texts)
+        with self.server.lock:
+            over_quota = self.server.characters + characters > self.server.character_limit
+            if not over_quota:
+                self.server.characters += characters
+        if over_quota:
+            self.send_json(456, {'message': 'Quota exceeded'})
+            return
+        self.send_json(200, {'translations': [
+            {'detected_source_language': 'EN', 'text': text.upper(), 'billed_characters': len(text)} for text in texts
+        ]})
+
+    def generate_gemini(self, body):
+        request = json.loads(body)
+        prompt = ''.join(part.get('text', '') for content in request.get('contents', []) for part in content.get('parts', []))
+        if self.simulate():
+            return
+        if '\n\nInput: ' in prompt:
+            # Packed prompt: answer with the numbered JSON array gemini_packing expects
+            items = json.loads(prompt.rsplit('\n\nInput: ', 1)[1])
+            text = json.dumps([{'id': item['id'], 'translation': item['text'].upper()} for item in items], ensure_ascii=False)
+        else:
+            text = prompt.rsplit('Text: ', 1)[-1].upper()
+        with self.server.lock:
+            self.server.characters += len(prompt)
+        self.send_json(200, {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}}]})
+
+# Function to start the mock backends on a local port in a background thread.
+# latency and jitter are in seconds; error_rate is the share of requests answered with an error status.
+def start_mock_server(latency=0.0, jitter=0.0, error_rate=0.0, error_statuses=(429, 503),
+                      character_limit=mock_character_limit, port=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockBackendHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.error_statuses = tuple(error_statuses)
+    server.character_limit = character_limit
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.errors = 0
+    server.connections = 0
+    server.characters = 0
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class MockGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+# Minimal client with the generate_content() call the GENAI translator uses, speaking the
+# Gemini REST wire format to a mock server instead of going through the Google SDK
+class MockGeminiModel:
+    def __init__(self, base_url, model_name='gemini-1.5-flash', timeout=60):
+        self.url = f"{base_url}/v1beta/models/{model_name}:generateContent"
+        self.timeout = timeout
+
+    def generate_content(self, prompt, generation_config=None):
+        payload = {'contents': [{'role': 'user', 'parts': [{'text': prompt}]}]}
+        if generation_config:
+            payload['generationConfig'] = {'responseMimeType': generation_config.get('response_mime_type', 'text/plain')}
+        request = Request(self.url, data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'})
+        with urlopen(request, timeout=self.timeout) as response:
+            reply = json.loads(response.read())
+        return MockGeminiResponse(reply['candidates'][0]['content']['parts'][0]['text'])
@@ -0,0 +1,112 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from cache_eviction import evict_lru
+from metrics import metrics
+
+default_cache_path = 'page_cache.sqlite3'
+default_max_bytes = 100 * 1024 * 1024  # Evict least recently used pages above this compressed size
+hash_block_size = 1024 * 1024
+
+# Function to hash a file's contents, so a renamed or copied PDF still hits the cache
+# and an edited one never does
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(hash_block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# On-disk cache of extracted page text keyed by PDF content hash, extractor and page number.
+# Page texts are stored zlib-compressed; page counts and auto mode's backend choice are kept per PDF as well.
+class PageCache:
+    def __init__(self, path=default_cache_path, max_bytes=default_max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None  # Running estimate of the stored bytes; only recounted when it passes max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            ' pdf_hash TEXT, extractor TEXT, page INTEGER, text BLOB, size INTEGER, last_used REAL,'
+            ' PRIMARY KEY (pdf_hash, extractor, page))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS documents (pdf_hash TEXT PRIMARY KEY, page_count INTEGER)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS auto_extractors (pdf_hash TEXT PRIMARY KEY, extractor TEXT)')
+        self._conn.commit()
+
+    # Function to return the cached page count of a PDF, or None
+    def page_count(self, pdf_hash):
+        with self._lock:
+            row = self._conn.execute('SELECT page_count FROM documents WHERE pdf_hash = ?', (pdf_hash,)).fetchone()
+        return row[0] if row else None
+
+    def store_page_count(self, pdf_hash, page_count):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO documents VALUES (?, ?)', (pdf_hash, page_count))
+            self._conn.commit()
+
+    # Function to return the backend extractor auto mode chose for a PDF earlier, or None
+    def auto_extractor(self, pdf_hash):
+        with self._lock:
+            row = self._conn.execute('SELECT extractor FROM auto_extractors WHERE pdf_hash = ?', (pdf_hash,)).fetchone()
+        return row[0] if row else None
+
+    def store_auto_extractor(self, pdf_hash, extractor):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO auto_extractors VALUES (?, ?)', (pdf_hash, extractor))
+            self._conn.commit()
+
+    # Function to look up many pages at once; returns {page: text} for the pages that are cached
+    def lookup_many(self, pdf_hash, extractor, pages):
+        pages = list(pages)
+        found = {}
+        now = time.time()
+        with self._lock:
+            for page in pages:
+                row = self._conn.execute(
+                    'SELECT text FROM pages WHERE pdf_hash = ? AND extractor = ? AND page = ?',
+                    (pdf_hash, extractor, page)
+                ).fetchone()
+                if row:
+                    found[page] = zlib.decompress(row[0]).decode('utf-8')
+            if found:
+                self._conn.executemany(
+                    'UPDATE pages SET last_used = ? WHERE pdf_hash = ? AND extractor = ? AND page = ?',
+                    [(now, pdf_hash, extractor, page) for page in found]
+                )
+            self._conn.commit()
+        self.hits += len(found)
+        self.misses += len(pages) - len(found)
+        metrics.count('page_cache.hits', len(found))
+        metrics.count('page_cache.misses', len(pages) - len(found))
+        return found
+
+    # Function to store extracted pages ({page: text}) and evict old pages when over the size limit
+    def store_many(self, pdf_hash, extractor, page_texts):
+        now = time.time()
+        rows = []
+        for page, text in page_texts.items():
+            compressed = zlib.compress(text.encode('utf-8'))
+            rows.append((pdf_hash, extractor, page, compressed, len(compressed), now))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._evict(sum(row[-2] for row in rows))
+            self._conn.commit()
+
+    def _evict(self, added):
+        self._size, evicted = evict_lru(self._conn, 'pages', self.max_bytes, self._size, added)
+        self.evictions += evicted
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def close(self):
+        self._conn.close()
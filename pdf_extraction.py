@@ -0,0 +1,302 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from page_cache import PageCache, file_digest
+
+EXTRACTOR_PDFPLUMBER = 'pdfplumber'
+EXTRACTOR_PYPDF2 = 'PyPDF2'
+EXTRACTOR_AUTO = 'auto'  # Sample a few pages and pick the fastest backend whose text is good enough
+
+min_pages_per_process = 8  # Smaller documents are not worth the process start-up cost
+chunks_per_process = 4  # More, smaller page ranges keep all processes busy until the end
+cache_store_pages = 20  # Newly extracted pages are written to the page cache in groups of this many
+auto_sample_pages = 4  # Pages with a text layer that auto mode extracts with every backend
+auto_min_quality = 0.9  # Share of the best backend's quality score (and text length) a backend must reach
+
+text_show_operator = re.compile(rb'[)>\]]\s*(?:Tj|TJ|\'|")')  # A string or array followed by an operator that shows it
+
+# Function to tell whether page content shows any text, looking into the form XObjects it draws too.
+# Scanned and blank pages show none. Only content streams are decoded, no layout is done,
+# so this is much cheaper than extracting.
+def shows_text(resources, contents, depth=0):
+    if text_show_operator.search(contents):
+        return True
+    if depth >= 3:
+        return False
+    resources = resolve(resources) or {}
+    xobjects = resolve(resources.get('/XObject', resources.get('XObject'))) or {}
+    for xobject in xobjects.values():
+        xobject = resolve(xobject)
+        stream_dict = getattr(xobject, 'attrs', xobject)  # pdfminer streams keep their dictionary in .attrs
+        subtype = resolve(stream_dict.get('/Subtype', stream_dict.get('Subtype')))
+        subtype = getattr(subtype, 'name', subtype)  # pdfminer names are PSLiterals
+        if isinstance(subtype, bytes):
+            subtype = subtype.decode('latin-1')
+        if str(subtype).lstrip('/') == 'Form':
+            if shows_text(stream_dict.get('/Resources', stream_dict.get('Resources')), xobject.get_data(), depth + 1):
+                return True
+    return False
+
+# Function to follow indirect references of either PDF library
+def resolve(value):
+    if hasattr(value, 'get_object'):
+        return value.get_object()  # PyPDF2
+    if hasattr(value, 'resolve'):
+        return value.resolve()  # pdfminer
+    return value
+
+# Function to triage a page before extracting it; a page that cannot be read is assumed to have text
+def has_text_layer(resources, content_streams):
+    try:
+        contents = b'\n'.join(resolve(stream).get_data() for stream in content_streams)
+        return shows_text(resources, contents)
+    except Exception:
+        return True
+
+# Extraction backend built on pdfplumber: slower, keeps reading order and spacing well
+class PdfplumberBackend:
+    name = EXTRACTOR_PDFPLUMBER
+
+    def count_pages(self, pdf_path):
+        import pdfplumber
+        with pdfplumber.open(pdf_path) as pdf:
+            return len(pdf.pages)
+
+    # Function to yield the text of the given pages, in the order given; pages without a text layer yield ''
+    def iter_page_texts(self, pdf_path, page_numbers):
+        import pdfplumber
+        with pdfplumber.open(pdf_path) as pdf:
+            for page_num in page_numbers:
+                page = pdf.pages[page_num]
+                if not has_text_layer(page.page_obj.resources, page.page_obj.contents):
+                    yield ''
+                    continue
+                yield page.extract_text() or ''
+                page.close()  # Drop the cached layout objects of finished pages
+
+# Extraction backend built on PyPDF2: fast, but may run words together on some layouts
+class PyPDF2Backend:
+    name = EXTRACTOR_PYPDF2
+
+    def count_pages(self, pdf_path):
+        import PyPDF2
+        with open(pdf_path, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+
+    def iter_page_texts(self, pdf_path, page_numbers):
+        import PyPDF2
+        with open(pdf_path, 'rb') as file:
+            reader = PyPDF2.PdfReader(file)
+            for page_num in page_numbers:
+                page = reader.pages[page_num]
+                contents = page.get_contents()
+                if not has_text_layer(page.get('/Resources'), [contents] if contents is not None else []):
+                    yield ''
+                    continue
+                yield page.extract_text() or ''
+
+extraction_backends = {backend.name: backend for backend in (PdfplumberBackend(), PyPDF2Backend())}
+
+# Function to count the pages of a PDF with the chosen extractor
+def count_pages(pdf_path, extractor=EXTRACTOR_PDFPLUMBER):
+    if extractor == EXTRACTOR_AUTO:
+        extractor = EXTRACTOR_PYPDF2  # Any backend counts the same pages; PyPDF2 does it fastest
+    return extraction_backends[extractor].count_pages(pdf_path)
+
+# Function to yield the text of pages [start, end) one page at a time; pages without text yield ''
+def iter_page_range(pdf_path, start, end, extractor=EXTRACTOR_PDFPLUMBER):
+    return extraction_backends[resolve_extractor(pdf_path, extractor)].iter_page_texts(pdf_path, range(start, end))
+
+# Function to score how much extracted text looks like real words, from 0 to 1. Backends that run
+# words together or break them into single letters produce many implausible tokens.
+def text_quality(text):
+    words = [word.strip('.,;:!?"\'()[]{}«»“”‘’-–—…') for word in text.split()]
+    words = [word for word in words if word]
+    if not words:
+        return 0.0
+    plausible = sum(
+        1 for word in words
+        if (word.isalpha() and (2 <= len(word) <= 20 or word.lower() in ('a', 'i', 'å', 'ø', 'y', 'o', 'e')))
+        or word.replace('.', '').replace(',', '').isdigit()
+    )
+    return plausible / len(words)
+
+# Function to pick up to auto_sample_pages pages with a text layer, spread over the whole PDF
+def sample_page_numbers(pdf_path):
+    import PyPDF2
+    with open(pdf_path, 'rb') as file:
+        pages = PyPDF2.PdfReader(file).pages
+        step = max(1, len(pages) // (auto_sample_pages * 2))
+        candidates = []
+        for page_num in range(0, len(pages), step):
+            contents = pages[page_num].get_contents()
+            if has_text_layer(pages[page_num].get('/Resources'), [contents] if contents is not None else []):
+                candidates.append(page_num)
+    step = max(1, len(candidates) // auto_sample_pages)
+    return candidates[::step][:auto_sample_pages]
+
+auto_choices = {}  # (path, size, mtime) -> backend chosen by auto mode in this process
+
+# Function to pick the backend for a PDF: time every backend on the same sample pages and take the
+# fastest whose quality score and text length come within auto_min_quality of the best
+def choose_extractor(pdf_path):
+    import time
+
+    stat = os.stat(pdf_path)
+    key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+    if key in auto_choices:
+        return auto_choices[key]
+
+    sample = sample_page_numbers(pdf_path)
+    if not sample:
+        auto_choices[key] = EXTRACTOR_PYPDF2  # No page has text; nothing will be extracted anyway
+        return EXTRACTOR_PYPDF2
+    results = {}
+    for name, backend in extraction_backends.items():
+        start = time.perf_counter()
+        text = '\n'.join(backend.iter_page_texts(pdf_path, sample))
+        results[name] = (time.perf_counter() - start, text_quality(text), len(''.join(text.split())))
+
+    best_quality = max(quality for _, quality, _ in results.values())
+    most_text = max(length for _, _, length in results.values())
+    good = [name for name, (_, quality, length) in results.items()
+            if quality >= auto_min_quality * best_quality and length >= auto_min_quality * most_text]
+    choice = min(good or results, key=lambda name: results[name][0])
+    print("Extractor auto mode:", ", ".join(
+        f"{name} {seconds:.2f}s quality {quality:.2f}" for name, (seconds, quality, _) in results.items()), "->", choice)
+    auto_choices[key] = choice
+    return choice
+
+# Function to turn EXTRACTOR_AUTO into a concrete backend name; other names are returned as they are
+def resolve_extractor(pdf_path, extractor):
+    if extractor == EXTRACTOR_AUTO:
+        return choose_extractor(pdf_path)
+    return extractor
+
+# Function to extract the text of pages [start, end); runs inside a worker process.
+# Returns the page texts in page order.
+def extract_page_range(pdf_path, start, end, extractor=EXTRACTOR_PDFPLUMBER):
+    return list(iter_page_range(pdf_path, start, end, extractor))
+
+# Function to split pages [0, page_count) into contiguous ranges
+def split_page_ranges(page_count, chunk_count):
+    chunk_count = max(1, min(chunk_count, page_count))
+    size, remainder = divmod(page_count, chunk_count)
+    ranges = []
+    start = 0
+    for idx in range(chunk_count):
+        end = start + size + (1 if idx < remainder else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+# Function to extract the first `page_limit` pages with a process pool.
+# Returns one text per page, in page order. With cache_path, see iter_pages.
+def extract_pages_parallel(pdf_path, page_limit=None, extractor=EXTRACTOR_PDFPLUMBER, max_processes=None, cache_path=None):
+    if cache_path:
+        return [text for _, text in iter_pages(pdf_path, page_limit, extractor, max_processes, cache_path)]
+    extractor = resolve_extractor(pdf_path, extractor)
+    page_count = count_pages(pdf_path, extractor)
+    if page_limit is not None:
+        page_count = min(page_count, page_limit)
+    if page_count == 0:
+        return []
+
+    max_processes = max_processes or os.cpu_count() or 1
+    processes = min(max_processes, page_count // min_pages_per_process)
+    if processes <= 1:
+        return extract_page_range(pdf_path, 0, page_count, extractor)
+
+    ranges = split_page_ranges(page_count, processes * chunks_per_process)
+    page_texts = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(extract_page_range, pdf_path, start, end, extractor) for start, end in ranges]
+        # Collect in submission order so the text is reassembled in page order
+        for future in futures:
+            page_texts.extend(future.result())
+    return page_texts
+
+# Function to yield (page_num, text) for pages [first_page, page_limit), in page order.
+# extractor is a backend name or EXTRACTOR_AUTO; pages without a text layer yield '' without being extracted.
+# With several processes, a bounded number of page ranges is extracted ahead of the consumer,
+# so later pages are extracted while earlier ones are already being translated.
+# With cache_path, pages found in the page cache are not extracted again and new pages are added to it.
+def iter_pages(pdf_path, page_limit=None, extractor=EXTRACTOR_PDFPLUMBER, max_processes=None, cache_path=None, first_page=0):
+    if cache_path:
+        yield from iter_cached_pages(pdf_path, page_limit, extractor, max_processes, cache_path, first_page)
+        return
+    extractor = resolve_extractor(pdf_path, extractor)  # Worker processes need the concrete backend
+    page_count = count_pages(pdf_path, extractor)
+    if page_limit is not None:
+        page_count = min(page_count, page_limit)
+    yield from iter_page_span(pdf_path, first_page, page_count, extractor, max_processes)
+
+# Function to yield (page_num, text) for pages [start, end), in a process pool if the span is long enough
+def iter_page_span(pdf_path, start, end, extractor=EXTRACTOR_PDFPLUMBER, max_processes=None):
+    max_processes = max_processes or os.cpu_count() or 1
+    processes = min(max_processes, (end - start) // min_pages_per_process)
+    if processes <= 1:
+        yield from enumerate(iter_page_range(pdf_path, start, end, extractor), start)
+        return
+
+    ranges = [(start + first, start + last) for first, last in split_page_ranges(end - start, processes * chunks_per_process)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        in_flight = []
+        for range_start, range_end in ranges:
+            in_flight.append((range_start, executor.submit(extract_page_range, pdf_path, range_start, range_end, extractor)))
+            if len(in_flight) > processes:
+                first, future = in_flight.pop(0)
+                for offset, text in enumerate(future.result()):
+                    yield first + offset, text
+        for first, future in in_flight:
+            for offset, text in enumerate(future.result()):
+                yield first + offset, text
+
+# Function to yield (page_num, text) like iter_pages, taking pages from the page cache where it has them.
+# Only runs of pages the cache has not seen are extracted, e.g. the new pages after raising the page limit.
+def iter_cached_pages(pdf_path, page_limit, extractor, max_processes, cache_path, first_page=0):
+    cache = PageCache(cache_path)
+    try:
+        pdf_hash = file_digest(pdf_path)
+        if extractor == EXTRACTOR_AUTO:
+            # Cache entries are per backend, so the choice is remembered and later runs hit the same entries
+            extractor = cache.auto_extractor(pdf_hash)
+            if extractor is None:
+                extractor = choose_extractor(pdf_path)
+                cache.store_auto_extractor(pdf_hash, extractor)
+        page_count = cache.page_count(pdf_hash)
+        if page_count is None:
+            page_count = count_pages(pdf_path, extractor)
+            cache.store_page_count(pdf_hash, page_count)
+        if page_limit is not None:
+            page_count = min(page_count, page_limit)
+        cached = cache.lookup_many(pdf_hash, extractor, range(first_page, page_count))
+
+        page = first_page
+        while page < page_count:
+            if page in cached:
+                yield page, cached[page]
+                page += 1
+                continue
+            run_end = page
+            while run_end < page_count and run_end not in cached:
+                run_end += 1
+            fresh = {}
+            try:
+                for page_num, text in iter_page_span(pdf_path, page, run_end, extractor, max_processes):
+                    fresh[page_num] = text
+                    if len(fresh) >= cache_store_pages:
+                        cache.store_many(pdf_hash, extractor, fresh)
+                        fresh = {}
+                    yield page_num, text
+            finally:
+                # Pages extracted before an interruption are kept too
+                cache.store_many(pdf_hash, extractor, fresh)
+            page = run_end
+    finally:
+        cache.close()
+
+# Function to add the --extractor option shared by the translator scripts
+def add_extraction_arguments(parser):
+    parser.add_argument('--extractor', choices=sorted(extraction_backends) + [EXTRACTOR_AUTO],
+                        help="PDF text extraction backend; auto samples a few pages and picks the fastest one whose text is good enough")
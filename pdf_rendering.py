@@ -0,0 +1,212 @@
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from types import SimpleNamespace
+from streaming import windows
+from metrics import metrics
+
+render_chunk_rows = 100  # Table rows laid out per reportlab Table while streaming
+render_part_rows = 1000  # Table rows rendered into each part file by a worker process
+manifest_name = 'manifest.json'  # Per output PDF: which rows went into which part and onto which output pages
+
+# A flowable list that pulls the next flowable from a generator whenever it runs empty.
+# reportlab's build loop checks len(flowables) before every step, so only the table
+# chunk currently being laid out is held in memory.
+class FlowableStream(list):
+    def __init__(self, flowables):
+        super().__init__()
+        self._source = iter(flowables)
+
+    def __len__(self):
+        if not list.__len__(self):
+            flowable = next(self._source, None)
+            if flowable is not None:
+                self.append(flowable)
+        return list.__len__(self)
+
+# Function to build a document from a stream of flowables instead of a full list
+def build_streaming(doc, flowables, **build_kwargs):
+    doc.build(FlowableStream(flowables), **build_kwargs)
+
+# Cache of rendered part files for one output PDF, keyed by the part's rows, its first row number,
+# the part arguments and the script that renders it. Unchanged parts are reused on a re-run, so only
+# the parts whose rows changed are laid out again. Parts the latest render did not use are removed.
+class RenderCache:
+    def __init__(self, cache_dir, output_pdf, render_part, part_args=()):
+        output_path = os.path.abspath(output_pdf)
+        name = os.path.splitext(os.path.basename(output_path))[0]
+        self.directory = os.path.join(cache_dir, f"{name}-{hashlib.sha1(output_path.encode('utf-8')).hexdigest()[:8]}")
+        os.makedirs(self.directory, exist_ok=True)
+        self.fingerprint = render_fingerprint(render_part, part_args)
+        self.hits = 0
+        self.misses = 0
+
+    # Function to return (path, cached) for a part; a part that is not cached should be rendered to path
+    def part_path(self, first_row, rows):
+        digest = hashlib.sha256(self.fingerprint.encode('utf-8'))
+        digest.update(repr(first_row).encode('utf-8'))
+        for row in rows:
+            digest.update(repr(row).encode('utf-8'))
+        path = os.path.join(self.directory, f"{digest.hexdigest()}.pdf")
+        cached = os.path.exists(path)
+        if cached:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return path, cached
+
+    # Function to return the part files with the footer stamped on. Page numbers run on across parts,
+    # so a stamped part is reused only while the parts before it keep their page count.
+    def stamp_parts(self, part_paths, footer):
+        from PyPDF2 import PdfReader, PdfWriter
+
+        stamped_paths = []
+        first_page = 1
+        for path in part_paths:
+            pages = PdfReader(path).pages
+            stamped_path = f"{os.path.splitext(path)[0]}-page{first_page}.pdf"
+            if not os.path.exists(stamped_path):
+                stamp_footer(pages, footer, first_page)
+                writer = PdfWriter()
+                for page in pages:
+                    writer.add_page(page)
+                with open(f"{stamped_path}.tmp", 'wb') as file:
+                    writer.write(file)
+                os.replace(f"{stamped_path}.tmp", stamped_path)
+            stamped_paths.append(stamped_path)
+            first_page += len(pages)
+        return stamped_paths
+
+    # Function to write the manifest of the latest render and remove the files it no longer uses.
+    # parts holds (first_row, row_count, path, page_count) in output order; used_paths lists any other files merged.
+    def finish(self, parts, used_paths=()):
+        entries = []
+        first_page = 1
+        for first_row, row_count, path, page_count in parts:
+            entries.append({'first_row': first_row + 1, 'last_row': first_row + row_count,
+                            'first_page': first_page, 'last_page': first_page + page_count - 1,
+                            'file': os.path.basename(path)})
+            first_page += page_count
+        with open(os.path.join(self.directory, manifest_name), 'w', encoding='utf-8') as file:
+            json.dump({'parts': entries}, file, indent=2)
+        used = {entry['file'] for entry in entries} | {os.path.basename(path) for path in used_paths}
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.pdf') and file_name not in used:
+                os.remove(os.path.join(self.directory, file_name))
+        metrics.count('render_cache.hits', self.hits)
+        metrics.count('render_cache.misses', self.misses)
+        print(f"Reused {self.hits} of {self.hits + self.misses} rendered parts")
+
+# Function to fingerprint what shapes a part besides its rows: the render function, its arguments, the
+# file it is defined in, this module and the reportlab version, so editing a script's layout or settings,
+# the shared rendering code or upgrading reportlab never reuses stale parts
+def render_fingerprint(render_part, part_args):
+    import reportlab
+
+    digest = hashlib.sha256(repr((render_part.__qualname__, part_args, reportlab.Version)).encode('utf-8'))
+    # The calling script's layout code, and this module's chunking, styles and stamping
+    source_paths = [getattr(sys.modules.get(render_part.__module__), '__file__', None), __file__]
+    for source_path in source_paths:
+        if source_path and os.path.exists(source_path):
+            with open(source_path, 'rb') as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+# Function to render rows into part files in worker processes and merge them into output_pdf.
+# render_part(part_path, rows, first_row, *part_args) must be a module-level function so it can
+# be sent to a worker; first_row lets it continue numbering styles such as alternating backgrounds.
+# Every part starts on a new page. The footer, if any, is stamped after merging so page
+# numbers run through the whole document. With cache_dir, unchanged parts come from a RenderCache;
+# with max_processes=1, parts are rendered in this process.
+def render_parallel(rows, render_part, output_pdf, part_rows=render_part_rows, max_processes=None, footer=None, part_args=(),
+                    cache_dir=None):
+    max_processes = max_processes or os.cpu_count() or 1
+    cache = RenderCache(cache_dir, output_pdf, render_part, part_args) if cache_dir else None
+    with tempfile.TemporaryDirectory() as part_dir:
+        parts = []  # (first_row, row_count, final path)
+        rendered = []  # (temporary path, cache path) of parts rendered this time
+        pending = set()
+        executor = ProcessPoolExecutor(max_workers=max_processes) if max_processes > 1 else None
+        try:
+            for idx, part in enumerate(windows(rows, part_rows)):
+                first_row = idx * part_rows
+                part_path = os.path.join(part_dir, f"part{idx:05d}.pdf")
+                if cache:
+                    cache_path, cached = cache.part_path(first_row, part)
+                    parts.append((first_row, len(part), cache_path))
+                    if cached:
+                        continue
+                    rendered.append((part_path, cache_path))
+                else:
+                    parts.append((first_row, len(part), part_path))
+                if executor is None:
+                    render_part(part_path, part, first_row, *part_args)
+                    continue
+                pending.add(executor.submit(render_part, part_path, part, first_row, *part_args))
+                # Hold back the row stream while every worker is busy, so memory stays bounded
+                while len(pending) >= max_processes * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+            for future in pending:
+                future.result()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        # Parts go into the cache only once they are complete, so an interrupted render never leaves a broken part behind
+        for part_path, cache_path in rendered:
+            os.replace(part_path, cache_path)
+        merge_paths = [path for _, _, path in parts]
+        if cache and footer:
+            # Stamping the footer costs more than laying out unchanged parts would save, so stamped parts are cached too
+            merge_paths = cache.stamp_parts(merge_paths, footer)
+            page_counts = merge_parts(merge_paths, output_pdf)
+        else:
+            page_counts = merge_parts(merge_paths, output_pdf, footer)
+    if cache:
+        cache.finish([(first_row, row_count, path, page_count)
+                      for (first_row, row_count, path), page_count in zip(parts, page_counts)], merge_paths)
+
+# Function to concatenate part files in order, optionally stamping a footer on every page.
+# Returns the number of pages each part contributed.
+def merge_parts(part_paths, output_pdf, footer=None):
+    from PyPDF2 import PdfReader, PdfWriter
+
+    page_counts = []
+    pages = []
+    for part_path in part_paths:
+        part_pages = PdfReader(part_path).pages
+        page_counts.append(len(part_pages))
+        pages.extend(part_pages)
+    if footer:
+        stamp_footer(pages, footer)
+    writer = PdfWriter()
+    for page in pages:
+        writer.add_page(page)
+    with open(output_pdf, 'wb') as file:
+        writer.write(file)
+    return page_counts
+
+# Function to draw footer(canvas, doc) on an overlay page per document page and merge it in.
+# Pages are stamped before they are added to the writer, so their contents are written out properly.
+# first_page is the page number the footer sees on the first of the pages.
+def stamp_footer(pages, footer, first_page=1):
+    from PyPDF2 import PdfReader
+    from reportlab.pdfgen import canvas
+
+    buffer = io.BytesIO()
+    overlay = canvas.Canvas(buffer)
+    overlay._pageNumber = first_page  # reportlab has no public setter; getPageNumber() counts on from here
+    for page in pages:
+        pagesize = (float(page.mediabox.width), float(page.mediabox.height))
+        overlay.setPageSize(pagesize)
+        footer(overlay, SimpleNamespace(pagesize=pagesize))
+        overlay.showPage()
+    overlay.save()
+    buffer.seek(0)
+    for page, overlay_page in zip(pages, PdfReader(buffer).pages):
+        page.merge_page(overlay_page)
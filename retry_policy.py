@@ -0,0 +1,236 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from metrics import metrics
+
+# Shared retry policy for the DeepL (SDK and REST) and Gemini paths: exponential backoff with
+# jitter, Retry-After on 429, a circuit breaker for 456/5xx bursts and adaptive concurrency.
+# A call either returns its result or raises its last error, so callers keep one row per sentence.
+
+max_attempts = 6  # Tries per request, including the first
+base_delay_sec = 0.5  # Backoff before the first retry; doubles on every further retry
+max_delay_sec = 30  # Longest backoff between two tries
+breaker_threshold = 5  # Consecutive 456/5xx replies that open the circuit breaker
+breaker_cooldown_sec = 15  # How long an open breaker holds requests back before letting one probe through
+max_breaker_cooldown_sec = 120  # The cooldown doubles each time a probe fails, up to this
+
+ERROR_THROTTLED = 'throttled'  # 429: slow down and wait at least Retry-After
+ERROR_QUOTA = 'quota'  # 456: the character quota is used up; not retried
+ERROR_SERVER = 'server'  # 5xx: retried, and counted towards the circuit breaker
+ERROR_NETWORK = 'network'  # Connection errors and timeouts: retried
+ERROR_FATAL = 'fatal'  # Anything else, e.g. 400 or 403: not retried
+
+# Function to find the HTTP status code of an error from requests, urllib, the DeepL SDK or google-api-core
+def status_code_of(error):
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        status = getattr(error, 'http_status_code', None)  # DeepL SDK
+    if status is None and isinstance(getattr(error, 'code', None), int):
+        status = error.code  # urllib HTTPError and google-api-core errors
+    return status
+
+# Function to read a Retry-After header (seconds or an HTTP date) from an error, or None
+def retry_after_of(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None)
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Function to sort an error into one of the ERROR_ kinds
+def classify(error):
+    status = status_code_of(error)
+    if status == 429:
+        return ERROR_THROTTLED
+    if status == 456:
+        return ERROR_QUOTA
+    if status is not None and status >= 500:
+        return ERROR_SERVER
+    if status is None and is_network_error(error):
+        return ERROR_NETWORK
+    return ERROR_FATAL
+
+def is_network_error(error):
+    import socket
+    from urllib.error import URLError
+    if isinstance(error, (ConnectionError, TimeoutError, socket.timeout, URLError)):
+        return True
+    try:
+        import requests
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+    except ImportError:
+        pass
+    return bool(getattr(error, 'should_retry', False))  # DeepL SDK ConnectionException
+
+# Concurrency limit that halves when the API throttles and grows by one after a limit's worth of
+# successes in a row (additive increase, multiplicative decrease)
+class AdaptiveConcurrency:
+    def __init__(self, max_limit):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify()
+
+    # Requests already in flight when the API starts throttling fail together; they count as one signal
+    def on_throttle(self, window=1.0):
+        with self._condition:
+            now = time.monotonic()
+            self._successes = 0
+            if now - self._last_decrease >= window and self.limit > 1:
+                self.limit = max(1, self.limit // 2)
+                self._last_decrease = now
+
+# Circuit breaker over consecutive 456/5xx replies. While open, requests wait instead of failing,
+# then a single probe goes through; its success closes the breaker, its failure reopens it for longer.
+class CircuitBreaker:
+    def __init__(self, threshold=breaker_threshold, cooldown=breaker_cooldown_sec, max_cooldown=max_breaker_cooldown_sec):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.open_until = None  # None while closed
+        self.probing = False
+        self._lock = threading.Lock()
+
+    # Function to return how long to wait before sending, or 0 if this caller may send now
+    def wait_time(self):
+        with self._lock:
+            if self.open_until is None:
+                return 0
+            remaining = self.open_until - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self.probing:
+                return min(1.0, self.base_cooldown)  # Another caller is probing; check again shortly
+            self.probing = True
+            return 0
+
+    def on_success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_until = None
+            self.probing = False
+            self.cooldown = self.base_cooldown
+
+    # Function to record a 456/5xx reply; returns True if the breaker opened because of it
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing:
+                self.probing = False
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self.open_until = time.monotonic() + self.cooldown
+                return True
+            if self.open_until is None and self.failures >= self.threshold:
+                self.open_until = time.monotonic() + self.cooldown
+                return True
+            return False
+
+    # Function to let another caller probe when this probe failed for a reason the breaker does not count
+    def release_probe(self):
+        with self._lock:
+            self.probing = False
+
+class RetryPolicy:
+    def __init__(self, engine, max_concurrency=1, attempts=max_attempts, base_delay=base_delay_sec, max_delay=max_delay_sec,
+                 breaker=None):
+        self.engine = engine
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.breaker = breaker or CircuitBreaker()
+        self.hold_until = 0.0  # Set from Retry-After, so every worker waits it out, not just the throttled one
+        self._lock = threading.Lock()
+
+    # Function to return the backoff before retry number `retry` (1-based), with full jitter
+    def backoff(self, retry):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+
+    def _wait_turn(self):
+        while True:
+            with self._lock:
+                hold = self.hold_until - time.monotonic()
+            wait = max(hold, self.breaker.wait_time())
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    # Function to call function(*args, **kwargs) under the policy; returns its result or raises the last error
+    def call(self, function, *args, **kwargs):
+        retry = 0
+        while True:
+            self._wait_turn()
+            self.concurrency.acquire()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as error:
+                kind = classify(error)
+                delay = self._on_error(error, kind, retry + 1)
+                if delay is None:
+                    raise
+                retry += 1
+            else:
+                self.breaker.on_success()
+                self.concurrency.on_success()
+                return result
+            finally:
+                self.concurrency.release()
+            metrics.count(f"retries.{self.engine}")
+            time.sleep(delay)
+
+    # Function to update the breaker and concurrency after an error and return the delay before
+    # the next try, or None if the error should be raised
+    def _on_error(self, error, kind, retry):
+        if kind in (ERROR_QUOTA, ERROR_SERVER):
+            if self.breaker.on_failure():
+                metrics.count(f"circuit_open.{self.engine}")
+                print(f"{self.engine}: {self.breaker.failures} failed requests in a row, pausing requests for {self.breaker.cooldown:.0f} s")
+        else:
+            self.breaker.release_probe()
+        if kind == ERROR_THROTTLED:
+            metrics.count(f"throttled.{self.engine}")
+            self.concurrency.on_throttle()
+        if kind in (ERROR_QUOTA, ERROR_FATAL) or retry >= self.attempts:
+            return None
+        delay = self.backoff(retry)
+        retry_after = retry_after_of(error) if kind == ERROR_THROTTLED else None
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.base_delay)  # Spread out the workers resuming together
+            with self._lock:
+                self.hold_until = max(self.hold_until, time.monotonic() + retry_after)
+        print(f"{self.engine}: {type(error).__name__} ({kind}), retry {retry} of {self.attempts - 1} in {delay:.1f} s")
+        return delay
@@ -0,0 +1,33 @@
+# Compact holder for numbered segments and their translations; replaces the pandas DataFrame.
+# Rows are kept in two parallel lists and numbered from 1 on the fly. The optional page index
+# says where the source pages ended, for rendering page markers that were never translated.
+class SegmentStore:
+    __slots__ = ('sentences', 'translations', 'page_index')
+
+    def __init__(self, sentences=(), translations=None, page_index=None):
+        self.sentences = list(sentences)
+        self.translations = list(translations) if translations is not None else [''] * len(self.sentences)
+        self.page_index = page_index
+
+    def __len__(self):
+        return len(self.sentences)
+
+    # Function to set the translations column; must line up with the sentences
+    def set_translations(self, translations):
+        translations = list(translations)
+        if len(translations) != len(self.sentences):
+            raise ValueError(f"Got {len(translations)} translations for {len(self.sentences)} sentences")
+        self.translations = translations
+
+    # Function to yield (number, sentence, translation) rows, the shape the PDF renderers take
+    def rows(self):
+        return zip(range(1, len(self.sentences) + 1), self.sentences, self.translations)
+
+    # Function to yield rows with the page markers put back into the source text, if there is a page index
+    def marked_rows(self, format_marker):
+        if self.page_index is None:
+            return self.rows()
+        return self.page_index.mark_rows(self.rows(), format_marker)
+
+    def __iter__(self):
+        return self.rows()
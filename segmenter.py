@@ -0,0 +1,209 @@
+import bisect
+import re
+from collections import deque
+
+# Single-pass sentence segmenter for streams of cleaned text chunks. Page markers are lifted out
+# of the text into a PageIndex, so they are never sent for translation but can still be rendered.
+
+RULE_PUNCTUATION = 'punctuation'  # Split after . ! or ? followed by a space
+RULE_SPEAKER_TAGS = 'speaker-tags'  # Split before speaker tags like 'JAMES:' or 'JAMES (with a grin):'
+
+boundary_patterns = {
+    RULE_PUNCTUATION: re.compile(r'(?<=[.!?]) +'),
+    RULE_SPEAKER_TAGS: re.compile(r'(?=\b[A-Z]{3,}(?:\s*\([^)]*\))?:\s)'),
+}
+
+# Words that end with a period without ending the sentence (compared lowercased, without the period)
+common_abbreviations = frozenset((
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'ft', 'vs', 'etc', 'cf', 'approx',
+    'vol', 'vols', 'fig', 'figs', 'pp', 'ch', 'chap', 'dept', 'inc', 'ltd', 'corp', 'gen', 'col',
+    'lt', 'sgt', 'capt', 'rev', 'hon', 'gov', 'pres', 'ave', 'rd', 'blvd',
+    'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+))
+
+scan_lookback = 200  # Carried characters re-scanned when a chunk arrives, so split points across chunks are found
+marker_holdback = 64  # Characters held back from a chunk's end in case a page marker continues in the next chunk
+
+# Function to tell whether the word before a period is an abbreviation or an initial ("J.", "e.g.")
+def is_abbreviation(word):
+    word = word.lstrip('(["\'“‘')
+    if len(word) == 1:
+        return word.isupper() and word not in 'AI'  # Initials, but not the words "A" and "I"
+    word = word.lower()
+    return word in common_abbreviations or re.fullmatch(r'(?:[a-z]\.)+[a-z]', word) is not None
+
+# Page breaks by segment: where in which segment each page ended, in reading order
+class PageIndex:
+    def __init__(self):
+        self.breaks = []  # (segment number, offset in segment, page number)
+
+    def record(self, number, offset, page):
+        self.breaks.append((number, offset, page))
+
+    # Function to list the (offset, page) breaks inside one segment
+    def breaks_in(self, number):
+        low = bisect.bisect_left(self.breaks, (number,))
+        high = bisect.bisect_left(self.breaks, (number + 1,))
+        return [(offset, page) for _, offset, page in self.breaks[low:high]]
+
+    # Function to return the page a segment starts on, or None if its page has not ended yet
+    def page_of(self, number):
+        idx = bisect.bisect_right(self.breaks, (number, 0, float('inf')))
+        return self.breaks[idx][2] if idx < len(self.breaks) else None
+
+    # Function to put the page markers back into a segment's text for display
+    def mark(self, number, sentence, format_marker):
+        for offset, page in reversed(self.breaks_in(number)):
+            sentence = f"{sentence[:offset].rstrip()} {format_marker(page)} {sentence[offset:].lstrip()}".strip()
+        return sentence
+
+    # Function to mark the source text of a stream of (number, sentence, translation) rows
+    def mark_rows(self, rows, format_marker):
+        for number, sentence, translation in rows:
+            yield number, self.mark(number, sentence, format_marker), translation
+
+class Segmenter:
+    # page_marker is a regex with one group for the page number; matches are removed from the text.
+    # Segments shorter than min_length are appended to the one before (or dropped at the start with drop_leading).
+    def __init__(self, rule=RULE_PUNCTUATION, page_marker=None, min_length=6, drop_leading=False, page_index=None):
+        self.rule = rule
+        self.boundary = boundary_patterns[rule]
+        self.page_marker = re.compile(r'\s*' + page_marker + r'\s*') if page_marker else None
+        self.min_length = min_length if rule == RULE_PUNCTUATION else 0
+        self.drop_leading = drop_leading
+        self.page_index = page_index if page_index is not None else PageIndex()
+        self._breaks = deque()  # (offset in the marker-free text, page number) not yet given to a segment
+
+    # Function to yield the segments of a stream of cleaned text chunks, recording page breaks as it goes
+    def segment(self, chunks):
+        number = 0
+        previous = None  # Held back one segment, so page breaks after the last text still have a home
+        for current in self._merge(self._split(self._strip_markers(chunks))):
+            if previous is not None:
+                number += 1
+                yield self._emit(number, previous)
+            previous = current
+        if previous is not None:
+            number += 1
+            yield self._emit(number, previous, last=True)
+
+    def _emit(self, number, segment, last=False):
+        start, end, text = segment
+        while self._breaks and (last or self._breaks[0][0] <= end):
+            offset, page = self._breaks.popleft()
+            self.page_index.record(number, min(max(offset - start, 0), len(text)), page)
+        return text
+
+    # Function to remove page markers from the chunks, remembering where each one was
+    def _strip_markers(self, chunks):
+        if self.page_marker is None:
+            yield from chunks
+            return
+        held = ''
+        length = 0  # Marker-free characters yielded so far
+        ends_with_space = True  # At the start of the stream nothing may begin with a space
+        for chunk in chunks:
+            text = held + chunk
+            cleaned, cut, length, ends_with_space = self._remove_markers(text, len(text) - marker_holdback, length, ends_with_space)
+            held = text[cut:]
+            if cleaned:
+                yield cleaned
+        if held:
+            cleaned, _, length, ends_with_space = self._remove_markers(held, len(held), length, ends_with_space)
+            if cleaned:
+                yield cleaned
+
+    def _remove_markers(self, text, cut, length, ends_with_space):
+        parts = []
+        position = 0
+        for match in self.page_marker.finditer(text):
+            if match.start() >= max(cut, 0):
+                break
+            before = text[position:match.start()]
+            if ends_with_space:
+                before = before.lstrip(' ')
+            if before:
+                parts.append(before)
+                length += len(before)
+                ends_with_space = before.endswith(' ')
+            self._breaks.append((length, int(match.group(1))))
+            if not ends_with_space:
+                parts.append(' ')
+                length += 1
+                ends_with_space = True
+            position = match.end()
+        cut = max(cut, position, 0)
+        rest = text[position:cut]
+        if ends_with_space:
+            rest = rest.lstrip(' ')
+        if rest:
+            parts.append(rest)
+            length += len(rest)
+            ends_with_space = rest.endswith(' ')
+        return ''.join(parts), cut, length, ends_with_space
+
+    # Function to find split points in one pass, carrying undecided text into the next chunk.
+    # Yields (start, end, text) with offsets into the marker-free text.
+    def _split(self, pieces):
+        carry = ''
+        base = 0  # Offset of carry[0] in the marker-free text
+        scanned = 0  # Carried characters already scanned
+        for piece in pieces:
+            carry += piece
+            segment_start = 0
+            for match in self.boundary.finditer(carry, max(0, scanned - scan_lookback)):
+                if match.start() < segment_start:
+                    continue
+                decision = self._is_boundary(carry, match)
+                if decision is None:
+                    break  # Depends on text that has not arrived yet
+                if decision:
+                    segment = self._segment(carry, segment_start, match.start(), base)
+                    if segment:
+                        yield segment
+                    segment_start = match.end()
+            carry = carry[segment_start:]
+            base += segment_start
+            scanned = len(carry)
+        segment = self._segment(carry, 0, len(carry), base)
+        if segment:
+            yield segment
+
+    # Function to decide whether a boundary match is a real split point; None if more text is needed
+    def _is_boundary(self, text, match):
+        if self.rule == RULE_SPEAKER_TAGS:
+            return True
+        if match.end() >= len(text):
+            return None  # Trailing spaces: the split waits until the next chunk shows text follows
+        mark = match.start() - 1
+        if text[mark] == '.':
+            word_start = text.rfind(' ', 0, mark) + 1
+            if is_abbreviation(text[word_start:mark]):
+                return False
+        return True
+
+    def _segment(self, text, start, end, base):
+        stripped = text[start:end]
+        if self.rule == RULE_SPEAKER_TAGS:
+            start += len(stripped) - len(stripped.lstrip())
+            stripped = stripped.strip()
+        else:
+            stripped = stripped.rstrip()
+        if not stripped:
+            return None
+        return base + start, base + start + len(stripped), stripped
+
+    # Function to append segments shorter than min_length to the one before
+    def _merge(self, segments):
+        pending = None  # [start, end, parts]
+        for start, end, text in segments:
+            if len(text) < self.min_length and (pending is not None or self.drop_leading):
+                if pending is not None:
+                    pending[1] = end
+                    pending[2].append(text)
+                continue
+            if pending is not None:
+                yield pending[0], pending[1], ' '.join(pending[2])
+            pending = [start, end, [text]]
+        if pending is not None:
+            yield pending[0], pending[1], ' '.join(pending[2])
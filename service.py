@@ -0,0 +1,268 @@
+import json
+import os
+import re
+import socketserver
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import metrics
+
+# Long-running local translation service. A translator script stays loaded, so its engine client,
+# connection pool, translation memory and caches are warm for every job. Clients submit jobs as JSON
+# over HTTP (TCP or a Unix socket), and poll them for progress and the result:
+#
+#   POST /jobs        {"input_path": "SourcePDFs/book.pdf", "target_lang": "DA", ...}  -> the new job
+#   GET  /jobs        every job, newest first
+#   GET  /jobs/<id>   one job: status, pages and rows done, output PDF and error
+#   GET  /status      queue counts and run metrics
+
+service_host = '127.0.0.1'
+service_port = 8765
+parallel_jobs = 2  # Jobs translated at the same time; the rest wait in the queue
+max_finished_jobs = 200  # Finished jobs kept for polling; older ones are forgotten
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+class ServiceJob:
+    def __init__(self, job_id, settings):
+        self.id = job_id
+        self.settings = settings
+        self.status = JOB_QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.pages_total = None
+        self.pages_done = 0
+        self.rows_done = 0
+        self.failed_rows = 0
+        self.outputs = []
+        self.error = None
+        self._lock = threading.Lock()
+
+    # Function to count pages (or chunks) as the pipeline pulls them
+    def track_pages(self, pages):
+        for page in pages:
+            with self._lock:
+                self.pages_done += 1
+            yield page
+
+    # Function to count (number, sentence, translation) rows as they come out of translation
+    def track_rows(self, rows):
+        for row in rows:
+            translations = row[2] if isinstance(row[2], tuple) else (row[2],)
+            with self._lock:
+                self.rows_done += 1
+                if any(translation.startswith('[Translation Error') for translation in translations):
+                    self.failed_rows += 1
+            yield row
+
+    def to_dict(self):
+        with self._lock:
+            end = self.finished or time.time()
+            return {
+                'id': self.id,
+                'status': self.status,
+                'settings': self.settings,
+                'pages_total': self.pages_total,
+                'pages_done': self.pages_done,
+                'rows_done': self.rows_done,
+                'failed_rows': self.failed_rows,
+                'outputs': list(self.outputs),
+                'error': self.error,
+                'queued_sec': round((self.started or end) - self.submitted, 3),
+                'running_sec': round(end - self.started, 3) if self.started else None,
+            }
+
+# Runs submitted jobs from an internal queue, parallel_jobs at a time.
+# prepare_job(settings) validates a job and fills in defaults, raising ValueError for a bad job;
+# run_job(job) translates and renders it, reporting progress through the job's track_ functions.
+class TranslationService:
+    def __init__(self, prepare_job, run_job, jobs=parallel_jobs):
+        self.prepare_job = prepare_job
+        self.run_job = run_job
+        self.started = time.time()
+        self.jobs = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='job')
+
+    def submit(self, settings):
+        settings = self.prepare_job(dict(settings))
+        with self._lock:
+            job = ServiceJob(self._next_id, settings)
+            self._next_id += 1
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+        self._executor.submit(self._run, job)
+        print(f"Job {job.id} queued: {settings.get('input_path')}")
+        return job
+
+    def _run(self, job):
+        job.status = JOB_RUNNING
+        job.started = time.time()
+        try:
+            self.run_job(job)
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = JOB_FAILED
+            metrics.count('service.jobs_failed')
+            print(f"Job {job.id} failed: {job.error}")
+        else:
+            job.status = JOB_DONE
+            metrics.count('service.jobs_done')
+            print(f"Job {job.id} done in {time.time() - job.started:.1f} s: {', '.join(job.outputs)}")
+        finally:
+            job.finished = time.time()
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in (JOB_DONE, JOB_FAILED)]
+        for job_id in finished[:max(0, len(finished) - max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job.to_dict() for job in reversed(jobs)]
+
+    def status(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        snapshot = metrics.snapshot()
+        return {'uptime_sec': round(time.time() - self.started, 1), 'jobs': counts,
+                'counters': snapshot['counters'], 'api_latency': snapshot['api_latency']}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass  # Job progress is printed by the service itself
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        path = self.path.split('?')[0].rstrip('/')
+        match = re.fullmatch(r'/jobs/(\d+)', path)
+        if path == '/jobs':
+            self.send_json(200, {'jobs': service.list()})
+        elif match:
+            job = service.get(int(match.group(1)))
+            if job is None:
+                self.send_json(404, {'error': f"No job {match.group(1)}"})
+            else:
+                self.send_json(200, job.to_dict())
+        elif path == '/status':
+            self.send_json(200, service.status())
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path.split('?')[0].rstrip('/') != '/jobs':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        try:
+            settings = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(settings, dict):
+                raise ValueError("The job must be a JSON object")
+            job = self.server.service.submit(settings)
+        except ValueError as e:  # Also covers malformed JSON
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(202, job.to_dict())
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.lexists(self.server_address):
+            # Only a socket left behind by a service that did not shut down cleanly is replaced
+            if not stat.S_ISSOCK(os.lstat(self.server_address).st_mode):
+                raise FileExistsError(f"{self.server_address} exists and is not a socket; choose another --socket path")
+            os.remove(self.server_address)
+        super().server_bind()
+
+# Function to run the service until interrupted. warm_up() is called once before the first job,
+# e.g. to create the engine client and import the PDF libraries.
+def serve(prepare_job, run_job, host=service_host, port=service_port, socket_path=None, jobs=parallel_jobs, warm_up=None):
+    if socket_path:
+        try:
+            server = UnixHTTPServer(socket_path, ServiceHandler)
+        except FileExistsError as e:
+            print(f"Not starting the translation service: {e}")
+            return
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), ServiceHandler)
+        server.daemon_threads = True
+        address = f"http://{host}:{server.server_port}"
+    service = None
+    try:
+        if warm_up:
+            warm_up()
+        service = TranslationService(prepare_job, run_job, jobs)
+        server.service = service
+        print(f"Translation service listening on {address} ({jobs} parallel jobs); Ctrl+C stops it")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping the translation service")
+    finally:
+        server.server_close()
+        if service:
+            service.shutdown()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+# Function to add the service options shared by the translator scripts
+def add_service_arguments(parser):
+    parser.add_argument('--serve', action='store_true', help="run as a local translation service that accepts jobs over HTTP")
+    parser.add_argument('--host', default=service_host, help=f"address to listen on with --serve (default: {service_host})")
+    parser.add_argument('--port', type=int, default=service_port, help=f"port to listen on with --serve (default: {service_port})")
+    parser.add_argument('--socket', metavar='PATH', help="listen on a Unix socket instead of a TCP port")
+    parser.add_argument('--parallel-jobs', type=int, default=parallel_jobs,
+                        help=f"jobs translated at the same time with --serve (default: {parallel_jobs})")
+
+# Function to read an optional boolean job setting
+def job_flag(settings, name, default=False):
+    value = settings.get(name, default)
+    if not isinstance(value, bool):
+        raise ValueError(f"{name} must be true or false")
+    return value
+
+# Function to read an optional positive integer job setting
+def job_limit(settings, name, default):
+    value = settings.get(name, default)
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+        raise ValueError(f"{name} must be a positive whole number")
+    return value
+
+# Function to check a job's input file and return its path
+def job_input_path(settings, extensions=('.pdf',)):
+    input_path = settings.get('input_path')
+    if not isinstance(input_path, str) or not input_path:
+        raise ValueError("input_path is required")
+    if not input_path.lower().endswith(extensions):
+        raise ValueError(f"input_path must be a {' or '.join(extensions)} file")
+    if not os.path.isfile(input_path):
+        raise ValueError(f"No such file: {input_path}")
+    return os.path.abspath(input_path)
@@ -0,0 +1,190 @@
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+stream_window = 200  # Sentences translated per window while the pipeline streams
+prefetch_size = 8  # Items a background stage may run ahead of its consumer
+stop_poll_sec = 0.1  # How often a stage blocked on a full buffer checks whether its consumer has gone
+
+_end_of_stream = object()
+
+class _StageFailure:
+    def __init__(self, error):
+        self.error = error
+
+# Function to put an item into a bounded buffer unless stop is set first; returns False if stopped
+def _put(buffer, item, stop):
+    while not stop.is_set():
+        try:
+            buffer.put(item, timeout=stop_poll_sec)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+# Function to close a generator stage, so it releases its worker pools, files and connections
+def _close(items):
+    close = getattr(items, 'close', None)
+    if close:
+        close()
+
+# Function to run a generator stage in a background thread, at most `size` items ahead.
+# Lets extraction and translation keep working while later stages consume earlier items.
+# If the consumer stops early (an error, or it closes this generator), the stage is stopped
+# and closed too, and its thread ends instead of waiting on a full buffer forever.
+def prefetch(items, size=prefetch_size):
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                if not _put(buffer, item, stop):
+                    break
+        except BaseException as e:
+            _put(buffer, _StageFailure(e), stop)
+        finally:
+            _close(items)
+            _put(buffer, _end_of_stream, stop)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _end_of_stream:
+                return
+            if isinstance(item, _StageFailure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+# Function to clean a stream of text chunks; same rules as clean_text, applied per chunk.
+# Whitespace runs that straddle two chunks still collapse to a single space.
+def clean_stream(chunks):
+    at_start = True
+    ends_with_space = False
+    for chunk in chunks:
+        cleaned = re.sub(r'\s+', ' ', chunk)
+        cleaned = cleaned.replace('\f', ';;;;')
+        if (at_start or ends_with_space) and cleaned.startswith(' '):
+            cleaned = cleaned[1:]
+        if not cleaned:
+            continue
+        at_start = False
+        ends_with_space = cleaned.endswith(' ')
+        yield cleaned
+
+# Function to group a stream into lists of at most `size` items
+def windows(items, size):
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+# Function to translate a sentence stream window by window.
+# Yields (number, sentence, translation) rows in sentence order. With a journal, sentences it
+# already holds are not sent again and every new translation is recorded as soon as its window is done.
+def translate_stream(sentences, translate_window, window_size=stream_window, journal=None):
+    number = 0
+    for window in windows(sentences, window_size):
+        numbers = range(number + 1, number + len(window) + 1)
+        number += len(window)
+        yield from zip(numbers, window, _translate_window(window, numbers, translate_window, journal))
+
+# Function to translate a sentence stream into several languages at once, window by window.
+# translate_windows has one translate_window function per language, and journals one journal
+# (or None) per language. Yields (number, sentence, translations) rows, where translations is a
+# tuple in the order of translate_windows. The languages of a window are translated concurrently.
+def translate_stream_multi(sentences, translate_windows, window_size=stream_window, journals=None):
+    journals = journals or [None] * len(translate_windows)
+    number = 0
+    with ThreadPoolExecutor(max_workers=len(translate_windows)) as executor:
+        for window in windows(sentences, window_size):
+            numbers = range(number + 1, number + len(window) + 1)
+            number += len(window)
+            futures = [executor.submit(_translate_window, window, numbers, translate_window, journal)
+                       for translate_window, journal in zip(translate_windows, journals)]
+            translations = [future.result() for future in futures]
+            yield from zip(numbers, window, zip(*translations))
+
+# Function to translate one window, taking what the journal already holds and recording the rest
+def _translate_window(window, numbers, translate_window, journal):
+    if journal is None:
+        return translate_window(window)
+    translations = [journal.lookup(n, sentence) for n, sentence in zip(numbers, window)]
+    missing = [idx for idx, translation in enumerate(translations) if translation is None]
+    metrics.count('journal.resumed', len(window) - len(missing))
+    if missing:
+        new_translations = translate_window([window[idx] for idx in missing])
+        for idx, translation in zip(missing, new_translations):
+            translations[idx] = translation
+            journal.record(numbers[idx], window[idx], translation)
+        journal.flush()
+    return translations
+
+# Function to feed one stream to several consumers, each running in its own thread.
+# Every consumer(items) gets all items in order; the stream is read once and each consumer may
+# run at most `size` items behind. Errors in a consumer are raised once all consumers have finished;
+# a failed consumer stops the stream being read further, so the others end early.
+def fan_out(items, consumers, size=prefetch_size):
+    buffers = [queue.Queue(maxsize=size) for _ in consumers]
+    errors = []
+    stop = threading.Event()
+
+    def consume(consumer, buffer):
+        finished = False
+
+        def drain():
+            nonlocal finished
+            while True:
+                item = buffer.get()
+                if item is _end_of_stream:
+                    finished = True
+                    return
+                yield item
+
+        try:
+            consumer(drain())
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            while not finished:
+                # Keep taking items after a consumer stops early, so the other consumers are not held up
+                finished = buffer.get() is _end_of_stream
+
+    threads = [threading.Thread(target=consume, args=(consumer, buffer), daemon=True)
+               for consumer, buffer in zip(consumers, buffers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for item in items:
+            if stop.is_set():
+                break
+            for buffer in buffers:
+                buffer.put(item)  # Every consumer keeps taking items until the end, even after failing
+    finally:
+        _close(items)
+        for buffer in buffers:
+            buffer.put(_end_of_stream)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+# Function to read a text file line by line, up to line_limit lines
+def iter_text_lines(file_path, line_limit=None):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for i, line in enumerate(file):
+            if line_limit is not None and i >= line_limit:
+                break
+            yield line
@@ -0,0 +1,67 @@
+import budget
+from budget import TranslationBudget, plan_budget, gate_window, BUDGET_ERROR
+
+# Ten segments of 100 characters, one per page
+sentences = [f"Segment {idx:02d} " + "x" * 89 for idx in range(1, 11)]
+
+def page_of(number):
+    return number
+
+def test_cap_stops_the_run_cleanly():
+    run_budget = TranslationBudget(max_characters=350)
+    sent = [run_budget.reserve([sentence]) for sentence in sentences]
+    assert sent == [True] * 3 + [False] * 7
+    assert run_budget.stopped
+    assert run_budget.spent == 300 <= run_budget.max_characters
+    # A failed request gives its characters back, but the run stays stopped
+    run_budget.release(100)
+    assert not run_budget.reserve(sentences[3:4])
+
+def test_cost_cap_is_converted_to_characters():
+    run_budget = TranslationBudget(max_cost=0.01, cost_per_million=20.0)
+    assert run_budget.max_characters == 500
+
+def test_plan_takes_priority_pages_first():
+    run_budget = TranslationBudget(max_characters=500)
+    billable, planned, blocked = plan_budget(sentences, run_budget, page_of, [(9, 10)])
+    assert (billable, planned) == (1000, 500)
+    # The priority pages and the start of the book fit; the rest is left out
+    assert blocked == {budget.normalize_text(sentence) for sentence in sentences[3:8]}
+    assert run_budget.held_total == 200
+    assert run_budget.remaining() == 300
+
+def test_priority_holds_survive_a_lower_account_cap(monkeypatch):
+    monkeypatch.setattr(budget, 'usage_check_sec', 0)
+    account = {'used': 0, 'limit': 1000}
+    run_budget = TranslationBudget(usage=lambda: (account['used'] + run_budget.spent, account['limit']))
+    plan_budget(sentences, run_budget, page_of, [(9, 10)])
+    assert run_budget.held_total == 200
+
+    assert run_budget.reserve(sentences[0:2])
+    account['used'] = 600  # Another job used most of the remaining quota
+    # 200 characters are left on the account, all of them held for the priority pages
+    assert not run_budget.reserve(sentences[2:3])
+    assert run_budget.stopped
+    assert run_budget.reserve(sentences[8:10])
+    assert run_budget.spent == 400
+    assert run_budget.held_total == 0
+
+def test_gate_window_keeps_rows_aligned():
+    blocked = {budget.normalize_text(sentences[1]), budget.normalize_text(sentences[3])}
+    sent = []
+
+    def translate_window(window):
+        sent.extend(window)
+        return [sentence.upper() for sentence in window]
+
+    translations = gate_window(translate_window, blocked)(sentences[:5])
+    assert sent == [sentences[0], sentences[2], sentences[4]]
+    assert translations == [sentences[0].upper(), BUDGET_ERROR, sentences[2].upper(), BUDGET_ERROR, sentences[4].upper()]
+
+def test_gate_window_sends_nothing_when_every_segment_is_blocked():
+    blocked = {budget.normalize_text(sentence) for sentence in sentences[:2]}
+
+    def translate_window(window):
+        raise AssertionError("nothing should be sent")
+
+    assert gate_window(translate_window, blocked)(sentences[:2]) == [BUDGET_ERROR] * 2
@@ -0,0 +1,46 @@
+import pytest
+from deepl_client import batch_sentences, encoded_size, translate_batched_sdk, max_texts_per_request
+from mock_backends import start_mock_server
+from segmenter import Segmenter, RULE_SPEAKER_TAGS
+
+deepl = pytest.importorskip('deepl')
+
+screenplay = (
+    "JAMES: Where were you last night? HERMIONE (with a grin): At the library, obviously. "
+    "JAMES: Again? RON: She lives there, mate. HERMIONE: Someone has to read the books. "
+)
+
+@pytest.fixture
+def server():
+    server = start_mock_server()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_batches_respect_text_limit():
+    sentences = [f"Sentence {idx}." for idx in range(123)]
+    batches = list(batch_sentences(sentences))
+    assert batches == [(0, 50), (50, 100), (100, 123)]
+
+def test_batches_respect_byte_limit():
+    sentences = ["x" * 300 for _ in range(20)]
+    max_bytes = 1024 + 4 * encoded_size(sentences[0])
+    batches = list(batch_sentences(sentences, max_bytes=max_bytes))
+    assert all(end - start == 4 for start, end in batches)
+    assert batches[0][0] == 0 and batches[-1][1] == len(sentences)
+    assert all(batches[idx][1] == batches[idx + 1][0] for idx in range(len(batches) - 1))
+
+def test_oversized_sentence_gets_its_own_batch():
+    sentences = ["short", "y" * 5000, "short"]
+    assert list(batch_sentences(sentences, max_bytes=2048)) == [(0, 1), (1, 2), (2, 3)]
+
+def test_rows_map_back_in_order_against_mock_endpoint(server):
+    sentences = list(Segmenter(RULE_SPEAKER_TAGS).segment([screenplay * 30]))
+    assert sentences[:3] == ["JAMES: Where were you last night?", "HERMIONE (with a grin): At the library, obviously.", "JAMES: Again?"]
+
+    translator = deepl.Translator('mock-key:fx', server_url=server.url)
+    translations = translate_batched_sdk(translator, sentences, 'EN', 'DA', max_workers=4)
+
+    # The mock "translates" by upper-casing, so every row must be its own source upper-cased
+    assert translations == [sentence.upper() for sentence in sentences]
+    assert server.requests == -(-len(sentences) // max_texts_per_request)
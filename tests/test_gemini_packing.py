@@ -0,0 +1,77 @@
+import json
+from gemini_packing import translate_packed, parse_packed_response, build_packed_prompt
+
+prompt_prefix = "Translate from EN to DA."
+
+# Local stand-in for the model: answers packed prompts with one item per input id, after
+# `corrupt` has had its way with the items, and single sentences with their upper-cased text
+class FakeModel:
+    def __init__(self, corrupt=None):
+        self.corrupt = corrupt
+        self.pack_sizes = []
+        self.singles = []
+
+    def generate_packed(self, prompt):
+        items = json.loads(prompt.rsplit('\n\nInput: ', 1)[1])
+        self.pack_sizes.append(len(items))
+        reply = [{'id': item['id'], 'translation': item['text'].upper()} for item in items]
+        if self.corrupt and len(reply) > 1:
+            reply = self.corrupt(reply)
+        return json.dumps(reply)
+
+    def generate_single(self, sentence):
+        self.singles.append(sentence)
+        return sentence.upper()
+
+def drop_id(reply):
+    return reply[:-1]
+
+def merge_ids(reply):
+    merged = {'id': reply[0]['id'], 'translation': reply[0]['translation'] + ' ' + reply[1]['translation']}
+    return [merged] + reply[2:]
+
+def invent_id(reply):
+    return reply[:-1] + [{'id': len(reply) + 7, 'translation': reply[-1]['translation']}]
+
+sentences = [f"Sentence number {idx} of the book." for idx in range(1, 9)]
+
+def translate(model):
+    return translate_packed(sentences, prompt_prefix, model.generate_packed, model.generate_single, token_budget=10000)
+
+def test_well_formed_packs_go_out_in_one_request():
+    model = FakeModel()
+    assert translate(model) == [sentence.upper() for sentence in sentences]
+    assert model.pack_sizes == [len(sentences)] and model.singles == []
+
+def test_dropped_id_splits_down_to_single_sentences():
+    model = FakeModel(drop_id)
+    assert translate(model) == [sentence.upper() for sentence in sentences]
+    assert model.pack_sizes == [8, 4, 2, 2, 4, 2, 2]
+    assert model.singles == sentences
+
+def test_merged_ids_split_down_to_single_sentences():
+    model = FakeModel(merge_ids)
+    assert translate(model) == [sentence.upper() for sentence in sentences]
+    assert model.singles == sentences
+
+def test_invented_id_splits_down_to_single_sentences():
+    model = FakeModel(invent_id)
+    assert translate(model) == [sentence.upper() for sentence in sentences]
+    assert model.singles == sentences
+
+def test_only_the_bad_half_is_split():
+    bad = sentences[5]
+    model = FakeModel(lambda reply: drop_id(reply) if any(item['translation'] == bad.upper() for item in reply) else reply)
+    assert translate(model) == [sentence.upper() for sentence in sentences]
+    assert model.singles == [sentences[4], bad]
+
+def test_parse_rejects_mismatched_replies():
+    batch = ["one", "two", "three"]
+    good = [{'id': 1, 'translation': 'EN'}, {'id': 2, 'translation': 'TO'}, {'id': 3, 'translation': 'TRE'}]
+    assert parse_packed_response(json.dumps(good), 3) == ['EN', 'TO', 'TRE']
+    assert parse_packed_response(f"```json\n{json.dumps(good[::-1])}\n```", 3) == ['EN', 'TO', 'TRE']
+    assert parse_packed_response(json.dumps(drop_id(good)), 3) is None
+    assert parse_packed_response(json.dumps(merge_ids(good)), 3) is None
+    assert parse_packed_response(json.dumps(good[:2] + [{'id': 9, 'translation': 'TRE'}]), 3) is None
+    assert parse_packed_response("not json", 3) is None
+    assert '"id": 3' in build_packed_prompt(prompt_prefix, batch)
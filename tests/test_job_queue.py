@@ -0,0 +1,26 @@
+import time
+import job_queue
+from job_queue import JobQueue
+
+def test_expired_lease_cannot_complete_or_fail(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path))
+    queue.add_book('book.pdf', 'book_translated.pdf', 10, pages_per_shard=10)
+    first = queue.claim_shard('worker-a')
+    monkeypatch.setattr(job_queue, 'lease_sec', 0)
+    time.sleep(0.01)
+    second = queue.claim_shard('worker-b')
+    assert second['id'] == first['id']
+
+    assert not queue.complete_shard(first['id'], 'stale.jsonl', 'worker-a')
+    assert not queue.fail_shard(first['id'], 'too slow', 'worker-a')
+    assert queue.complete_shard(second['id'], 'fresh.jsonl', 'worker-b')
+    assert queue.shard_rows_paths(first['book_id']) == ['fresh.jsonl']
+    queue.close()
+
+def test_failed_shard_goes_back_to_pending(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.add_book('book.pdf', 'book_translated.pdf', 10, pages_per_shard=10)
+    shard = queue.claim_shard('worker-a')
+    assert queue.fail_shard(shard['id'], 'rows failed', 'worker-a')
+    assert queue.claim_shard('worker-b')['id'] == shard['id']
+    queue.close()
@@ -0,0 +1,168 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from cache_eviction import evict_lru
+from metrics import metrics
+
+default_memory_path = 'translation_memory.sqlite3'
+default_max_bytes = 200 * 1024 * 1024  # Evict least recently used entries above this size
+
+# Engine names used as part of the cache key
+ENGINE_DEEPL_SDK = 'deepl-sdk'
+ENGINE_DEEPL_REST = 'deepl-rest'
+ENGINE_GEMINI = 'gemini-1.5-flash'
+
+# Function to normalize source text so trivial whitespace differences still hit the cache
+def normalize_text(text):
+    text = unicodedata.normalize('NFC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+# Failed translations are never cached so they get retried on the next run
+def is_error_translation(translation):
+    return translation is None or translation.startswith('[Translation Error')
+
+# On-disk translation memory keyed by normalized text, languages and engine
+class TranslationMemory:
+    def __init__(self, engine, source_language, target_language, path=default_memory_path, max_bytes=default_max_bytes):
+        self.engine = engine
+        self.source_language = source_language.upper()
+        self.target_language = target_language.upper()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None  # Running estimate of the stored bytes; only recounted when it passes max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)  # Batch workers share the file
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS translations ('
+            ' engine TEXT, source_lang TEXT, target_lang TEXT, source TEXT,'
+            ' translation TEXT, size INTEGER, last_used REAL,'
+            ' PRIMARY KEY (engine, source_lang, target_lang, source))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)')
+        self._conn.commit()
+
+    def _key(self, text, engine=None):
+        return (engine or self.engine, self.source_language, self.target_language, normalize_text(text))
+
+    # Function to look up many sentences at once; returns None for every miss.
+    # engine looks up another engine's translations than the memory's own.
+    def lookup_many(self, sentences, engine=None):
+        results = []
+        now = time.time()
+        with self._lock:
+            for sentence in sentences:
+                row = self._conn.execute(
+                    'SELECT translation FROM translations'
+                    ' WHERE engine = ? AND source_lang = ? AND target_lang = ? AND source = ?',
+                    self._key(sentence, engine)
+                ).fetchone()
+                if row:
+                    self.hits += 1
+                    self._conn.execute(
+                        'UPDATE translations SET last_used = ?'
+                        ' WHERE engine = ? AND source_lang = ? AND target_lang = ? AND source = ?',
+                        (now,) + self._key(sentence, engine)
+                    )
+                    results.append(row[0])
+                else:
+                    self.misses += 1
+                    results.append(None)
+            self._conn.commit()
+        return results
+
+    # Function to store finished translations and evict old entries when over the size limit.
+    # engines names the engine of each translation when several engines produced them.
+    def store_many(self, sentences, translations, engines=None):
+        now = time.time()
+        rows = []
+        for sentence, translation, engine in zip(sentences, translations, engines or [None] * len(sentences)):
+            if is_error_translation(translation):
+                continue
+            key = self._key(sentence, engine)
+            size = len(key[3].encode('utf-8')) + len(translation.encode('utf-8'))
+            rows.append(key + (translation, size, now))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self._evict(sum(row[-2] for row in rows))
+            self._conn.commit()
+
+    def _evict(self, added):
+        self._size, evicted = evict_lru(self._conn, 'translations', self.max_bytes, self._size, added)
+        self.evictions += evicted
+        if evicted:
+            metrics.count('memory.evictions', evicted)
+
+    # Function to translate through the memory: only misses are passed to translate_missing
+    def translate(self, sentences, translate_missing):
+        sentences = list(sentences)
+        translations = self.lookup_many(sentences)
+        missing = [idx for idx, translation in enumerate(translations) if translation is None]
+        metrics.progress(f"Translation memory: {len(sentences) - len(missing)} cached, {len(missing)} to translate")
+        metrics.count('memory.hits', len(sentences) - len(missing))
+        metrics.count('memory.misses', len(missing))
+        if missing:
+            missing_sentences = [sentences[idx] for idx in missing]
+            new_translations = translate_missing(missing_sentences)
+            for idx, translation in zip(missing, new_translations):
+                translations[idx] = translation
+            self.store_many(missing_sentences, new_translations)
+        return translations
+
+    # Function to translate through the memory when a router spreads the work over several engines.
+    # A translation cached by any of engine_names is reused, preferring earlier engines. translate_missing
+    # returns (translations, engines) for the misses, and every new translation is stored under the
+    # engine that produced it. Returns (translations, engines).
+    def translate_routed(self, sentences, engine_names, translate_missing):
+        sentences = list(sentences)
+        translations = [None] * len(sentences)
+        engines = [None] * len(sentences)
+        missing = list(range(len(sentences)))
+        for engine in engine_names:
+            if not missing:
+                break
+            found = self.lookup_many([sentences[idx] for idx in missing], engine)
+            self.misses -= sum(1 for translation in found if translation is None)  # Counted once below
+            still_missing = []
+            for idx, translation in zip(missing, found):
+                if translation is None:
+                    still_missing.append(idx)
+                else:
+                    translations[idx], engines[idx] = translation, engine
+            missing = still_missing
+        self.misses += len(missing)
+        metrics.progress(f"Translation memory: {len(sentences) - len(missing)} cached, {len(missing)} to translate")
+        metrics.count('memory.hits', len(sentences) - len(missing))
+        metrics.count('memory.misses', len(missing))
+        if missing:
+            missing_sentences = [sentences[idx] for idx in missing]
+            new_translations, new_engines = translate_missing(missing_sentences)
+            for idx, translation, engine in zip(missing, new_translations, new_engines):
+                translations[idx], engines[idx] = translation, engine
+            self.store_many(missing_sentences, new_translations, [engine or self.engine for engine in new_engines])
+        return translations, engines
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def close(self):
+        self._conn.close()
+
+shared_memories = {}  # (process, engine, languages, path) -> TranslationMemory, see get_shared_memory
+shared_memories_lock = threading.Lock()
+
+# Function to return one TranslationMemory per engine, language pair and file for the whole process, so every
+# window and parallel job shares its connection and running size total instead of reopening the file.
+# The process id is part of the key because a forked batch worker must not reuse its parent's connection.
+def get_shared_memory(engine, source_language, target_language, path=default_memory_path):
+    key = (os.getpid(), engine, source_language.upper(), target_language.upper(), path)
+    with shared_memories_lock:
+        if key not in shared_memories:
+            shared_memories[key] = TranslationMemory(engine, source_language, target_language, path=path)
+        return shared_memories[key]